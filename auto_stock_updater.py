@@ -3,7 +3,8 @@
 на основе данных из внешней базы данных (!YMWB.db → таблица prices).
 
 Основные шаги:
-- Загружает остатки и ОПТ из таблицы prices.
+- Обнуляет в prices остатки ниже порога поставщика (реестр suppliers, min_stock).
+- Выбирает поставщика для всех строк одним запросом (db.suppliers.fetch_best_suppliers).
 - Обновляет таблицы маркетплейсов в локальной базе marketplace_base.db.
 - Обнуляет остатки у выключенных товаров или тех, что не найдены в источнике.
 - Логирует основные этапы (без избыточных сообщений).
@@ -12,6 +13,8 @@
 import sqlite3
 from logger_config import logger
 from datetime import datetime
+from db.suppliers import fetch_best_suppliers, list_suppliers
+from services.pricing import calc_price, parse_number
 
 def update(flags):
     logger.info("🚀 Начато обновление остатков для маркетплейсов")
@@ -24,40 +27,32 @@ def update(flags):
 
     now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
 
-    # --- 1. Обнуление остатков <3 у внешних поставщиков ---
-    logger.info("⚙️ Проверка внешних поставщиков (Invask, Okno, United): остаток <3 → 0")
-    source_cursor.execute("""
+    # --- 1. Обнуление остатков ниже порога у внешних поставщиков (порог — из реестра) ---
+    registry = list_suppliers(target_conn)
+    thresholds = [(s["name"], s["min_stock"]) for s in registry if not s["preferred"] and s["min_stock"] > 1]
+    logger.info(
+        "⚙️ Проверка внешних поставщиков: "
+        + ", ".join(f"{name} <{limit} → 0" for name, limit in thresholds)
+    )
+    source_cursor.executemany("""
         UPDATE prices
            SET "Наличие" = 0
-         WHERE UPPER(TRIM("Поставщик")) IN ('INVASK', 'OKNO', 'UNITED')
-           AND CAST("Наличие" AS INTEGER) < 3
-    """)
+         WHERE UPPER(TRIM("Поставщик")) = UPPER(?)
+           AND CAST("Наличие" AS INTEGER) < ?
+           AND CAST("Наличие" AS INTEGER) <> 0
+    """, thresholds)
     affected = source_conn.total_changes
     source_conn.commit()
-    logger.info(f"🔧 Обнулено {affected} записей в !YMWB.db (остаток <3)")
+    source_conn.close()
+    logger.info(f"🔧 Обнулено {affected} записей в !YMWB.db (остаток ниже порога)")
 
-    # --- 2. Загрузка таблицы prices в память ---
-    source_cursor.execute("""SELECT "Поставщик", "Артикул", "Наличие", "ОПТ" FROM prices""")
-    source_data = source_cursor.fetchall()
-    logger.info(f"📥 Загружено {len(source_data)} строк из таблицы prices")
-
-    source_dict = {}
-    for supplier, article, stock, opt in source_data:
-        try:
-            supplier = str(supplier or "").strip()
-            article = str(article or "").strip()
-            stock = int(stock or 0)
-            opt = int(opt or 0)
-            if supplier != "Sklad" and stock < 3:
-                stock = 0
-            source_dict[(supplier, article)] = (stock, opt)
-        except Exception as e:
-            logger.warning(f"❌ Ошибка при обработке строки из prices: {e}")
+    # --- 2. Выбор поставщика для всех строк: один запрос (join + оконная функция) ---
+    best = fetch_best_suppliers(target_conn, flags)
+    logger.info(f"📥 Поставщик выбран для {len(best)} строк")
 
     # --- 3. Основной SELECT по маркетплейсам ---
     cursor.execute("""
-        SELECT rowid, Маркетплейс, Sklad, Invask, Okno, United,
-               Статус, Модель, Нал, Опт, "%", Цена
+        SELECT rowid, Маркетплейс, Статус, Модель, Нал, Опт, "%", Цена
         FROM marketplace
     """)
     all_rows = cursor.fetchall()
@@ -68,15 +63,9 @@ def update(flags):
     updated = 0
     cleared = 0
 
-    supplier_flags = flags.get("suppliers", {}) or {}
-
-    def supplier_enabled(supplier_name: str) -> bool:
-        return bool(supplier_flags.get(supplier_name, True))
-
     # --- 4. Основной цикл ---
     for row in all_rows:
-        (rowid, mp, code_sklad, code_invask, code_okno, code_united,
-         status, model, old_stock, old_opt, markup, old_price) = row
+        rowid, mp, status, model, old_stock, old_opt, markup, old_price = row
 
         mp = (mp or "").strip().lower()
         status = (status or "").strip().lower()
@@ -95,52 +84,19 @@ def update(flags):
                 cleared += 1
             continue
 
-        # --- получение данных из источников ---
-        def get_from_source(supplier_name, code_value):
-            if not code_value:
-                return 0, None
-
-            if not supplier_enabled(supplier_name):
-                return 0, None
-
-            return source_dict.get((supplier_name, str(code_value).strip()), (0, None))
-
-        chosen_supplier = ""
-        chosen_stock = 0
-        chosen_opt = None
-
-        # --- приоритет Sklad ---
-        if code_sklad:
-            st, opt_val = get_from_source("Sklad", code_sklad)
-            if st >= 1:
-                chosen_supplier = "Sklad"
-                chosen_stock, chosen_opt = st, opt_val
-
-        # --- приоритет Invask/Okno/United ---
-        if not chosen_supplier:
-            candidates = []
-            for sup_name, sup_code in (("Invask", code_invask),
-                                       ("Okno", code_okno),
-                                       ("United", code_united)):
-                st, opt_val = get_from_source(sup_name, sup_code)
-                if (st or 0) > 0 and opt_val is not None:
-                    candidates.append((sup_name, int(st), float(opt_val)))
-            if candidates:
-                order = {"Invask": 0, "Okno": 1, "United": 2}
-                candidates.sort(key=lambda x: (x[2], order.get(x[0], 9)))
-                chosen_supplier, chosen_stock, chosen_opt = candidates[0]
+        chosen_supplier, chosen_stock, chosen_opt = best.get(rowid, ("", 0, None))
 
         new_stock = chosen_stock if chosen_supplier else 0
         new_opt = chosen_opt if chosen_opt is not None else old_opt
 
         # --- пересчёт цены ---
-        try:
-            markup_val = float(str(markup).replace('%', '').replace(' ', '')) if markup else 0.0
-            base_opt = float(str(new_opt).replace(' ', '').replace('р.', '')) if new_opt else 0.0
-            new_price = round((base_opt + base_opt * markup_val / 100.0) / 100.0) * 100
-        except Exception:
+        markup_val = parse_number(markup) if markup else 0.0
+        base_opt = parse_number(new_opt) if new_opt else 0.0
+        if markup_val is None or base_opt is None:
             new_price = 0
             base_opt = 0
+        else:
+            new_price = calc_price(base_opt, markup_val)
 
         try:
             old_stock = int(old_stock or 0)
@@ -172,7 +128,6 @@ def update(flags):
     target_conn.commit()
 
     # --- завершение ---
-    source_conn.close()
     target_conn.close()
 
     logger.info(f"📊 Обработано {total_rows} строк | Обновлено: {updated} | Обнулено: {cleared}")
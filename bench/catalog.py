@@ -0,0 +1,136 @@
+"""
+Модуль `bench.catalog` — синтетический каталог для бенчмарков.
+
+build_catalog(root, skus, suppliers, seed) создаёт в root/System:
+    - marketplace_base.db — таблица marketplace (~80% SKU на каждом маркетплейсе),
+      коды поставщиков в колонках, реестр поставщиков (db.suppliers);
+    - !YMWB.db — таблица prices: строки Sklad и поставщиков, плюс товары, которых нет в marketplace;
+    - stock_flags.json — все маркетплейсы и поставщики включены;
+и возвращает описание каталога со строками листа СКЛАД (для заглушки Google Sheets).
+
+Данные детерминированы (seed): одинаковый масштаб → одинаковый каталог → сравнимые замеры.
+"""
+
+import json
+import random
+import sqlite3
+from pathlib import Path
+
+from db.suppliers import DEFAULT_SUPPLIERS, ensure_supplier_registry, upsert_supplier
+
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+MARKETS = ("yandex", "ozon", "wildberries")
+# Внешние поставщики по умолчанию (Invask, Okno, United); сверх них — Sup4, Sup5, ...
+BASE_SUPPLIERS = [s[0] for s in DEFAULT_SUPPLIERS if s[0] != "Sklad"]
+
+SKLAD_HEADER = ["Статус", "Арт мой", "Модель", "Наличие", "ОПТ", "РРЦ", "Место", "Комментарий"]
+# Доля SKU на своём складе (лист СКЛАД) и у каждого внешнего поставщика
+SKLAD_SHARE = 0.3
+SUPPLIER_SHARE = 0.35
+
+
+def supplier_names(count: int) -> list[str]:
+    return [*BASE_SUPPLIERS, *(f"Sup{i}" for i in range(len(BASE_SUPPLIERS) + 1, count + 1))][:count]
+
+
+def _marketplace_columns(suppliers) -> list[str]:
+    return [
+        "Маркетплейс", "Sklad", *suppliers, "WB Barcode", "WB Артикул", "Модель", "Статус",
+        "Нал", "Опт", "%", "Цена", "Комментарий", "Дата изменения",
+    ]
+
+
+def build_catalog(root, skus: int, suppliers: int = 3, seed: int = 1) -> dict:
+    system = Path(root) / "System"
+    system.mkdir(parents=True, exist_ok=True)
+    mp_path, prices_path = system / "marketplace_base.db", system / "!YMWB.db"
+    for path in (mp_path, prices_path):
+        path.unlink(missing_ok=True)
+
+    rnd = random.Random(seed)
+    names = supplier_names(suppliers)
+    columns = _marketplace_columns(names)
+
+    mp_rows, price_rows, sklad_rows = [], [], []
+    by_market = {m: [] for m in MARKETS}
+    for i in range(skus):
+        sku = str(100000 + i)
+        model = f"Model {i}"
+        codes = {
+            name: (f"{'00' if rnd.random() < 0.2 else ''}{name[:2].upper()}{i}" if rnd.random() < SUPPLIER_SHARE else "")
+            for name in names
+        }
+        opt = rnd.randint(1_000, 90_000)
+        markup = rnd.choice((10, 15, 20, 25))
+
+        for market in MARKETS:
+            if rnd.random() >= 0.8:
+                continue
+            by_market[market].append(sku)
+            wb = market == "wildberries"
+            mp_rows.append((
+                market, sku, *(codes[n] for n in names),
+                f"20{i:011d}" if wb else None, str(500000 + i) if wb else None,
+                model, "выкл." if rnd.random() < 0.05 else "вкл.",
+                rnd.randint(0, 5), opt, markup, 0, "", "01.01.2024 10:00",
+            ))
+
+        if rnd.random() < SKLAD_SHARE:
+            stock = rnd.randint(0, 4)
+            status = "На складе" if rnd.random() < 0.9 else "Продан"
+            sklad_rows.append([status, sku, model, str(stock), f"{opt:,}".replace(",", " "), str(opt * 2), "A1", ""])
+        for name, code in codes.items():
+            if code and rnd.random() < 0.9:
+                price_rows.append((name, code.lstrip("0"), model, rnd.randint(0, 10), rnd.randint(1_000, 90_000), 0))
+
+    # Товары поставщиков, которых нет в marketplace (выгрузка «невыставленных»)
+    for j in range(skus // 3):
+        price_rows.append((rnd.choice(names), f"X{j}", f"Extra {j}", rnd.randint(0, 10), rnd.randint(1_000, 90_000), 0))
+
+    conn = sqlite3.connect(mp_path)
+    try:
+        conn.execute(f"CREATE TABLE marketplace ({', '.join(_column_sql(c) for c in columns)})")
+        conn.executemany(
+            f"INSERT INTO marketplace VALUES ({', '.join('?' * len(columns))})", mp_rows
+        )
+        conn.commit()
+        ensure_supplier_registry(conn)
+        for priority, name in enumerate(names[len(BASE_SUPPLIERS):], start=len(BASE_SUPPLIERS) + 1):
+            upsert_supplier(conn, name, priority=priority, min_stock=3, code_column=name)
+    finally:
+        conn.close()
+
+    conn = sqlite3.connect(prices_path)
+    try:
+        conn.execute("""
+            CREATE TABLE prices (
+                "Поставщик" TEXT, "Артикул" TEXT, "Наименование" TEXT,
+                "Наличие" INTEGER, "ОПТ" INTEGER, "РРЦ" INTEGER
+            )
+        """)
+        conn.executemany("INSERT INTO prices VALUES (?, ?, ?, ?, ?, ?)", price_rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    with open(system / "stock_flags.json", "w", encoding="utf-8") as f:
+        json.dump({"yandex": True, "ozon": True, "wildberries": True,
+                   "suppliers": {name: True for name in ["Sklad", *names]}}, f)
+
+    return {
+        "skus": skus,
+        "suppliers": names,
+        "marketplace_rows": len(mp_rows),
+        "price_rows": len(price_rows),
+        "by_market": by_market,
+        "sklad_sheet": [SKLAD_HEADER, *sklad_rows],
+    }
+
+
+def _column_sql(name: str) -> str:
+    kind = "INTEGER" if name in ("Нал", "Опт", "%", "Цена") else "TEXT"
+    return f'"{name}" {kind}'
+
+
+__all__ = ["SCALES", "MARKETS", "build_catalog", "supplier_names"]
@@ -0,0 +1,320 @@
+"""
+Бенчмарки горячих путей на синтетическом каталоге (bench.catalog) и локальных заглушках API (bench.stubs).
+
+Запуск из папки проекта:
+    python -m bench.run                          # масштаб 1k, сравнение с bench/baseline.json
+    python -m bench.run --scale 1k 10k 100k      # несколько масштабов
+    python -m bench.run --case orders show_table # только выбранные замеры
+    python -m bench.run --save-baseline          # записать результаты как эталон
+
+Каждый масштаб — отдельный процесс во временной папке (System/ с базами и логами): модули проекта
+работают с относительными путями и кэшами уровня процесса. Замер = медиана `--repeat` запусков
+после `--warmup` прогревочных. Регрессия — медиана хуже эталона больше чем на `--tolerance`
+(доля) и больше чем на MIN_DELTA секунд; тогда код возврата 1.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DEFAULT_TOLERANCE = 0.5
+# Разница меньше этой (секунды) не считается регрессией — шум таймера и планировщика ОС
+MIN_DELTA = 0.05
+
+# Окружение процесса замеров: фиктивные ключи API, логи — только предупреждения
+BENCH_ENV = {
+    "LOG_LEVEL": "WARNING",
+    "SECRET_KEY": "bench",
+    "PASSWORD": "bench",
+    "wb_token": "bench", "warehouseId": "1",
+    "ym_token": "bench", "campaign_id": "1", "businessId": "1",
+    "ozon_client_ID": "1", "ozon_API_key": "bench",
+    "telegram_got_token": "1:bench", "telegram_chat_id": "1",
+    "telegram_got_token_error": "1:bench", "telegram_chat_id_error": "1",
+}
+
+MARKETS = ("yandex", "ozon", "wildberries")
+CASES = {}
+
+
+def case(name):
+    def register(func):
+        CASES[name] = func
+        return func
+    return register
+
+
+@case("update_sklad_task")
+def _update_sklad_task(ctx):
+    ctx.web_app.update_sklad_task()
+
+
+@case("auto_stock_updater.update")
+def _auto_stock_update(ctx):
+    ctx.auto_stock_updater.update(ctx.web_app.global_stock_flags)
+
+
+@case("recompute_marketplace_core")
+def _recompute(ctx):
+    for market in MARKETS:
+        ctx.web_app.recompute_marketplace_core(market)
+
+
+@case("show_table")
+def _show_table(ctx):
+    for market in MARKETS:
+        response = ctx.client.get(f"/table/{market}")
+        if response.status_code != 200:
+            raise RuntimeError(f"/table/{market}: {response.status_code}")
+
+
+@case("stock.gen_sklad")
+def _gen_sklad(ctx):
+    ctx.stock_data = ctx.stock.gen_sklad()
+
+
+@case("push_stocks")
+def _push_stocks(ctx):
+    wb_data, ym_data, oz_data = ctx.stock_data or ctx.stock.gen_sklad()
+    ctx.stock.wb_update(wb_data)
+    ctx.stock.ym_update(ym_data)
+    ctx.stock.oz_update(oz_data)
+
+
+@case("push_prices")
+def _push_prices(ctx):
+    ctx.price_updater_master.update_all_prices()
+
+
+@case("orders")
+def _orders(ctx):
+    ctx.order_notifications.check_for_new_orders()
+
+
+def _skus(scale: str) -> int:
+    from bench.catalog import SCALES
+
+    if scale in SCALES:
+        return SCALES[scale]
+    try:
+        return int(scale)
+    except ValueError:
+        raise SystemExit(f"Неизвестный масштаб: {scale} (варианты: {', '.join(SCALES)} или число SKU)")
+
+
+def _start_stubs(catalog, orders_per_call: int) -> dict:
+    from bench import stubs
+
+    sheets = {
+        ("КАЗНА", "СКЛАД"): catalog["sklad_sheet"],
+        **{("КАЗНА", name): [["Дата", "ID", "Товар"], [""], ["старый заказ"]] for name in ("ВБ", "ЯМ", "ОЗ")},
+    }
+    servers = {
+        "wb": stubs.wb_stub(stubs.OrderFeed(catalog["by_market"]["wildberries"], per_call=orders_per_call)),
+        "ym": stubs.ym_stub(stubs.OrderFeed(catalog["by_market"]["yandex"], per_call=orders_per_call)),
+        "ozon": stubs.ozon_stub(stubs.OrderFeed(catalog["by_market"]["ozon"], per_call=orders_per_call)),
+        "telegram": stubs.telegram_stub(),
+        "sheets": stubs.sheets_stub(sheets),
+    }
+    for server in servers.values():
+        server.start()
+    return servers
+
+
+def _measure(func, ctx, servers, repeat: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        func(ctx)
+    calls_before = sum(s.total_calls() for s in servers.values())
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(ctx)
+        timings.append(time.perf_counter() - started)
+    calls = sum(s.total_calls() for s in servers.values()) - calls_before
+    return {
+        "median": round(statistics.median(timings), 4),
+        "min": round(min(timings), 4),
+        "requests": round(calls / repeat, 1),
+    }
+
+
+def run_scale(scale: str, args) -> dict:
+    """Замеры одного масштаба в текущем процессе (меняет cwd и окружение)."""
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    workdir = Path(tempfile.mkdtemp(prefix=f"ymwb-bench-{scale}-"))
+    os.chdir(workdir)
+    sys.path.insert(0, str(PROJECT_DIR))
+
+    from bench.catalog import build_catalog
+    from bench.stubs import API_HOSTS, install_sheets_client
+
+    servers = {}
+    try:
+        started = time.perf_counter()
+        catalog = build_catalog(workdir, _skus(scale), suppliers=args.suppliers, seed=args.seed)
+        print(
+            f"📦 {scale}: marketplace {catalog['marketplace_rows']} строк, prices {catalog['price_rows']}, "
+            f"поставщики {', '.join(catalog['suppliers'])} ({time.perf_counter() - started:.1f} с)",
+            flush=True,
+        )
+
+        servers = _start_stubs(catalog, args.orders)
+        from http_client import set_base_urls
+
+        set_base_urls({host: servers[name].url for host, name in API_HOSTS.items()})
+        install_sheets_client(servers["sheets"].url)
+
+        import auto_stock_updater
+        import order_notifications
+        import price_updater_master
+        import stock
+        import web_app
+
+        client = web_app.app.test_client()
+        with client.session_transaction() as session:
+            session["logged_in"] = True
+        ctx = SimpleNamespace(
+            web_app=web_app, client=client, stock=stock, auto_stock_updater=auto_stock_updater,
+            price_updater_master=price_updater_master, order_notifications=order_notifications,
+            stock_data=None,
+        )
+
+        results = {}
+        for name in args.case or CASES:
+            results[name] = _measure(CASES[name], ctx, servers, args.repeat, args.warmup)
+            print(f"⏱ {scale} {name}: {results[name]['median']:.3f} с", flush=True)
+        return results
+    finally:
+        for server in servers.values():
+            server.stop()
+        os.chdir(PROJECT_DIR)
+        if args.keep:
+            print(f"📁 Папка замеров сохранена: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float = MIN_DELTA) -> list[str]:
+    regressions = []
+    for scale, cases in results.items():
+        for name, current in cases.items():
+            base = baseline.get(scale, {}).get(name)
+            if base is None:
+                continue
+            if current["median"] > base["median"] * (1 + tolerance) and current["median"] - base["median"] > min_delta:
+                regressions.append(
+                    f"{scale} {name}: {current['median']:.3f} с против {base['median']:.3f} с "
+                    f"(×{current['median'] / base['median']:.2f})"
+                )
+    return regressions
+
+
+def _print_report(results: dict, baseline: dict):
+    print(f"\n{'масштаб':<8} {'замер':<28} {'медиана':>9} {'мин':>9} {'запросов':>9} {'эталон':>9} {'×':>6}")
+    for scale, cases in results.items():
+        for name, r in cases.items():
+            base = baseline.get(scale, {}).get(name)
+            base_text = f"{base['median']:.3f}" if base else "—"
+            ratio = f"{r['median'] / base['median']:.2f}" if base and base["median"] else "—"
+            print(f"{scale:<8} {name:<28} {r['median']:>9.3f} {r['min']:>9.3f} {r['requests']:>9} {base_text:>9} {ratio:>6}")
+
+
+def _load_baseline(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("scales", {})
+
+
+def _save_baseline(path: Path, results: dict):
+    scales = _load_baseline(path)
+    scales.update(results)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"python": sys.version.split()[0], "cpu_count": os.cpu_count(), "scales": scales},
+                  f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def _child_command(scale: str, args, result_file: str) -> list[str]:
+    command = [
+        sys.executable, "-m", "bench.run", "--child", scale, "--result-file", result_file,
+        "--repeat", str(args.repeat), "--warmup", str(args.warmup), "--orders", str(args.orders),
+        "--suppliers", str(args.suppliers), "--seed", str(args.seed),
+    ]
+    if args.case:
+        command += ["--case", *args.case]
+    if args.keep:
+        command.append("--keep")
+    return command
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки на синтетическом каталоге с заглушками API")
+    parser.add_argument("--scale", nargs="+", default=["1k"], help="1k / 10k / 100k или число SKU")
+    parser.add_argument("--case", nargs="+", choices=list(CASES), help="только эти замеры")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--orders", type=int, default=1, help="новых заказов на маркетплейс за запрос")
+    parser.add_argument("--suppliers", type=int, default=3, help="внешних поставщиков в каталоге")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="допустимое ухудшение медианы, доля (0.5 = +50%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как эталон")
+    parser.add_argument("--keep", action="store_true", help="не удалять временные папки с базами")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        results = run_scale(args.child, args)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        return 0
+
+    results = {}
+    for scale in args.scale:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            result_file = tmp.name
+        try:
+            completed = subprocess.run(_child_command(scale, args, result_file), cwd=PROJECT_DIR)
+            if completed.returncode != 0:
+                print(f"❌ Замеры {scale} завершились с ошибкой (код {completed.returncode})")
+                return completed.returncode
+            with open(result_file, encoding="utf-8") as f:
+                results[scale] = json.load(f)
+        finally:
+            os.unlink(result_file)
+
+    baseline = _load_baseline(args.baseline)
+    _print_report(results, baseline)
+
+    if args.save_baseline:
+        _save_baseline(args.baseline, results)
+        print(f"\n💾 Эталон сохранён: {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n❌ Регрессии:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\n✅ Регрессий нет" if baseline else "\nℹ️ Эталона нет — сохраните его: --save-baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
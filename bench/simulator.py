@@ -0,0 +1,136 @@
+"""
+Локальный симулятор API маркетплейсов для нагрузочных проверок и замеров задержек.
+
+Поднимает заглушки bench.stubs (WB, Я.Маркет, Ozon, Telegram) на соседних портах и держит их,
+пока не нажат Ctrl+C. Помехи задаются для маркетплейсов: задержка ответа, доля 429 и 5xx,
+лимит запросов в секунду; заказы — постоянный хвост (--backlog) плюс новые в каждом опросе.
+
+Запуск из папки проекта:
+    python -m bench.simulator --db System/marketplace_base.db --backlog 500 --latency 0.05-0.3 --rate-429 0.05
+    python -m bench.simulator --skus 10000 --rps 5 --actions 20 --action-products 1000
+
+Симулятор печатает строку API_BASE_URLS=... — с ней main.py / web_app.py ходят в симулятор
+вместо настоящих API (см. http_client.set_base_urls). Счётчики запросов и выданных ошибок —
+GET /_stats на любом порту, итог печатается при остановке.
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+
+from bench import stubs
+
+
+MARKETS = {"wb": "wildberries", "ym": "yandex", "ozon": "ozon"}
+
+
+def _parse_latency(value: str) -> tuple[float, float]:
+    """"0.2" → (0.2, 0.2); "0.05-0.3" → (0.05, 0.3)."""
+    low, _, high = value.partition("-")
+    try:
+        low, high = float(low), float(high or low)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"задержка — число или диапазон «мин-макс»: {value}")
+    if low < 0 or high < low:
+        raise argparse.ArgumentTypeError(f"неверный диапазон задержки: {value}")
+    return low, high
+
+
+def _skus_from_db(path: str) -> dict:
+    """SKU (колонка Sklad) каждого маркетплейса из marketplace_base.db."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute('SELECT "Маркетплейс", "Sklad" FROM marketplace WHERE "Sklad" IS NOT NULL').fetchall()
+    finally:
+        conn.close()
+    skus = {market: [] for market in MARKETS.values()}
+    for market, sku in rows:
+        if market in skus and str(sku).strip():
+            skus[market].append(str(sku).strip())
+    return skus
+
+
+def start_simulator(skus: dict, args) -> dict:
+    """Запускает заглушки; skus: {маркетплейс: [SKU]} → {имя заглушки: StubServer}."""
+    def faults(name: str, index: int):
+        if name not in args.faults_for:
+            return None
+        return stubs.Faults(args.latency, args.rate_429, args.rate_5xx, args.rps,
+                            seed=None if args.seed is None else args.seed + index)
+
+    def feed(name: str):
+        return stubs.OrderFeed(skus.get(MARKETS[name], []), backlog=args.backlog, per_call=args.new_orders_per_poll)
+
+    def port(offset: int) -> int:
+        return args.port + offset if args.port else 0
+
+    servers = {
+        "wb": stubs.wb_stub(feed("wb"), faults("wb", 0), port(0)),
+        "ym": stubs.ym_stub(feed("ym"), faults("ym", 1), port(1)),
+        "ozon": stubs.ozon_stub(feed("ozon"), faults("ozon", 2), port(2),
+                                actions=args.actions, action_products=args.action_products),
+        "telegram": stubs.telegram_stub(faults("telegram", 3), port(3)),
+    }
+    for server in servers.values():
+        server.start()
+    return servers
+
+
+def base_urls_line(servers: dict) -> str:
+    return "API_BASE_URLS=" + ",".join(f"{host}={servers[name].url}" for host, name in stubs.API_HOSTS.items())
+
+
+def _print_stats(servers: dict):
+    for name, server in servers.items():
+        stats = server.stats()
+        injected = ", ".join(f"{code}: {count}" for code, count in sorted(stats["injected"].items())) or "нет"
+        print(f"📊 {name}: {server.total_calls()} запросов, помехи — {injected}")
+        for route, count in sorted(stats["calls"].items()):
+            print(f"     {count:>7}  {route}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный симулятор API маркетплейсов с помехами")
+    parser.add_argument("--port", type=int, default=0,
+                        help="первый порт: wb, ym, ozon, telegram — на соседних (0 — выбирает система)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", help="marketplace_base.db, из которой берутся SKU заказов")
+    source.add_argument("--skus", type=int, default=1_000, help="синтетические SKU 100000… (без --db)")
+    parser.add_argument("--backlog", type=int, default=0, help="необработанных заказов в каждом ответе")
+    parser.add_argument("--new-orders-per-poll", type=int, default=1, help="новых заказов в каждом опросе")
+    parser.add_argument("--latency", type=_parse_latency, default=(0.0, 0.0),
+                        help="задержка ответа, секунды: 0.2 или диапазон 0.05-0.3")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="доля ответов 500/502/503")
+    parser.add_argument("--rps", type=float, help="лимит запросов в секунду на заглушку (сверх — 429)")
+    parser.add_argument("--faults-for", nargs="+", choices=["wb", "ym", "ozon", "telegram"],
+                        default=["wb", "ym", "ozon"], help="к каким заглушкам применять помехи")
+    parser.add_argument("--actions", type=int, default=3, help="акций Ozon")
+    parser.add_argument("--action-products", type=int, default=250, help="товаров в каждой акции Ozon")
+    parser.add_argument("--seed", type=int, help="зерно помех (повторяемые прогоны)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        skus = _skus_from_db(args.db)
+    else:
+        synthetic = [str(100000 + i) for i in range(args.skus)]
+        skus = {market: synthetic for market in MARKETS.values()}
+
+    servers = start_simulator(skus, args)
+    print("🛰 Симулятор запущен:", ", ".join(f"{name} {server.url}" for name, server in servers.items()))
+    print(base_urls_line(servers), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _print_stats(servers)
+        for server in servers.values():
+            server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
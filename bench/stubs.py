@@ -0,0 +1,427 @@
+"""
+Модуль `bench.stubs` — локальные HTTP-заглушки API для бенчмарков и симулятора (bench.simulator).
+
+Каждая заглушка — отдельный ThreadingHTTPServer (порт выбирает система или задаётся явно) со своей
+таблицей маршрутов и счётчиками вызовов:
+    - wb / ym / ozon — остатки, цены, заказы (OrderFeed), акции Ozon;
+    - telegram       — sendMessage;
+    - sheets         — листы КАЗНА (СКЛАД, ВБ, ЯМ, ОЗ) в памяти.
+
+Faults — помехи на стороне заглушки: задержка ответа, 429 (доля запросов и/или лимит запросов
+в секунду), 5xx. GET /_stats на любой заглушке — счётчики вызовов и выданных ошибок (без помех).
+
+Маркетплейсы и Telegram подключаются подменой хостов (http_client.set_base_urls): код модулей
+не меняется. gspread ходит в Google через собственный авторизованный клиент, поэтому вместо него
+ставится SheetsClient — тот же интерфейс (open → worksheet → get / update / ...), запросы идут
+в заглушку sheets.
+"""
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import requests
+
+
+class Faults:
+    def __init__(self, latency: tuple[float, float] = (0.0, 0.0), rate_429: float = 0.0,
+                 rate_5xx: float = 0.0, rps: float | None = None, seed: int | None = None):
+        """latency — (мин, макс) секунд; rate_* — доля запросов; rps — лимит запросов в секунду (сверх — 429)."""
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rps = rps
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = float(rps or 0)
+        self._stamp = time.monotonic()
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.rps), self._tokens + (now - self._stamp) * self.rps)
+            self._stamp = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def apply(self):
+        """Ждёт задержку; возвращает (статус, тело, заголовки) ошибки или None — отвечать как обычно."""
+        low, high = self.latency
+        with self._lock:
+            delay = self._random.uniform(low, high) if high > 0 else 0.0
+            roll = self._random.random()
+            server_error = self._random.choice((500, 502, 503))
+        if delay:
+            time.sleep(delay)
+        if (self.rps and not self._take_token()) or roll < self.rate_429:
+            return 429, {"code": 8, "message": "rate limit exceeded (simulator)"}, {"Retry-After": "1"}
+        if roll < self.rate_429 + self.rate_5xx:
+            return server_error, {"message": "simulated server error"}, {}
+        return None
+
+
+class StubServer:
+    def __init__(self, name: str, routes, faults: Faults | None = None, port: int = 0):
+        """routes: [(метод, регулярное выражение пути, handler(match, body, query) → (статус, JSON или None))]."""
+        self.name = name
+        self.routes = [(method, re.compile(pattern), handler) for method, pattern, handler in routes]
+        self.faults = faults
+        self.calls = Counter()     # "МЕТОД путь-шаблон" → число запросов
+        self.injected = Counter()  # статус выданной помехи → число
+        self._calls_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"stub-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def total_calls(self) -> int:
+        with self._calls_lock:
+            return sum(self.calls.values())
+
+    def stats(self) -> dict:
+        with self._calls_lock:
+            return {"calls": dict(self.calls), "injected": {str(k): v for k, v in self.injected.items()}}
+
+    def dispatch(self, method: str, path: str, body, query):
+        """→ (статус, JSON или None, заголовки)."""
+        if method == "GET" and path == "/_stats":
+            return 200, self.stats(), {}
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path) if route_method == method else None
+            if match:
+                with self._calls_lock:
+                    self.calls[f"{method} {pattern.pattern}"] += 1
+                fault = self.faults.apply() if self.faults else None
+                if fault:
+                    with self._calls_lock:
+                        self.injected[fault[0]] += 1
+                    return fault
+                return (*handler(match, body, query), {})
+        return 404, {"error": f"{self.name}: нет маршрута {method} {path}"}, {}
+
+
+def _make_handler(stub: StubServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, как у http_session
+        disable_nagle_algorithm = True  # заголовки и тело уходят разными write — без TCP_NODELAY +40 мс на ответ
+
+        def _handle(self):
+            parts = urlsplit(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                body = None
+            status, payload, headers = stub.dispatch(self.command, unquote(parts.path), body, parse_qs(parts.query))
+
+            data = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            if data:
+                self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# --- маркетплейсы и Telegram ---
+
+_order_ids = itertools.count(1)
+
+
+class OrderFeed:
+    """
+    Заказы одного маркетплейса: backlog — постоянный хвост необработанных заказов (одни и те же id
+    в каждом ответе), per_call — сколько новых заказов (новые id) приходит в каждом опросе.
+    """
+
+    def __init__(self, skus, backlog: int = 0, per_call: int = 1):
+        self.skus = list(skus)
+        self.per_call = per_call
+        self._lock = threading.Lock()
+        self._backlog = self._new(backlog)
+
+    def _new(self, count: int) -> list[tuple[int, str]]:
+        if not self.skus:
+            return []
+        result = []
+        for _ in range(count):
+            order_id = next(_order_ids)
+            result.append((order_id, self.skus[(order_id * 7919) % len(self.skus)]))
+        return result
+
+    def poll(self) -> list[tuple[int, str]]:
+        """(id заказа, SKU): хвост плюс новые заказы этого опроса."""
+        with self._lock:
+            return [*self._backlog, *self._new(self.per_call)]
+
+
+def _query_int(query, name: str, default: int) -> int:
+    try:
+        return int(query.get(name, [default])[0])
+    except (TypeError, ValueError):
+        return default
+
+
+def wb_stub(orders: OrderFeed, faults: Faults | None = None, port: int = 0) -> StubServer:
+    def new_orders(match, body, query):
+        return 200, {"orders": [
+            {"id": order_id, "article": sku, "convertedPrice": 1_250_000, "quantity": 1}
+            for order_id, sku in orders.poll()
+        ]}
+
+    return StubServer("wb", [
+        ("PUT", r"/api/v3/stocks/\d+", lambda m, b, q: (204, None)),
+        ("GET", r"/api/v3/orders/new", new_orders),
+        ("POST", r"/api/v2/upload/task", lambda m, b, q: (200, {"data": {"id": 1}, "error": False})),
+    ], faults, port)
+
+
+def ym_stub(orders: OrderFeed, faults: Faults | None = None, port: int = 0) -> StubServer:
+    def campaign_orders(match, body, query):
+        page, page_size = max(1, _query_int(query, "page", 1)), max(1, _query_int(query, "pageSize", 50))
+        backlog = orders.poll()
+        chunk = backlog[(page - 1) * page_size: page * page_size]
+        return 200, {
+            "pager": {"total": len(backlog), "currentPage": page, "pageSize": page_size,
+                      "pagesCount": -(-len(backlog) // page_size)},
+            "orders": [
+                {
+                    "id": order_id,
+                    "delivery": {"shipments": [{"shipmentDate": "01-01-2025"}]},
+                    "items": [{"offerId": sku, "offerName": f"Товар {sku}", "buyerPrice": 12_500, "count": 1,
+                               "subsidies": [{"type": "SUBSIDY", "amount": 300}]}],
+                }
+                for order_id, sku in chunk
+            ],
+        }
+
+    return StubServer("ym", [
+        ("PUT", r"/campaigns/\w+/offers/stocks", lambda m, b, q: (200, {"status": "OK"})),
+        ("GET", r"/campaigns/\w+/orders", campaign_orders),
+        ("POST", r"/businesses/\w+/offer-prices/updates", lambda m, b, q: (200, {"status": "OK"})),
+    ], faults, port)
+
+
+def ozon_stub(orders: OrderFeed, faults: Faults | None = None, port: int = 0,
+              actions: int = 0, action_products: int = 0) -> StubServer:
+    """actions × action_products — акции с товарами; снятые с акции товары в ней больше не возвращаются."""
+    lock = threading.Lock()
+    promo = {
+        action_id: list(range(action_id * 1_000_000, action_id * 1_000_000 + action_products))
+        for action_id in range(1, actions + 1)
+    }
+
+    def postings(match, body, query):
+        body = body or {}
+        limit, offset = int(body.get("limit") or 100), int(body.get("offset") or 0)
+        backlog = orders.poll()
+        return 200, {"result": {"postings": [
+            {
+                "posting_number": f"{order_id}-0001-1",
+                "status": "awaiting_packaging",
+                "shipment_date": "2025-01-01T10:00:00Z",
+                "products": [{"offer_id": sku, "name": f"Товар {sku}", "price": "12500.0000", "quantity": 1}],
+            }
+            for order_id, sku in backlog[offset:offset + limit]
+        ], "count": len(backlog)}}
+
+    def stocks(match, body, query):
+        items = (body or {}).get("stocks", [])
+        return 200, {"result": [{"offer_id": s.get("offer_id"), "updated": True, "errors": []} for s in items]}
+
+    def list_actions(match, body, query):
+        with lock:
+            return 200, {"result": [
+                {"id": action_id, "title": f"Акция {action_id}", "is_participating": bool(products),
+                 "participating_products_count": len(products), "date_end": "2030-01-01T00:00:00Z"}
+                for action_id, products in promo.items()
+            ]}
+
+    def action_products_page(match, body, query):
+        body = body or {}
+        limit = int(body.get("limit") or 100)
+        last_id = int(body.get("last_id") or 0)
+        with lock:
+            products = [p for p in promo.get(body.get("action_id"), []) if p > last_id][:limit]
+        return 200, {"result": {
+            "products": [{"id": p, "price": 1000, "action_price": 900} for p in products],
+            "total": len(products),
+            "last_id": str(products[-1]) if len(products) == limit else "",
+        }}
+
+    def deactivate(match, body, query):
+        body = body or {}
+        ids = set(body.get("product_ids") or [])
+        with lock:
+            products = promo.get(body.get("action_id"), [])
+            removed = [p for p in products if p in ids]
+            products[:] = [p for p in products if p not in ids]
+        return 200, {"result": {"product_ids": removed, "rejected": []}}
+
+    return StubServer("ozon", [
+        ("POST", r"/v2/products/stocks", stocks),
+        ("POST", r"/v3/posting/fbs/unfulfilled/list", postings),
+        ("POST", r"/v1/product/import/prices", lambda m, b, q: (200, {"result": []})),
+        ("GET", r"/v1/actions", list_actions),
+        ("POST", r"/v1/actions/products", action_products_page),
+        ("POST", r"/v1/actions/products/deactivate", deactivate),
+    ], faults, port)
+
+
+def telegram_stub(faults: Faults | None = None, port: int = 0) -> StubServer:
+    message_ids = itertools.count(1)
+    return StubServer("telegram", [
+        ("POST", r"/bot[^/]+/sendMessage",
+         lambda m, b, q: (200, {"ok": True, "result": {"message_id": next(message_ids)}})),
+    ], faults, port)
+
+
+# Хост API → имя заглушки
+API_HOSTS = {
+    "marketplace-api.wildberries.ru": "wb",
+    "discounts-prices-api.wildberries.ru": "wb",
+    "api.partner.market.yandex.ru": "ym",
+    "api-seller.ozon.ru": "ozon",
+    "api.telegram.org": "telegram",
+}
+
+
+# --- Google Sheets ---
+
+def _a1_start(range_name: str) -> tuple[int, int]:
+    """'C5' / 'A2:H' → (строка, колонка) с нуля."""
+    letters, digits = re.match(r"([A-Z]+)(\d*)", range_name.split(":")[0].upper()).groups()
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch) - 64
+    return (int(digits) if digits else 1) - 1, col - 1
+
+
+def sheets_stub(sheets: dict) -> StubServer:
+    """sheets: {(таблица, лист): [[ячейки]]} — изменяется на месте."""
+    lock = threading.Lock()
+
+    def sheet(match):
+        return sheets.setdefault((match["book"], match["sheet"]), [])
+
+    def values(match, body, query):
+        with lock:
+            return 200, {"values": [list(row) for row in sheet(match)]}
+
+    def update(match, body, query):
+        with lock:
+            rows = sheet(match)
+            top, left = _a1_start(body["range"])
+            for r, row_values in enumerate(body["values"]):
+                while len(rows) <= top + r:
+                    rows.append([])
+                row = rows[top + r]
+                while len(row) < left + len(row_values):
+                    row.append("")
+                row[left:left + len(row_values)] = ["" if v is None else str(v) for v in row_values]
+        return 200, {"updatedRows": len(body["values"])}
+
+    def insert_row(match, body, query):
+        with lock:
+            sheet(match).insert(int(body["index"]) - 1, [str(v) for v in body.get("values", [])])
+        return 200, {}
+
+    book = r"/spreadsheets/(?P<book>[^/]+)/(?P<sheet>[^/]+)"
+    return StubServer("sheets", [
+        ("GET", book, values),
+        ("POST", book + r"/update", update),
+        ("POST", book + r"/insert_row", insert_row),
+    ])
+
+
+class _Worksheet:
+    def __init__(self, session, url):
+        self._session = session
+        self._url = url
+
+    def get_all_values(self):
+        response = self._session.get(self._url, timeout=30)
+        response.raise_for_status()
+        return response.json()["values"]
+
+    def get(self, range_name=None):
+        return self.get_all_values()
+
+    def col_values(self, col: int):
+        values = [row[col - 1] if len(row) >= col else "" for row in self.get_all_values()]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def update(self, range_name, values, value_input_option=None):
+        response = self._session.post(f"{self._url}/update", json={"range": range_name, "values": values}, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def insert_row(self, values, index=1):
+        response = self._session.post(f"{self._url}/insert_row", json={"index": index, "values": values}, timeout=30)
+        response.raise_for_status()
+
+
+class _Spreadsheet:
+    def __init__(self, session, url):
+        self._session = session
+        self._url = url
+
+    def worksheet(self, title: str) -> _Worksheet:
+        return _Worksheet(self._session, f"{self._url}/{quote(title)}")
+
+
+class SheetsClient:
+    """Замена клиента gspread: те же вызовы, данные — в заглушке sheets."""
+
+    def __init__(self, base_url: str):
+        self._session = requests.Session()
+        self._base_url = base_url
+
+    def open(self, title: str) -> _Spreadsheet:
+        return _Spreadsheet(self._session, f"{self._base_url}/spreadsheets/{quote(title)}")
+
+
+def install_sheets_client(base_url: str):
+    import gspread
+
+    client = SheetsClient(base_url)
+    gspread.service_account = lambda *args, **kwargs: client
+
+
+__all__ = [
+    "Faults", "StubServer", "OrderFeed", "API_HOSTS", "wb_stub", "ym_stub", "ozon_stub", "telegram_stub",
+    "sheets_stub", "SheetsClient", "install_sheets_client",
+]
@@ -0,0 +1,238 @@
+"""
+Модуль `db.changes` — версия данных и журнал изменений для таблиц SQLite.
+
+Триггеры AFTER INSERT/UPDATE/DELETE на отслеживаемой таблице:
+    - увеличивают счётчик таблицы в `_data_version` (монотонная версия данных);
+    - пишут строку в `_change_log`: (таблица, версия, rowid строки, операция, время).
+
+Счётчик растёт при любой записи — из веб-приложения, из main.py или из внешнего
+редактора базы — поэтому кэши и дельта-выгрузки могут опираться на него.
+
+- ensure_version_tracking(conn, table):
+    Создаёт служебные таблицы и триггеры (идемпотентно). UPDATE, не изменивший ни одной
+    колонки, версию не увеличивает. Если всё уже на месте — только чтение sqlite_master;
+    пересоздаются лишь триггеры, определение которых изменилось (например, добавилась колонка).
+
+- get_data_version(conn, table):
+    Текущая версия данных таблицы.
+
+- changes_since(conn, table, version):
+    Изменения после версии N: ChangeSet(version, changes, complete).
+    complete=False — журнал уже обрезан, нужна полная перечитка таблицы.
+
+- prune_change_log(conn, table, keep):
+    Оставляет в журнале только последние `keep` записей таблицы.
+
+- VersionedCache(db_path, table, setup):
+    Кэш результатов, который сбрасывается при изменении версии данных одной или нескольких таблиц.
+"""
+
+import sqlite3
+import threading
+from collections import namedtuple
+
+from logger_config import logger
+
+
+VERSION_TABLE = "_data_version"
+CHANGE_LOG_TABLE = "_change_log"
+
+# Сколько последних записей журнала хранить для каждой таблицы (см. prune_change_log)
+CHANGE_LOG_KEEP = 200_000
+
+ChangeSet = namedtuple("ChangeSet", ["version", "changes", "complete"])
+
+# Базы/таблицы, для которых триггеры уже проверены в этом процессе
+_tracked = set()
+_tracked_lock = threading.Lock()
+
+
+def ensure_version_tracking(conn, table: str = "marketplace"):
+    key = (_db_file(conn), table)
+    if key in _tracked:
+        return
+
+    with _tracked_lock:
+        triggers = _trigger_sql(conn, table)
+        # Всё на месте и триггеры совпадают с нужными — только чтение, без DDL и блокировки записи
+        if not _tracking_ready(conn, table, triggers):
+            _install_tracking(conn, table, triggers)
+            logger.debug(f"🔢 Журнал изменений включён: {key[0]} → {table}")
+        _tracked.add(key)
+
+
+def _trigger_sql(conn, table: str) -> dict:
+    """Имя триггера → CREATE TRIGGER. Условие UPDATE перечисляет колонки — при их добавлении триггер меняется."""
+    info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+    columns = [r[1] for r in info]
+    row_id = _row_id_column(conn, table, info)
+    # UPDATE без фактических изменений (SET x = x) версию не двигает
+    changed = " OR ".join(f'OLD."{col}" IS NOT NEW."{col}"' for col in columns) or "1"
+    triggers = {}
+    for op, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        name = f"trg_{table}_changes_{op.lower()}"
+        triggers[name] = f"""CREATE TRIGGER "{name}"
+                AFTER {op} ON "{table}"
+                {f"WHEN {changed}" if op == "UPDATE" else ""}
+                BEGIN
+                    UPDATE {VERSION_TABLE} SET version = version + 1 WHERE tbl = '{table}';
+                    INSERT INTO {CHANGE_LOG_TABLE} (tbl, version, row_id, op)
+                    SELECT '{table}', version, {ref}.{row_id}, '{op[0]}'
+                      FROM {VERSION_TABLE} WHERE tbl = '{table}';
+                END"""
+    return triggers
+
+
+def _normalized(sql: str | None) -> str:
+    return " ".join((sql or "").split())
+
+
+def _tracking_ready(conn, table: str, triggers: dict) -> bool:
+    existing = dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type IN ('table', 'index', 'trigger')"
+    ).fetchall())
+    if not {VERSION_TABLE, CHANGE_LOG_TABLE, "idx_change_log_tbl_version"} <= existing.keys():
+        return False
+    if any(_normalized(existing.get(name)) != _normalized(sql) for name, sql in triggers.items()):
+        return False
+    return conn.execute(f"SELECT 1 FROM {VERSION_TABLE} WHERE tbl = ?", (table,)).fetchone() is not None
+
+
+def _install_tracking(conn, table: str, triggers: dict):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+            tbl     TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} (
+            seq        INTEGER PRIMARY KEY,
+            tbl        TEXT    NOT NULL,
+            version    INTEGER NOT NULL,
+            row_id     INTEGER NOT NULL,
+            op         TEXT    NOT NULL,
+            changed_at TEXT    NOT NULL DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_change_log_tbl_version
+            ON {CHANGE_LOG_TABLE} (tbl, version)
+    """)
+    conn.execute(f"INSERT OR IGNORE INTO {VERSION_TABLE} (tbl, version) VALUES (?, 0)", (table,))
+    # Пересоздаются только отсутствующие или изменившиеся триггеры
+    existing = dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (table,)
+    ).fetchall())
+    for name, sql in triggers.items():
+        if _normalized(existing.get(name)) == _normalized(sql):
+            continue
+        conn.execute(f'DROP TRIGGER IF EXISTS "{name}"')
+        conn.execute(sql)
+    conn.commit()
+
+
+def get_data_version(conn, table: str = "marketplace") -> int:
+    ensure_version_tracking(conn, table)
+    row = conn.execute(f"SELECT version FROM {VERSION_TABLE} WHERE tbl = ?", (table,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def changes_since(conn, table: str, version: int) -> ChangeSet:
+    """
+    Строки, изменённые после версии `version`.
+    changes — список (row_id, op, version) по одной записи на строку (последняя операция),
+    op: 'I' — вставка, 'U' — изменение, 'D' — удаление.
+    """
+    current = get_data_version(conn, table)
+    if version >= current:
+        return ChangeSet(current, [], True)
+
+    oldest = conn.execute(
+        f"SELECT MIN(version) FROM {CHANGE_LOG_TABLE} WHERE tbl = ?", (table,)
+    ).fetchone()[0]
+    if oldest is None or oldest > version + 1:
+        # журнал обрезан (или включён позже) — восстановить дельту нельзя
+        return ChangeSet(current, [], False)
+
+    rows = conn.execute(f"""
+        SELECT row_id, op, MAX(version) AS version
+          FROM {CHANGE_LOG_TABLE}
+         WHERE tbl = ? AND version > ? AND version <= ?
+         GROUP BY row_id
+         ORDER BY version
+    """, (table, version, current)).fetchall()
+    return ChangeSet(current, [(row_id, op, ver) for row_id, op, ver in rows], True)
+
+
+def prune_change_log(conn, table: str, keep: int = CHANGE_LOG_KEEP) -> int:
+    ensure_version_tracking(conn, table)
+    cur = conn.execute(f"""
+        DELETE FROM {CHANGE_LOG_TABLE}
+         WHERE tbl = ?
+           AND version <= (SELECT version FROM {VERSION_TABLE} WHERE tbl = ?) - ?
+    """, (table, table, keep))
+    conn.commit()
+    if cur.rowcount:
+        logger.info(f"🧹 Журнал изменений {table}: удалено {cur.rowcount} старых записей")
+    return cur.rowcount
+
+
+def _row_id_column(conn, table: str, info) -> str:
+    """rowid; у таблиц WITHOUT ROWID — первая колонка первичного ключа (в журнал пишется её значение)."""
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if sql and "WITHOUT ROWID" in (sql[0] or "").upper():
+        return f'"{min((r for r in info if r[5]), key=lambda r: r[5])[1]}"'
+    return "rowid"
+
+
+def _db_file(conn) -> str:
+    row = conn.execute("PRAGMA database_list").fetchone()
+    return row[2] if row else ""
+
+
+class VersionedCache:
+    """
+    Кэш «ключ → результат», действительный, пока не изменилась версия данных таблицы
+    (table — имя или кортеж имён: результат зависит от нескольких таблиц одной базы).
+    Проверка версии — один SELECT по первичному ключу на таблицу.
+    setup(conn) — необязательная подготовка базы перед чтением версий (создание таблиц).
+    """
+
+    def __init__(self, db_path: str, table: str | tuple[str, ...] = "marketplace", setup=None):
+        self.db_path = db_path
+        self.tables = (table,) if isinstance(table, str) else tuple(table)
+        self.setup = setup
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def version(self) -> tuple[int, ...]:
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            if self.setup:
+                self.setup(conn)
+            return tuple(get_data_version(conn, table) for table in self.tables)
+        finally:
+            conn.close()
+
+    def get(self, key, compute):
+        version = self.version()
+        with self._lock:
+            cached = self._values.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        value = compute()
+        with self._lock:
+            self._values[key] = (version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+__all__ = [
+    "ensure_version_tracking", "get_data_version", "changes_since", "prune_change_log",
+    "ChangeSet", "VersionedCache",
+]
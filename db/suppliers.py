@@ -0,0 +1,368 @@
+"""
+Модуль `db.suppliers` — реестр поставщиков и связь «строка marketplace ↔ код поставщика».
+
+Таблицы в marketplace_base.db:
+
+- suppliers:
+    name        — имя поставщика (как в prices."Поставщик")
+    priority    — приоритет при равном ОПТ (меньше — важнее)
+    min_stock   — минимальный остаток: меньше — считаем, что товара нет
+    enabled     — поставщик используется при выборе
+    preferred   — «свой склад»: берётся первым при наличии, без сравнения цен
+    code_column — колонка marketplace с кодом поставщика (NULL — коды только в supplier_codes)
+
+- supplier_codes (mp_rowid, supplier, code, code_key):
+    Нормализованная связь строк marketplace с кодами поставщиков. Для поставщиков с code_column
+    поддерживается триггерами на marketplace, для остальных заполняется напрямую (set_supplier_code).
+    code_key — код без пробелов/табов и ведущих нулей (так же нормализуется prices."Артикул").
+
+- prepare_best_supplier_view(conn, flags) → temp.best_supplier:
+    Выбор поставщика для всех строк одним запросом: join supplier_codes → suppliers → prices
+    и ROW_NUMBER() OVER (PARTITION BY строка ORDER BY preferred, ОПТ, priority).
+    fetch_best_suppliers / best_supplier_for_codes читают результат в Python.
+"""
+
+import json
+import re
+import threading
+
+from db.changes import ensure_version_tracking
+from logger_config import logger
+from services.pricing import register_sql_functions
+
+
+SUP_DB_PATH = "System/!YMWB.db"
+SUP_SCHEMA = "sup"
+
+# Поставщики по умолчанию (то, что раньше было зашито в код)
+DEFAULT_SUPPLIERS = [
+    # name,    priority, min_stock, enabled, preferred, code_column
+    ("Sklad",  0,        1,         1,       1,         "Sklad"),
+    ("Invask", 1,        3,         1,       0,         "Invask"),
+    ("Okno",   2,        3,         1,       0,         "Okno"),
+    ("United", 3,        3,         1,       0,         "United"),
+]
+
+
+def code_key_sql(expr: str) -> str:
+    """SQL-выражение нормализованного кода: без пробелов, неразрывных пробелов, табов и ведущих нулей."""
+    return (
+        f"LTRIM(REPLACE(REPLACE(REPLACE(TRIM(CAST({expr} AS TEXT)), ' ', ''), char(160), ''), char(9), ''), '0')"
+    )
+
+
+def code_key(value) -> str:
+    """То же, что code_key_sql, на стороне Python (None → '')."""
+    if value is None:
+        return ""
+    return str(value).strip(" ").replace(" ", "").replace("\xa0", "").replace("\t", "").lstrip("0")
+
+
+_ready = set()
+_ready_lock = threading.Lock()
+
+
+def ensure_supplier_registry(conn):
+    """Создаёт реестр и связь, заполняет значения по умолчанию, ставит триггеры (один раз на процесс)."""
+    key = conn.execute("PRAGMA database_list").fetchone()[2]
+    if key in _ready:
+        return
+
+    with _ready_lock:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS suppliers (
+                name        TEXT PRIMARY KEY,
+                priority    INTEGER NOT NULL DEFAULT 100,
+                min_stock   INTEGER NOT NULL DEFAULT 1,
+                enabled     INTEGER NOT NULL DEFAULT 1,
+                preferred   INTEGER NOT NULL DEFAULT 0,
+                code_column TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS supplier_codes (
+                mp_rowid INTEGER NOT NULL,
+                supplier TEXT    NOT NULL,
+                code     TEXT    NOT NULL,
+                code_key TEXT    NOT NULL,
+                PRIMARY KEY (mp_rowid, supplier)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_supplier_codes_key ON supplier_codes (supplier, code_key)")
+        if conn.execute("SELECT COUNT(*) FROM suppliers").fetchone()[0] == 0:
+            conn.executemany("""
+                INSERT INTO suppliers (name, priority, min_stock, enabled, preferred, code_column)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, DEFAULT_SUPPLIERS)
+            logger.info(f"🏷 Реестр поставщиков создан: {', '.join(s[0] for s in DEFAULT_SUPPLIERS)}")
+
+        # Версии реестра и связи — для кэшей, зависящих от поставщиков (статистика)
+        ensure_version_tracking(conn, "suppliers")
+        ensure_version_tracking(conn, "supplier_codes")
+        _install_code_triggers(conn)
+        # rowid могут измениться после VACUUM — при старте процесса пересобираем связь из колонок
+        rebuild_supplier_codes(conn)
+        conn.commit()
+        _ready.add(key)
+
+
+def _column_suppliers(conn) -> list[tuple[str, str]]:
+    mp_columns = {r[1] for r in conn.execute('PRAGMA table_info("marketplace")')}
+    return [
+        (name, col) for name, col in conn.execute(
+            "SELECT name, code_column FROM suppliers WHERE code_column IS NOT NULL ORDER BY priority"
+        )
+        if col in mp_columns
+    ]
+
+
+def _insert_codes_sql(name: str, col: str, ref: str) -> str:
+    return f"""
+        INSERT OR REPLACE INTO supplier_codes (mp_rowid, supplier, code, code_key)
+        SELECT {ref}.rowid, '{name}', TRIM({ref}."{col}"), {code_key_sql(f'{ref}."{col}"')}
+         WHERE TRIM(COALESCE({ref}."{col}", '')) <> '';
+    """
+
+
+def _install_code_triggers(conn):
+    """Триггеры, поддерживающие supplier_codes для поставщиков с колонкой в marketplace."""
+    pairs = _column_suppliers(conn)
+    for op in ("insert", "update", "delete"):
+        conn.execute(f'DROP TRIGGER IF EXISTS "trg_marketplace_supplier_codes_{op}"')
+    if not pairs:
+        return
+
+    names = ", ".join(f"'{name}'" for name, _ in pairs)
+    columns = ", ".join(f'"{col}"' for _, col in pairs)
+    inserts = "".join(_insert_codes_sql(name, col, "NEW") for name, col in pairs)
+
+    conn.execute(f"""
+        CREATE TRIGGER "trg_marketplace_supplier_codes_insert"
+        AFTER INSERT ON marketplace
+        BEGIN
+            {inserts}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER "trg_marketplace_supplier_codes_update"
+        AFTER UPDATE OF {columns} ON marketplace
+        BEGIN
+            DELETE FROM supplier_codes WHERE mp_rowid = OLD.rowid AND supplier IN ({names});
+            {inserts}
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER "trg_marketplace_supplier_codes_delete"
+        AFTER DELETE ON marketplace
+        BEGIN
+            DELETE FROM supplier_codes WHERE mp_rowid = OLD.rowid;
+        END
+    """)
+
+
+def rebuild_supplier_codes(conn):
+    """
+    Пересборка связи для поставщиков с колонкой; коды остальных поставщиков не трогаем.
+    Пишутся только расхождения с колонками: связь в порядке — версия supplier_codes не меняется.
+    """
+    pairs = _column_suppliers(conn)
+    conn.execute("DELETE FROM supplier_codes WHERE mp_rowid NOT IN (SELECT rowid FROM marketplace)")
+    for name, col in pairs:
+        conn.execute(f"""
+            DELETE FROM supplier_codes
+             WHERE supplier = ?
+               AND NOT EXISTS (
+                    SELECT 1 FROM marketplace m
+                     WHERE m.rowid = supplier_codes.mp_rowid
+                       AND TRIM(COALESCE(m."{col}", '')) <> ''
+                       AND TRIM(m."{col}") = supplier_codes.code
+                       AND {code_key_sql(f'm."{col}"')} = supplier_codes.code_key
+               )
+        """, (name,))
+        conn.execute(f"""
+            INSERT OR REPLACE INTO supplier_codes (mp_rowid, supplier, code, code_key)
+            SELECT rowid, ?, TRIM("{col}"), {code_key_sql(f'"{col}"')}
+              FROM marketplace
+             WHERE TRIM(COALESCE("{col}", '')) <> ''
+               AND NOT EXISTS (
+                    SELECT 1 FROM supplier_codes c
+                     WHERE c.mp_rowid = marketplace.rowid AND c.supplier = ?
+               )
+        """, (name, name))
+
+
+def list_suppliers(conn, enabled_only: bool = False) -> list[dict]:
+    ensure_supplier_registry(conn)
+    where = "WHERE enabled = 1" if enabled_only else ""
+    cur = conn.execute(f"""
+        SELECT name, priority, min_stock, enabled, preferred, code_column
+          FROM suppliers {where}
+         ORDER BY priority, name
+    """)
+    columns = [d[0] for d in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def upsert_supplier(conn, name: str, priority: int = 100, min_stock: int = 1, enabled: bool = True,
+                    preferred: bool = False, code_column: str | None = None):
+    # имя идёт в имена таблиц резервных копий и в тексты триггеров
+    if not re.fullmatch(r"\w+", name or ""):
+        raise ValueError(f"Недопустимое имя поставщика: {name!r}")
+    ensure_supplier_registry(conn)
+    conn.execute("""
+        INSERT INTO suppliers (name, priority, min_stock, enabled, preferred, code_column)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            priority = excluded.priority, min_stock = excluded.min_stock, enabled = excluded.enabled,
+            preferred = excluded.preferred, code_column = excluded.code_column
+    """, (name, int(priority), int(min_stock), int(bool(enabled)), int(bool(preferred)), code_column))
+    _install_code_triggers(conn)
+    rebuild_supplier_codes(conn)
+    conn.commit()
+    logger.info(f"🏷 Поставщик {name} сохранён в реестре")
+
+
+def set_supplier_code(conn, mp_rowid: int, supplier: str, code: str | None):
+    """Код поставщика без собственной колонки в marketplace (пустой код — удалить связь)."""
+    ensure_supplier_registry(conn)
+    conn.execute("DELETE FROM supplier_codes WHERE mp_rowid = ? AND supplier = ?", (mp_rowid, supplier))
+    if code and str(code).strip():
+        conn.execute(f"""
+            INSERT INTO supplier_codes (mp_rowid, supplier, code, code_key)
+            VALUES (?, ?, TRIM(?), {code_key_sql('?')})
+        """, (mp_rowid, supplier, str(code), str(code)))
+
+
+def supplier_rows_clause(supplier: str, preferred: bool) -> tuple[str, tuple]:
+    """
+    Условие «строка marketplace относится к поставщику».
+    Для preferred (свой склад) — только строки, где кроме него поставщиков нет.
+    """
+    if preferred:
+        return ("""
+            rowid IN (SELECT mp_rowid FROM supplier_codes WHERE supplier = ?)
+            AND rowid NOT IN (SELECT mp_rowid FROM supplier_codes WHERE supplier <> ?)
+        """, (supplier, supplier))
+    return "rowid IN (SELECT mp_rowid FROM supplier_codes WHERE supplier = ?)", (supplier,)
+
+
+def supplier_conditions(conn, enabled_only: bool = True) -> dict:
+    """{поставщик: (условие, параметры)} для всех поставщиков реестра — для подсчётов по строкам marketplace."""
+    return {
+        s["name"]: supplier_rows_clause(s["name"], bool(s["preferred"]))
+        for s in list_suppliers(conn, enabled_only=enabled_only)
+    }
+
+
+def attach_prices(conn, path: str = SUP_DB_PATH):
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if SUP_SCHEMA not in attached:
+        conn.execute(f"ATTACH DATABASE ? AS {SUP_SCHEMA}", (path,))
+
+
+def disabled_suppliers(flags: dict | None) -> list[str]:
+    return [name for name, on in ((flags or {}).get("suppliers") or {}).items() if not on]
+
+
+def _best_supplier_sql(codes: str) -> str:
+    """
+    Запрос выбора поставщика. codes — источник (mp_rowid, supplier, code_key):
+    таблица supplier_codes или коды одной строки (VALUES).
+    Свой склад (preferred) — первым при наличии, иначе минимальный ОПТ, при равенстве — priority.
+    """
+    return f"""
+        WITH stock AS (
+            -- prices: одна запись на (поставщик, нормализованный артикул) — первая по rowid.
+            -- CAST AS TEXT — та же affinity, что у supplier_codes.code_key: иначе автоматический
+            -- индекс строится только по supplier_key и соединение становится квадратичным
+            SELECT UPPER(TRIM("Поставщик")) AS supplier_key,
+                   CAST({code_key_sql('"Артикул"')} AS TEXT) AS code_key,
+                   MIN(rowid) AS first_id,
+                   CAST(TRIM(CAST(COALESCE("Наличие", 0) AS TEXT)) AS INTEGER) AS nal,
+                   parse_number("ОПТ") AS opt  -- нечисловой ОПТ → NULL (а не 0 от CAST), строка не участвует
+              FROM {SUP_SCHEMA}.prices
+             GROUP BY 1, 2
+        ),
+        offers AS (
+            SELECT c.mp_rowid, s.name AS supplier, s.priority, s.preferred,
+                   CASE WHEN st.nal >= s.min_stock THEN st.nal ELSE 0 END AS nal,
+                   st.opt
+              FROM ({codes}) c
+              JOIN main.suppliers s ON s.name = c.supplier
+              JOIN stock st ON st.supplier_key = UPPER(s.name) AND st.code_key = c.code_key
+             WHERE s.enabled = 1
+               AND s.name NOT IN (SELECT name FROM temp.disabled_suppliers)
+        ),
+        ranked AS (
+            SELECT mp_rowid, supplier, nal, opt,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY mp_rowid
+                       ORDER BY preferred DESC, opt, priority
+                   ) AS rn
+              FROM offers
+             WHERE nal > 0 AND (preferred = 1 OR opt IS NOT NULL)
+        )
+        SELECT mp_rowid, supplier, nal, opt FROM ranked WHERE rn = 1
+    """
+
+
+def prepare_best_supplier_view(conn, flags: dict | None = None, prices_path: str = SUP_DB_PATH):
+    """
+    Создаёт на соединении временное представление temp.best_supplier (mp_rowid, supplier, nal, opt):
+    выбранный поставщик для каждой строки marketplace. Строк без подходящего поставщика в нём нет.
+    flags — stock_flags: поставщики, выключенные в flags["suppliers"], не участвуют.
+    Только DDL — транзакцию вызывающего кода не открывает и не фиксирует.
+    """
+    ensure_supplier_registry(conn)
+    attach_prices(conn, prices_path)
+    register_sql_functions(conn)  # parse_number в _best_supplier_sql
+    disabled = json.dumps(disabled_suppliers(flags), ensure_ascii=False).replace("'", "''")
+    conn.execute("DROP VIEW IF EXISTS temp.disabled_suppliers")
+    conn.execute(f"CREATE TEMP VIEW disabled_suppliers AS SELECT value AS name FROM json_each('{disabled}')")
+    conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS best_supplier AS {_best_supplier_sql('SELECT * FROM main.supplier_codes')}")
+
+
+def fetch_best_suppliers(conn, flags: dict | None = None, market: str | None = None,
+                         prices_path: str = SUP_DB_PATH) -> dict:
+    """
+    Выбор поставщика для строк marketplace (всех или одного маркетплейса): {rowid: (supplier, nal, opt)}.
+    """
+    prepare_best_supplier_view(conn, flags, prices_path)
+    if market is None:
+        rows = conn.execute("SELECT mp_rowid, supplier, nal, opt FROM temp.best_supplier").fetchall()
+    else:
+        rows = conn.execute("""
+            SELECT b.mp_rowid, b.supplier, b.nal, b.opt
+              FROM temp.best_supplier b
+              JOIN marketplace m ON m.rowid = b.mp_rowid
+             WHERE m.Маркетплейс = ?
+        """, (market,)).fetchall()
+    return {rowid: (supplier, int(nal), opt) for rowid, supplier, nal, opt in rows}
+
+
+def best_supplier_for_codes(conn, codes: dict, flags: dict | None = None,
+                            prices_path: str = SUP_DB_PATH) -> tuple[str, int, float | None]:
+    """
+    Тот же выбор для строки, которой нет в marketplace: codes = {поставщик: код}.
+    Возвращает (supplier, nal, opt) или ('', 0, None).
+    """
+    codes = [(name, str(code).strip()) for name, code in codes.items() if code and str(code).strip()]
+    if not codes:
+        return "", 0, None
+    prepare_best_supplier_view(conn, flags, prices_path)
+    values = ", ".join("(?, ?)" for _ in codes)
+    source = f"SELECT 0 AS mp_rowid, column1 AS supplier, {code_key_sql('column2')} AS code_key FROM (VALUES {values})"
+    row = conn.execute(
+        _best_supplier_sql(source), [v for pair in codes for v in pair]
+    ).fetchone()
+    if not row:
+        return "", 0, None
+    return row[1], int(row[2]), row[3]
+
+
+__all__ = [
+    "ensure_supplier_registry", "rebuild_supplier_codes", "list_suppliers", "upsert_supplier",
+    "set_supplier_code", "supplier_rows_clause", "supplier_conditions", "attach_prices",
+    "prepare_best_supplier_view", "fetch_best_suppliers", "best_supplier_for_codes", "code_key_sql", "code_key",
+    "SUP_DB_PATH",
+]
@@ -0,0 +1,202 @@
+"""
+Модуль `exporter` — потоковая выгрузка строк в CSV и XLSX без DataFrame целиком в памяти.
+
+Источник — пара (columns, rows): список названий колонок и итерируемое строк (кортежи).
+
+- table_rows(source, columns, filters, chunk_size):
+    (columns, rows) для таблицы маркетплейса (yandex / ozon / wildberries) или prices.
+    Выбор колонок и фильтры {колонка: значение или список значений} — в SQL,
+    строки читаются курсором порциями по chunk_size.
+
+- iter_csv(columns, rows):
+    Генератор байтов CSV (UTF-8 с BOM и разделителем «;» — Excel открывает как есть).
+    Подходит для Response(...) во Flask: файл отдаётся по мере чтения строк.
+
+- write_xlsx(columns, rows, sheet_name):
+    XLSX через XlsxWriter в режиме constant_memory (строки пишутся на диск по одной)
+    во временный файл: до SPOOL_MAX_BYTES — в памяти, дальше — на диске.
+    Возвращает файл, перемотанный в начало.
+"""
+
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+
+import xlsxwriter
+
+from db.suppliers import SUP_DB_PATH
+from services.stock_service import DB_PATH
+
+
+CSV_DELIMITER = ";"
+# Сколько строк CSV копить перед отдачей очередного куска
+CSV_CHUNK_ROWS = 1000
+# Порог, после которого временный XLSX-файл уходит из памяти на диск
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+# Источник выгрузки → (база, таблица, значение «Маркетплейс» или None)
+EXPORT_SOURCES = {
+    "yandex": (DB_PATH, "marketplace", "yandex"),
+    "ozon": (DB_PATH, "marketplace", "ozon"),
+    "wildberries": (DB_PATH, "marketplace", "wildberries"),
+    "prices": (SUP_DB_PATH, "prices", None),
+}
+
+CSV_MIMETYPE = "text/csv; charset=utf-8"
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_columns(conn, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def table_rows(source: str, columns=None, filters: dict | None = None, chunk_size: int = 1000):
+    """
+    Неизвестный источник, колонка или фильтр → ValueError.
+    Соединение закрывается, когда генератор дочитан или закрыт.
+    """
+    if source not in EXPORT_SOURCES:
+        raise ValueError(f"Неизвестная таблица: {source}")
+    db_path, table, market = EXPORT_SOURCES[source]
+
+    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+    try:
+        available = table_columns(conn, table)
+        selected = list(columns) if columns else list(available)
+        unknown = [c for c in [*selected, *(filters or {})] if c not in available]
+        if unknown:
+            raise ValueError(f"Неизвестные колонки: {', '.join(unknown)}")
+
+        where, params = [], []
+        if market is not None:
+            where.append('"Маркетплейс" = ?')
+            params.append(market)
+        for column, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            where.append(f"{_quote(column)} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+
+        sql = f"SELECT {', '.join(map(_quote, selected))} FROM {_quote(table)}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        cur = conn.execute(sql + " ORDER BY rowid", params)
+    except Exception:
+        conn.close()
+        raise
+
+    def rows():
+        try:
+            while True:
+                batch = cur.fetchmany(chunk_size)
+                if not batch:
+                    break
+                yield from batch
+        finally:
+            conn.close()
+
+    return selected, rows()
+
+
+def iter_csv(columns, rows, chunk_rows: int = CSV_CHUNK_ROWS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=CSV_DELIMITER)
+    writer.writerow(columns)
+    pending = 0
+    first = True
+
+    for row in rows:
+        writer.writerow(["" if v is None else v for v in row])
+        pending += 1
+        if pending >= chunk_rows:
+            yield _take(buffer, first)
+            first = False
+            pending = 0
+
+    yield _take(buffer, first)
+
+
+def _take(buffer: io.StringIO, first: bool) -> bytes:
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text.encode("utf-8-sig" if first else "utf-8")
+
+
+def write_xlsx(columns, rows, sheet_name: str = "Sheet1"):
+    output = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True, "strings_to_numbers": False})
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        header = workbook.add_format({"bold": True})
+        worksheet.write_row(0, 0, columns, header)
+        for i, row in enumerate(rows, start=1):
+            worksheet.write_row(i, 0, ["" if v is None else v for v in row])
+    finally:
+        workbook.close()
+    output.seek(0)
+    return output
+
+
+def _parse_filters(items) -> dict:
+    filters = {}
+    for item in items or []:
+        column, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Фильтр должен быть в виде колонка=значение: {item}")
+        filters.setdefault(column, []).append(value)
+    return filters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка таблицы маркетплейса или prices в CSV/XLSX")
+    parser.add_argument("source", choices=sorted(EXPORT_SOURCES))
+    parser.add_argument("-f", "--format", choices=("csv", "xlsx"), default="csv")
+    parser.add_argument("-c", "--columns", help="колонки через запятую (по умолчанию — все)")
+    parser.add_argument("--filter", action="append", metavar="КОЛОНКА=ЗНАЧЕНИЕ",
+                        help="фильтр по значению колонки (можно повторять)")
+    parser.add_argument("-o", "--output", help="файл (CSV по умолчанию — в stdout)")
+    args = parser.parse_args(argv)
+
+    if args.format == "xlsx" and not args.output:
+        parser.error("для xlsx нужен --output")
+    # Пути баз — относительно папки проекта (как в main.py), путь файла — относительно текущей
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(Path(__file__).resolve().parent)
+
+    try:
+        columns = [c.strip() for c in args.columns.split(",")] if args.columns else None
+        columns, rows = table_rows(args.source, columns, _parse_filters(args.filter))
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.format == "csv":
+        out = open(output, "wb") if output else sys.stdout.buffer
+        try:
+            for chunk in iter_csv(columns, rows):
+                out.write(chunk)
+        finally:
+            if output:
+                out.close()
+        return
+
+    with open(output, "wb") as out, write_xlsx(columns, rows, sheet_name=args.source) as tmp:
+        while chunk := tmp.read(1024 * 1024):
+            out.write(chunk)
+
+
+__all__ = [
+    "EXPORT_SOURCES", "table_rows", "iter_csv", "write_xlsx", "CSV_MIMETYPE", "XLSX_MIMETYPE",
+]
+
+
+if __name__ == "__main__":
+    main()
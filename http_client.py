@@ -0,0 +1,77 @@
+"""
+Модуль `http_client` — общий requests.Session для запросов к API маркетплейсов.
+
+Одна сессия на процесс: TCP/TLS-соединения с api-seller.ozon.ru, api.partner.market.yandex.ru,
+*.wildberries.ru переиспользуются между вызовами (keep-alive). Особенно важно для воркера
+(`main.py --worker`), где задачи выполняются в одном процессе по расписанию.
+
+Каждый запрос замеряется (metrics): ymwb_api_request_seconds{host, method}
+и ymwb_api_requests_total{host, method, code}.
+
+- set_base_urls(mapping) / API_BASE_URLS:
+    Подмена адресов API (стенд, заглушки bench/): {хост: базовый URL}. Из окружения —
+    API_BASE_URLS="api-seller.ozon.ru=http://127.0.0.1:8001,api.telegram.org=http://127.0.0.1:8002".
+    Запросы к перечисленным хостам уходят на базовый URL с тем же путём и параметрами.
+
+- api_url(url):
+    Адрес с учётом подмены — для библиотек со своим HTTP-клиентом (notifier).
+"""
+
+import os
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# Пул соединений на хост: задачи воркера могут идти параллельно
+POOL_SIZE = 10
+
+_base_urls = {}
+
+
+def set_base_urls(mapping: dict[str, str]):
+    _base_urls.clear()
+    _base_urls.update({host.strip().lower(): url.strip().rstrip("/") for host, url in mapping.items()})
+
+
+def _parse_base_urls(value: str) -> dict[str, str]:
+    pairs = (item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {host: url for host, url in pairs}
+
+
+def api_url(url: str) -> str:
+    if not _base_urls:
+        return url
+    parts = urlsplit(url)
+    base = _base_urls.get((parts.hostname or "").lower())
+    if base is None:
+        return url
+    return base + parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+class InstrumentedSession(requests.Session):
+    def request(self, method, url, *args, **kwargs):
+        host = urlsplit(str(url)).hostname or ""
+        method = str(method).upper()
+        code = "error"
+        started = time.perf_counter()
+        try:
+            response = super().request(method, api_url(str(url)), *args, **kwargs)
+            code = str(response.status_code)
+            return response
+        finally:
+            metrics.observe("ymwb_api_request_seconds", time.perf_counter() - started, host=host, method=method)
+            metrics.inc("ymwb_api_requests_total", host=host, method=method, code=code)
+
+
+http_session = InstrumentedSession()
+_adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+http_session.mount("https://", _adapter)
+http_session.mount("http://", _adapter)
+
+set_base_urls(_parse_base_urls(os.getenv("API_BASE_URLS", "")))
+
+__all__ = ["http_session", "set_base_urls", "api_url"]
@@ -0,0 +1,180 @@
+"""
+Модуль `job_runner` запускает длительные задачи (обновление склада и т.п.) в фоне,
+вне Flask-запроса.
+
+Основные возможности:
+
+- JobRunner.submit(name, func):
+    Ставит задачу в очередь и сразу возвращает объект Job с id.
+    Если задача с таким же именем уже стоит в очереди или выполняется —
+    новый запрос «склеивается» с ней (возвращается тот же Job).
+
+- Job.report(stage, message):
+    Задача сообщает о ходе выполнения по этапам. События хранятся в Job
+    и доступны для опроса (to_dict) или потоковой выдачи (wait_events → SSE).
+
+- JobRunner.get(job_id):
+    Возвращает задачу по id (последние `keep` задач хранятся в памяти).
+
+Длительность каждого этапа (от report до следующего report) и задачи целиком пишется
+в metrics: ymwb_job_stage_seconds{job, stage}, ymwb_job_seconds{job, status}.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from logger_config import job_context, logger, set_stage
+from metrics import metrics
+
+
+ACTIVE_STATUSES = ("queued", "running")
+# Этапы-итоги: отмечают конец задачи, их длительность не замеряется
+FINAL_STAGES = ("done", "error")
+
+
+class Job:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = "queued"
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.events = []
+        self.merged = 0  # сколько повторных запросов склеено с этой задачей
+        self._cond = threading.Condition()
+        self._stage = None  # (этап, perf_counter начала) — для замера длительности этапа
+
+    # --- ход выполнения ---
+    def report(self, stage: str, message: str = ""):
+        set_stage(stage)  # поле stage в записях лога этой задачи (см. logger_config.job_context)
+        now = time.perf_counter()
+        if self._stage is not None:
+            metrics.observe("ymwb_job_stage_seconds", now - self._stage[1], job=self.name, stage=self._stage[0])
+        self._stage = None if stage in FINAL_STAGES else (stage, now)
+        with self._cond:
+            self.events.append({
+                "stage": stage,
+                "message": message,
+                "time": datetime.now().strftime("%H:%M:%S"),
+            })
+            self._cond.notify_all()
+
+    def _set_status(self, status: str, error: str | None = None):
+        with self._cond:
+            self.status = status
+            if status == "running":
+                self.started_at = datetime.now()
+            elif status in ("done", "error"):
+                self.finished_at = datetime.now()
+                self.error = error
+            self._cond.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in ACTIVE_STATUSES
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Блокирует до завершения задачи. Возвращает True, если задача завершилась."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout=timeout)
+
+    def wait_events(self, after: int, timeout: float = 15.0) -> tuple[list, bool]:
+        """
+        Ждёт новых событий после индекса `after`.
+        Возвращает (новые события, задача завершена).
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.events) > after or self.finished, timeout=timeout)
+            return self.events[after:], self.finished
+
+    def to_dict(self) -> dict:
+        def fmt(dt):
+            return dt.strftime("%d.%m.%Y %H:%M:%S") if dt else None
+
+        # Снимок целиком под _cond: поток задачи меняет status/started_at/finished_at под той же блокировкой
+        with self._cond:
+            duration = None
+            if self.started_at:
+                end = self.finished_at or datetime.now()
+                duration = round((end - self.started_at).total_seconds(), 2)
+            return {
+                "job_id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "created_at": fmt(self.created_at),
+                "started_at": fmt(self.started_at),
+                "finished_at": fmt(self.finished_at),
+                "duration": duration,
+                "merged": self.merged,
+                "stage": self.events[-1]["stage"] if self.events else None,
+                "events": list(self.events),
+                "error": self.error,
+            }
+
+
+class JobRunner:
+    def __init__(self, max_workers: int = 1, keep: int = 50):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._active = {}  # name -> Job (в очереди или выполняется)
+        self._lock = threading.Lock()
+        self._keep = keep
+
+    def submit(self, name: str, func, *args, **kwargs) -> tuple[Job, bool]:
+        """
+        Ставит func(*args, progress=job.report, **kwargs) в очередь.
+        Возвращает (job, created): created=False, если запрос склеен с уже идущей задачей.
+        """
+        with self._lock:
+            active = self._active.get(name)
+            if active is not None and not active.finished:
+                active.merged += 1
+                logger.info(f"🔗 Задача '{name}' уже выполняется ({active.id}) → запрос объединён")
+                return active, False
+
+            job = Job(name)
+            self._jobs[job.id] = job
+            self._active[name] = job
+            while len(self._jobs) > self._keep:
+                self._jobs.popitem(last=False)
+
+        logger.info(f"📥 Задача '{name}' поставлена в очередь: {job.id}")
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job, True
+
+    def _run(self, job: Job, func, args, kwargs):
+        job._set_status("running")
+        started = time.perf_counter()
+        try:
+            with job_context(job.name, "running"):
+                try:
+                    func(*args, progress=job.report, **kwargs)
+                except Exception as e:
+                    logger.exception(f"❌ Задача '{job.name}' ({job.id}) завершилась с ошибкой")
+                    job.report("error", str(e))
+                    job._set_status("error", str(e))
+                else:
+                    job.report("done", f"{time.perf_counter() - started:.1f} с")
+                    job._set_status("done")
+        finally:
+            metrics.observe("ymwb_job_seconds", time.perf_counter() - started, job=job.name, status=job.status)
+            with self._lock:
+                if self._active.get(job.name) is job:
+                    del self._active[job.name]
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self, name: str) -> Job | None:
+        with self._lock:
+            return self._active.get(name)
+
+
+__all__ = ["Job", "JobRunner"]
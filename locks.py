@@ -0,0 +1,114 @@
+"""
+Модуль `locks` — именованные блокировки вместо одного глобального toggle_lock.
+
+Ключи блокировок:
+    "market:<маркетплейс>"   — строки marketplace одного маркетплейса (yandex / ozon / wildberries)
+    "supplier:<поставщик>"   — резервные копии и флаг конкретного поставщика
+    "prices"                 — таблица prices в !YMWB.db
+    "flags"                  — запись System/stock_flags.json
+
+LockManager.hold(*keys) захватывает несколько блокировок сразу, всегда в отсортированном порядке,
+поэтому взаимоблокировки между разными вызовами невозможны. Независимые операции (например,
+переключение разных маркетплейсов) выполняются параллельно, конфликтующие — по очереди.
+
+Для каждого ключа собирается статистика: сколько раз захватывался, сколько суммарно/максимум
+ждали захвата и сколько суммарно/максимум держали (см. metrics()).
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from logger_config import logger
+
+
+# Ожидание дольше этого порога пишем в лог
+SLOW_WAIT_SECONDS = 5.0
+
+
+class _LockStats:
+    __slots__ = ("acquired", "waiting", "wait_total", "wait_max", "held_total", "held_max", "holder")
+
+    def __init__(self):
+        self.acquired = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.held_total = 0.0
+        self.held_max = 0.0
+        self.holder = None
+
+    def to_dict(self) -> dict:
+        return {
+            "acquired": self.acquired,
+            "waiting": self.waiting,
+            "held_by": self.holder,
+            "wait_total": round(self.wait_total, 3),
+            "wait_max": round(self.wait_max, 3),
+            "wait_avg": round(self.wait_total / self.acquired, 3) if self.acquired else 0.0,
+            "held_total": round(self.held_total, 3),
+            "held_max": round(self.held_max, 3),
+            "held_avg": round(self.held_total / self.acquired, 3) if self.acquired else 0.0,
+        }
+
+
+class LockManager:
+    def __init__(self):
+        self._locks = {}
+        self._stats = {}
+        self._guard = threading.Lock()
+
+    def _get(self, key: str):
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.RLock()
+                self._stats[key] = _LockStats()
+            return lock, self._stats[key]
+
+    @contextmanager
+    def hold(self, *keys: str, owner: str | None = None):
+        """Захватывает все ключи (в отсортированном порядке) на время блока with."""
+        owner = owner or threading.current_thread().name
+        acquired = []
+        try:
+            for key in sorted(set(keys)):
+                lock, stats = self._get(key)
+                with self._guard:
+                    stats.waiting += 1
+                started = time.perf_counter()
+                lock.acquire()
+                waited = time.perf_counter() - started
+                with self._guard:
+                    stats.waiting -= 1
+                    stats.acquired += 1
+                    stats.wait_total += waited
+                    stats.wait_max = max(stats.wait_max, waited)
+                    stats.holder = owner
+                if waited >= SLOW_WAIT_SECONDS:
+                    logger.warning(f"🐢 Ожидание блокировки {key}: {waited:.1f} с ({owner})")
+                acquired.append((key, lock, stats, time.perf_counter()))
+            yield
+        finally:
+            for key, lock, stats, since in reversed(acquired):
+                held = time.perf_counter() - since
+                with self._guard:
+                    stats.held_total += held
+                    stats.held_max = max(stats.held_max, held)
+                    stats.holder = None
+                lock.release()
+
+    def metrics(self) -> dict:
+        with self._guard:
+            return {key: stats.to_dict() for key, stats in sorted(self._stats.items())}
+
+
+def market_key(market: str) -> str:
+    return f"market:{market.lower()}"
+
+
+def supplier_key(supplier: str) -> str:
+    return f"supplier:{supplier}"
+
+
+__all__ = ["LockManager", "market_key", "supplier_key"]
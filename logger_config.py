@@ -1,29 +1,106 @@
+"""
+Модуль `logger_config` — настройка loguru для всего проекта.
+
+Режим задаётся переменными окружения (или System/.env):
+    LOG_MODE=dev (по умолчанию) — DEBUG в консоль и app.log, запись синхронная (как раньше);
+    LOG_MODE=prod               — INFO; файл пишется через очередь (enqueue): вызов логгера не ждёт диска;
+    LOG_LEVEL=...               — уровень вместо уровня режима по умолчанию;
+    LOG_JSON=1                  — дополнительно app.jsonl: по JSON-записи на строку, в extra — поля job и stage.
+
+- is_enabled(level):
+    Включён ли уровень хотя бы в одном обработчике — проверка перед дорогими сообщениями в циклах.
+    Для отложенного форматирования: logger.opt(lazy=True).debug("{}", lambda: ...).
+
+- job_context(job, stage), set_stage(stage):
+    Поля job/stage для всех записей внутри блока with (в т.ч. из вызываемых функций);
+    set_stage меняет этап текущей задачи до конца блока.
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
+
+from dotenv import load_dotenv
 from loguru import logger
-import sys
 
 # Папка для логов
 LOG_DIR = Path("System/logs")
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
+load_dotenv(dotenv_path=Path("System") / ".env")  # уже заданные переменные окружения не перекрываются
+
+LOG_MODE = os.getenv("LOG_MODE", "dev").strip().lower()
+PRODUCTION = LOG_MODE == "prod"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO" if PRODUCTION else "DEBUG").strip().upper()
+LOG_JSON = os.getenv("LOG_JSON", "0").strip().lower() in ("1", "true", "yes")
+
+_job_fields = ContextVar("log_job_fields", default=None)
+
+
+def _add_job_fields(record):
+    fields = _job_fields.get()
+    if fields:
+        record["extra"].update(fields)
+
+
 # Удаляем все предыдущие обработчики
 logger.remove()
+logger.configure(extra={"job": None, "stage": None}, patcher=_add_job_fields)
 
 # Формат лога
 log_format = "{time:YYYY-MM-DD HH:mm:ss} | {level:<8} | {name}:{function}:{line} - {message}"
 
 # Поток в консоль
-logger.add(sys.stdout, format=log_format, level="DEBUG", colorize=False)
+logger.add(sys.stdout, format=log_format, level=LOG_LEVEL, colorize=False, diagnose=not PRODUCTION)
 
 # Запись в файл
 logger.add(
     LOG_DIR / "app.log",
     format=log_format,
-    level="DEBUG",
+    level=LOG_LEVEL,
     rotation="1 day",
     retention="7 days",
-    encoding="utf-8"
+    encoding="utf-8",
+    enqueue=PRODUCTION,
+    diagnose=not PRODUCTION,
 )
 
+# Структурированный журнал для разбора (jq, pandas.read_json(lines=True))
+if LOG_JSON:
+    logger.add(
+        LOG_DIR / "app.jsonl",
+        level=LOG_LEVEL,
+        serialize=True,
+        rotation="1 day",
+        retention="7 days",
+        encoding="utf-8",
+        enqueue=True,
+        diagnose=False,
+    )
+
+_min_level_no = logger.level(LOG_LEVEL).no
+
+
+def is_enabled(level: str) -> bool:
+    return logger.level(level).no >= _min_level_no
+
+
+@contextmanager
+def job_context(job: str, stage: str | None = None):
+    token = _job_fields.set({"job": job, "stage": stage})
+    try:
+        yield
+    finally:
+        _job_fields.reset(token)
+
+
+def set_stage(stage: str):
+    fields = _job_fields.get()
+    if fields is not None:
+        _job_fields.set({**fields, "stage": stage})
+
+
 # Экспорт
-__all__ = ["logger", "LOG_DIR"]
+__all__ = ["logger", "LOG_DIR", "is_enabled", "job_context", "set_stage"]
@@ -1,22 +1,32 @@
+"""
+Фоновый скрипт для cron: выгрузка остатков, проверка заказов, обновление цен.
+
+Импорт модуля лёгкий: stock / order_notifications / price_updater_master (а с ними pandas,
+gspread, requests, notifiers) импортируются внутри задач, которым они нужны.
+
+    python main.py                  — один прогон всех задач
+    python main.py --worker         — постоянный процесс со своим планировщиком (см. run_worker)
+    python main.py --check-startup  — замер `-X importtime` для `import main` против STARTUP_BUDGET_MS
+"""
+
 import os
 import sys
 import signal
-import json
 from pathlib import Path
-from stock import gen_sklad, wb_update, ym_update, oz_update
-from order_notifications import check_for_new_orders
-from price_updater_master import update_all_prices
-import stock
+
 from dotenv import load_dotenv
 
-load_dotenv(dotenv_path=Path(__file__).parent / "System" / ".env")
-from logger_config import logger
+BASE_DIR = Path(__file__).resolve().parent
 
+# 📦 Переход в директорию проекта (до logger_config — папка логов относительная)
+os.chdir(BASE_DIR)
+load_dotenv(dotenv_path=BASE_DIR / "System" / ".env")
 
-# 📦 Переход в директорию проекта
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+from logger_config import logger
 
-FLAGS_PATH = Path("System/stock_flags.json")
+# Бюджет на `import main` (мс) и модули, которых при импорте быть не должно
+STARTUP_BUDGET_MS = 250
+STARTUP_FORBIDDEN_MODULES = ("pandas", "numpy", "gspread", "flask", "apscheduler", "notifiers", "requests")
 
 STOCK_FIELD_NAMES = {
     "нал",
@@ -33,30 +43,6 @@ STOCK_FIELD_NAMES = {
 }
 
 
-def load_stock_flags():
-    try:
-        with FLAGS_PATH.open("r", encoding="utf-8") as f:
-            flags = json.load(f)
-    except Exception as e:
-        logger.warning(f"⚠️ Не удалось прочитать {FLAGS_PATH}: {e}. Используем все маркетплейсы ON.")
-        return {
-            "wildberries": True,
-            "yandex": True,
-            "ozon": True,
-            "suppliers": {},
-        }
-
-    flags.setdefault("wildberries", True)
-    flags.setdefault("yandex", True)
-    flags.setdefault("ozon", True)
-    flags.setdefault("suppliers", {})
-    return flags
-
-
-def is_market_enabled(flags: dict, market: str) -> bool:
-    return bool(flags.get(market, True))
-
-
 def is_stock_field(field_name) -> bool:
     normalized = str(field_name).strip().lower().replace(" ", "_").replace("-", "_")
     return normalized in STOCK_FIELD_NAMES
@@ -128,9 +114,11 @@ def zero_stock_payload(payload, market: str):
 
 # 📬 Телеграм-уведомление
 def send_telegram_message(message: str):
-    stock.telegram.notify(
-        token=stock.telegram_got_token_error,
-        chat_id=stock.telegram_chat_id_error,
+    from notifier import telegram
+
+    telegram.notify(
+        token=os.getenv('telegram_got_token_error'),
+        chat_id=os.getenv('telegram_chat_id_error'),
         message=message
     )
 
@@ -142,25 +130,28 @@ def handle_exit_signal(signum, frame):
     sys.exit(0)
 
 
-# Установка сигналов завершения
-signal.signal(signal.SIGTERM, handle_exit_signal)
-signal.signal(signal.SIGINT, handle_exit_signal)
-
-
 # 🛠 Универсальная обёртка для try/except с логом и телеграмом
-def run_safe(action_description: str, func):
+# fatal=True — разовый запуск (cron): ошибка завершает процесс;
+# fatal=False — воркер: ошибка логируется, процесс продолжает работу.
+def run_safe(action_description: str, func, fatal: bool = True) -> bool:
     try:
         logger.info(f"▶ Начало: {action_description}")
         func()
         logger.success(f"✅ Завершено: {action_description}")
+        return True
     except Exception as e:
         logger.exception(f"❌ Ошибка при {action_description}")
         send_telegram_message(f"😨 Ошибка при {action_description}: {e}")
-        sys.exit(1)
+        if fatal:
+            sys.exit(1)
+        return False
 
 
 # 🔁 Обновление остатков
-def run_price_updates():
+def run_price_updates(fatal: bool = True):
+    from stock import gen_sklad, wb_update, ym_update, oz_update
+    from services.stock_service import is_market_enabled, load_stock_flags
+
     try:
         logger.info("📦 Получаем складские остатки...")
         wb_data, ym_data, oz_data = gen_sklad()
@@ -168,7 +159,9 @@ def run_price_updates():
     except Exception as e:
         logger.exception("❌ Ошибка при получении данных из БД")
         send_telegram_message(f"❌ Ошибка при получении данных из БД: {e}")
-        sys.exit(1)
+        if fatal:
+            sys.exit(1)
+        return
 
     flags = load_stock_flags()
 
@@ -186,11 +179,19 @@ def run_price_updates():
 
         run_safe(
             description,
-            lambda update_func=update_func, sync_payload=sync_payload: update_func(sync_payload)
+            lambda update_func=update_func, sync_payload=sync_payload: update_func(sync_payload),
+            fatal=fatal
         )
 
 # 🚀 Основной запуск
 def main():
+    from order_notifications import check_for_new_orders
+    from price_updater_master import update_all_prices
+
+    # Установка сигналов завершения
+    signal.signal(signal.SIGTERM, handle_exit_signal)
+    signal.signal(signal.SIGINT, handle_exit_signal)
+
     logger.info("🚀 Старт фонового процесса")
     # send_telegram_message("Программа запущена⭐️")
 
@@ -201,5 +202,147 @@ def main():
     logger.success("🏁 Все задачи завершены успешно")
 
 
+# 🔄 Воркер: постоянный процесс со своим планировщиком
+# Интервалы (минуты) — переменные окружения WORKER_STOCK_MINUTES / WORKER_ORDERS_MINUTES / WORKER_PRICES_MINUTES
+WORKER_INTERVALS = {
+    "stock": int(os.getenv("WORKER_STOCK_MINUTES", "5")),
+    "orders": int(os.getenv("WORKER_ORDERS_MINUTES", "2")),
+    "prices": int(os.getenv("WORKER_PRICES_MINUTES", "15")),
+}
+
+
+def run_worker():
+    """
+    Задачи остатков, заказов и цен — в одном процессе, каждая со своим интервалом.
+    Импорты, HTTP-сессия (http_client) и кэши (флаги, реестр поставщиков) живут всё время работы.
+    SIGTERM/SIGINT: новые запуски не начинаются, выполняющиеся задачи доводятся до конца.
+    """
+    import threading
+    from datetime import datetime
+
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from scheduler.jobs import JobRegistry
+    from order_notifications import check_for_new_orders
+    from price_updater_master import update_all_prices
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if not stop.is_set():
+            logger.info("📴 Получен сигнал завершения → ждём окончания текущих задач")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    jobs = [
+        ("stock", "выгрузке остатков", lambda: run_price_updates(fatal=False)),
+        ("orders", "проверке новых заказов маркетплейсов", check_for_new_orders),
+        ("prices", "обновлении всех цен", update_all_prices),
+    ]
+
+    # Без наложения запусков, с историей длительностей и предупреждением о перерасходе (scheduler/jobs.py)
+    registry = JobRegistry(alert=send_telegram_message)
+    for job_id, description, func in jobs:
+        registry.add(
+            job_id, run_safe, "interval",
+            minutes=WORKER_INTERVALS[job_id],
+            args=[description, func],
+            kwargs={"fatal": False},
+            jitter=10,
+            next_run_time=datetime.now(),  # первый запуск — сразу
+        )
+    scheduler = BackgroundScheduler()
+    registry.install(scheduler)
+    scheduler.start()
+    logger.info(
+        "🚀 Воркер запущен: "
+        + ", ".join(f"{job_id} каждые {WORKER_INTERVALS[job_id]} мин" for job_id, _, _ in jobs)
+    )
+
+    while not stop.wait(1):
+        pass
+
+    scheduler.shutdown(wait=True)
+    logger.success("🏁 Воркер остановлен, текущие задачи завершены")
+    send_telegram_message("Программа завершена❗️")
+
+
+# ⏱ Проверка времени запуска
+def _parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    """Строки `import time: self | cumulative | name` → [(name с отступом, self_us, cumulative_us)]."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        head, cumulative, name = line.split("|", 2)
+        self_us = head.split(":", 1)[1].strip()
+        if not self_us.isdigit():  # заголовок таблицы
+            continue
+        rows.append((name.rstrip(), int(self_us), int(cumulative.strip())))
+    return rows
+
+
+def check_startup(budget_ms: int = STARTUP_BUDGET_MS) -> bool:
+    """
+    Запускает `python -X importtime -c "import main"` в отдельном процессе и проверяет:
+    - суммарное время импорта main не больше budget_ms;
+    - тяжёлые модули из STARTUP_FORBIDDEN_MODULES не импортируются при старте.
+    """
+    import subprocess
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BASE_DIR, capture_output=True, text=True, timeout=60
+    )
+    if result.returncode != 0:
+        logger.error(f"❌ import main завершился с ошибкой:\n{result.stderr[-2000:]}")
+        return False
+
+    rows = _parse_importtime(result.stderr)
+    main_idx = next((i for i, (name, _, _) in enumerate(rows) if name.strip() == "main"), None)
+    if main_idx is None:
+        logger.error("❌ В выводе -X importtime нет модуля main")
+        return False
+    total_ms = rows[main_idx][2] / 1000
+
+    # модули, импортированные при импорте main, идут в выводе прямо перед ним (с большим отступом)
+    start = main_idx
+    while start > 0 and rows[start - 1][0].startswith("   "):
+        start -= 1
+    children = rows[start:main_idx]
+
+    loaded = {name.strip().split(".")[0] for name, _, _ in children}
+    forbidden = sorted(loaded & set(STARTUP_FORBIDDEN_MODULES))
+
+    heaviest = sorted(
+        ((name.strip(), cum) for name, _, cum in children if not name.startswith("    ")),
+        key=lambda item: item[1], reverse=True
+    )[:5]
+    for name, cum in heaviest:
+        logger.info(f"⏱ {name}: {cum / 1000:.1f} мс")
+
+    ok = total_ms <= budget_ms and not forbidden
+    if forbidden:
+        logger.error(f"❌ При старте импортированы тяжёлые модули: {', '.join(forbidden)}")
+    log = logger.success if ok else logger.error
+    log(f"{'✅' if ok else '❌'} import main: {total_ms:.1f} мс (бюджет {budget_ms} мс)")
+    return ok
+
+
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Фоновые задачи: остатки, заказы, цены")
+    parser.add_argument("--check-startup", action="store_true",
+                        help="проверить время импорта main против бюджета и выйти")
+    parser.add_argument("--worker", action="store_true",
+                        help="постоянный процесс: остатки, заказы и цены по своим интервалам")
+    args = parser.parse_args()
+
+    if args.check_startup:
+        sys.exit(0 if check_startup() else 1)
+    if args.worker:
+        run_worker()
+    else:
+        main()
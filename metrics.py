@@ -0,0 +1,188 @@
+"""
+Модуль `metrics` — лёгкие метрики процесса: счётчики и гистограммы длительностей.
+
+Метрики живут в памяти процесса (веб-приложение и воркер `main.py --worker` считают каждый своё)
+и отдаются:
+    - в текстовом формате Prometheus (render) — маршрут /metrics;
+    - сводкой с перцентилями по последним RECENT_WINDOW замерам (summary) — страница /metrics/dashboard.
+
+- metrics.timer(name, **labels):
+    Контекстный менеджер и декоратор: замеряет длительность блока/функции в секундах.
+    Исключение тоже замеряется и дополнительно считается в ymwb_errors_total{metric=name}.
+
+- metrics.observe(name, seconds, **labels) / metrics.inc(name, value, **labels):
+    Ручная запись замера / увеличение счётчика.
+
+Метки — только с небольшим набором значений (маркетплейс, этап, хост), не id и не артикулы:
+на каждый набор меток хранится отдельная гистограмма.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# Границы корзин гистограмм, секунды: от быстрых SQL до минутных выгрузок
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Сколько последних замеров хранить для перцентилей
+RECENT_WINDOW = 500
+PERCENTILES = (50, 90, 99)
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Histogram:
+    __slots__ = ("counts", "count", "sum", "max", "recent")
+
+    def __init__(self, buckets):
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_WINDOW)
+
+    def observe(self, buckets, value: float):
+        index = bisect.bisect_left(buckets, value)
+        if index < len(buckets):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+
+def _percentile(ordered, p: int) -> float:
+    """Ближайший ранг по отсортированному списку."""
+    index = max(0, min(len(ordered) - 1, -(-len(ordered) * p // 100) - 1))
+    return ordered[index]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(labels, extra=()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._help = {}        # имя → (тип, описание)
+        self._counters = {}    # (имя, метки) → значение
+        self._histograms = {}  # (имя, метки) → _Histogram
+
+    def describe(self, name: str, kind: str, help_text: str):
+        """kind — "counter" или "histogram"; описание попадает в # HELP."""
+        self._help[name] = (kind, help_text)
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(self.buckets, seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc("ymwb_errors_total", metric=name)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(h.counts), h.count, h.sum)) for key, h in self._histograms.items()
+            )
+
+        lines = []
+        described = set()
+
+        def header(name, default_kind):
+            if name in described:
+                return
+            described.add(name)
+            kind, help_text = self._help.get(name, (default_kind, name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels_text(labels)} {_number(value)}")
+
+        for (name, labels), (counts, count, total) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels_text(labels, [('le', _number(float(bound)))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels_text(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels_text(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[dict]:
+        """Гистограммы для страницы метрик: число замеров, среднее, максимум и перцентили последних замеров."""
+        with self._lock:
+            items = sorted(
+                (key, h.count, h.sum, h.max, sorted(h.recent)) for key, h in self._histograms.items()
+            )
+
+        rows = []
+        for (name, labels), count, total, peak, recent in items:
+            row = {
+                "name": name,
+                "labels": ", ".join(f"{k}={v}" for k, v in labels),
+                "count": count,
+                "avg": round(total / count, 4) if count else 0.0,
+                "max": round(peak, 4),
+            }
+            for p in PERCENTILES:
+                row[f"p{p}"] = round(_percentile(recent, p), 4) if recent else 0.0
+            rows.append(row)
+        return rows
+
+
+metrics = Metrics()
+
+metrics.describe("ymwb_errors_total", "counter", "Исключения внутри замеров metrics.timer, по имени метрики")
+metrics.describe("ymwb_gen_sklad_seconds", "histogram", "Сборка склада: source=sheets (update_sklad) или db (stock)")
+metrics.describe("ymwb_job_stage_seconds", "histogram", "Этапы фоновых задач job_runner (update_sklad и др.)")
+metrics.describe("ymwb_job_seconds", "histogram", "Фоновые задачи job_runner целиком")
+metrics.describe("ymwb_api_request_seconds", "histogram", "Запросы к API маркетплейсов через http_client")
+metrics.describe("ymwb_api_requests_total", "counter", "Запросы к API маркетплейсов по коду ответа (error — без ответа)")
+metrics.describe("ymwb_sheets_seconds", "histogram", "Вызовы Google Sheets")
+metrics.describe("ymwb_http_server_seconds", "histogram", "Обработка запросов Flask по маршрутам")
+metrics.describe("ymwb_render_seconds", "histogram", "Рендеринг шаблонов")
+
+
+__all__ = ["Metrics", "metrics", "PROMETHEUS_MIMETYPE"]
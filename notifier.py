@@ -0,0 +1,35 @@
+"""
+Модуль `notifier` — Telegram-уведомления с отложенным импортом библиотеки notifiers.
+
+notifiers при импорте тянет pkg_resources/distutils (~0.3 с), поэтому уведомитель создаётся
+при первой отправке, а не при импорте модулей stock / order_notifications / price_updater_master.
+Интерфейс тот же: telegram.notify(token=..., chat_id=..., message=..., ...).
+Адрес Bot API учитывает подмену хостов http_client (API_BASE_URLS).
+"""
+
+import threading
+
+from http_client import api_url
+
+
+class _LazyTelegram:
+    def __init__(self):
+        self._notifier = None
+        self._base_url = None
+        self._lock = threading.Lock()
+
+    def notify(self, **kwargs):
+        if self._notifier is None:
+            with self._lock:
+                if self._notifier is None:
+                    from notifiers import get_notifier
+                    self._notifier = get_notifier('telegram')
+                    self._base_url = self._notifier.base_url
+        # base_url — шаблон вида https://api.telegram.org/bot{token}; подмена только меняет хост
+        self._notifier.base_url = api_url(self._base_url)
+        return self._notifier.notify(**kwargs)
+
+
+telegram = _LazyTelegram()
+
+__all__ = ["telegram"]
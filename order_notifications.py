@@ -29,15 +29,14 @@ Yandex.Market, Wildberries и Ozon, уведомления о них в Telegram
 
 import os
 import sqlite3
-import requests
-import pandas as pd
-import gspread
+from http_client import http_session
 
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from logger_config import logger
-from notifiers import get_notifier
-from web_app import choose_best_supplier_for_row
+from metrics import metrics
+from notifier import telegram
+from services.supplier_selector import choose_best_supplier_for_row
 
 
 # Загрузка переменных окружения из .env
@@ -46,11 +45,11 @@ load_dotenv(dotenv_path=os.path.join("System", ".env"))
 # Настройка Telegram-уведомлений
 telegram_got_token = os.getenv('telegram_got_token')
 telegram_chat_id = os.getenv('telegram_chat_id')
-telegram = get_notifier('telegram')
 
 # --- Счётчик заказов с ежедневным сбросом ---
 counter_file = "System/order_counter.txt"
 
+@metrics.timer("ymwb_sheets_seconds", call="write_order")
 def write_order_to_gsheets(platform, order_id, items_to_update, rrc_price, supplier_fixed):
 
 
@@ -67,6 +66,9 @@ def write_order_to_gsheets(platform, order_id, items_to_update, rrc_price, suppl
         logger.error(f"❌ Неизвестная платформа: {platform}")
         return
 
+    import gspread
+    import pandas as pd
+
     # Подключение Google Sheets
     gc = gspread.service_account(filename="System/my-python-397519-3688db4697d6.json")
     sh = gc.open("КАЗНА")
@@ -196,6 +198,9 @@ def get_today_order_number():
 
 
 def update_stock(articul, platform, quantity=1):
+    import gspread
+    import pandas as pd
+
     logger.info(f"🔁 Вычитание со склада: {articul} | Платформа: {platform}")
     platform = platform.lower()
     db_path = "System/marketplace_base.db"
@@ -203,7 +208,7 @@ def update_stock(articul, platform, quantity=1):
     articul = str(articul).strip()
 
     df = pd.read_sql_query(
-        "SELECT * FROM marketplace WHERE Sklad = ? AND Маркетплейс = ?",
+        "SELECT rowid, * FROM marketplace WHERE Sklad = ? AND Маркетплейс = ?",
         conn,
         params=(articul, platform)
     )
@@ -223,7 +228,7 @@ def update_stock(articul, platform, quantity=1):
     stock = int(row.get("Нал", 0))
     # Определяем поставщика по новой логике
     row_dict = row.to_dict()
-    chosen_supplier, _, _ = choose_best_supplier_for_row(row_dict, None, use_row_sklad=True)
+    chosen_supplier, _, _ = choose_best_supplier_for_row(row_dict, conn)
     supplier = chosen_supplier or "N/A"
     opt_price = format_price(row.get("Опт"))
     artikul_alt = row.get(supplier, "")
@@ -232,10 +237,11 @@ def update_stock(articul, platform, quantity=1):
     if supplier.lower() == 'sklad':
         try:
             # --- Работа с Google Sheets ---
-            gc = gspread.service_account(filename='System/my-python-397519-3688db4697d6.json')
-            sh = gc.open("КАЗНА")
-            worksheet = sh.worksheet("СКЛАД")
-            data = worksheet.get_all_values()
+            with metrics.timer("ymwb_sheets_seconds", call="read_sklad"):
+                gc = gspread.service_account(filename='System/my-python-397519-3688db4697d6.json')
+                sh = gc.open("КАЗНА")
+                worksheet = sh.worksheet("СКЛАД")
+                data = worksheet.get_all_values()
             sklad = pd.DataFrame(data[1:], columns=data[0])
 
             sklad['Наличие'] = pd.to_numeric(sklad['Наличие'], errors='coerce').fillna(0).astype(int)
@@ -249,7 +255,8 @@ def update_stock(articul, platform, quantity=1):
                 new_q = sklad.at[row_index, 'Наличие']
 
                 updated_data = sklad.iloc[:, :8].replace([float('inf'), float('-inf')], 0).fillna(0).values.tolist()
-                worksheet.update('A2:H', updated_data, value_input_option='USER_ENTERED')
+                with metrics.timer("ymwb_sheets_seconds", call="update_sklad"):
+                    worksheet.update('A2:H', updated_data, value_input_option='USER_ENTERED')
 
                 # --- формируем сообщение в зависимости от остатка ---
                 if prev_q == 0:
@@ -363,7 +370,7 @@ def get_orders_yandex_market():
         "status": "PROCESSING",
         "substatus": "STARTED"
     }
-    response = requests.get(url_ym, headers=headers, params=params, timeout=10)
+    response = http_session.get(url_ym, headers=headers, params=params, timeout=10)
     if response.status_code == 200:
         orders_data = response.json().get('orders', [])  # Получаем список заказов
         logger.success(f"✅ Заказы от Yandex получены: {len(orders_data)} шт.")
@@ -379,7 +386,7 @@ def get_orders_wildberries():
     wb_api_token = os.getenv('wb_token')
     url = 'https://marketplace-api.wildberries.ru/api/v3/orders/new'
     headers = {'Authorization': wb_api_token}
-    response = requests.get(url, headers=headers, timeout=10)
+    response = http_session.get(url, headers=headers, timeout=10)
     if response.status_code == 200:
         orders = response.json().get('orders', [])
         logger.success(f"✅ Заказы от WB получены: {len(orders)} шт.")
@@ -420,7 +427,7 @@ def get_orders_ozon():
             "translit": True  # Включить транслитерацию
         }
     }
-    response = requests.post(url, headers=headers, json=payload, timeout=10)
+    response = http_session.post(url, headers=headers, json=payload, timeout=10)
     if response.status_code == 200:
         # Фильтруем заказы с нужным статусом 'awaiting_packaging'
         orders = response.json().get("result", {}).get("postings", [])
@@ -1,16 +1,18 @@
-import requests
+from http_client import http_session
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from loguru import logger
 from datetime import datetime, timezone, timedelta
-from notifiers import get_notifier
+from notifier import telegram
 from pathlib import Path
 
 # Загрузка переменных окружения
 load_dotenv(dotenv_path=Path(__file__).resolve().parent / "System" / ".env")
 
 # Telegram уведомления
-telegram = get_notifier('telegram')
 telegram_got_token = os.getenv('telegram_got_token')
 telegram_chat_id = os.getenv('telegram_chat_id')
 
@@ -28,6 +30,19 @@ URL_LIST_ACTIONS = "https://api-seller.ozon.ru/v1/actions"
 URL_GET_PRODUCTS = "https://api-seller.ozon.ru/v1/actions/products"
 URL_REMOVE_PRODUCTS = "https://api-seller.ozon.ru/v1/actions/products/deactivate"
 
+# (подключение, чтение) — секунды
+REQUEST_TIMEOUT = (5, 30)
+# Сколько акций сканируется одновременно (не больше пула http_client)
+MAX_WORKERS = 4
+# Сколько товаров снимать с акции одним запросом
+DEACTIVATE_CHUNK_SIZE = 100
+# Сколько секунд не пересканировать акцию, в которой не нашлось товаров
+EMPTY_ACTION_TTL = 3600
+
+# (id, число товаров, участие) → момент, до которого акция считается пустой
+_empty_actions = {}
+_empty_actions_lock = threading.Lock()
+
 def format_iso_date(date_str, hide_year=False):
     try:
         dt = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%SZ")
@@ -38,37 +53,155 @@ def format_iso_date(date_str, hide_year=False):
     except Exception:
         return date_str
 
-def remove_all_products_from_all_actions(limit_per_page=100):
-    logger.info("\n🚨 НАЧАЛО: отключение всех товаров из всех активных акций на Ozon\n")
+def _post(url, payload):
+    return http_session.post(url, json=payload, headers=HEADERS, timeout=REQUEST_TIMEOUT)
+
+
+def _fetch_action_product_ids(action_id, limit_per_page):
+    """Все id товаров акции (страницы по курсору last_id — внутри акции последовательно)."""
+    product_ids = []
+    last_id = ""
+    pages = 0
+    while True:
+        r = _post(URL_GET_PRODUCTS, {"action_id": action_id, "limit": limit_per_page, "last_id": last_id})
+        if r.status_code != 200:
+            raise RuntimeError(f"получение товаров: {r.status_code} — {r.text}")
+        pages += 1
+
+        result = r.json().get("result", {})
+        products = result.get("products", [])
+        product_ids.extend(p["id"] for p in products)
+        last_id = result.get("last_id", "")
+
+        if not products or not last_id:
+            return product_ids, pages
+
+
+def _deactivate(action_id, product_ids):
+    """Снятие товаров с акции пачками по DEACTIVATE_CHUNK_SIZE → (removed, rejected, ошибки)."""
+    removed, rejected, errors = [], [], []
+    for start in range(0, len(product_ids), DEACTIVATE_CHUNK_SIZE):
+        chunk = product_ids[start:start + DEACTIVATE_CHUNK_SIZE]
+        try:
+            r = _post(URL_REMOVE_PRODUCTS, {"action_id": action_id, "product_ids": chunk})
+        except Exception as e:
+            errors.append(f"удаление {len(chunk)} товаров: {e}")
+            continue
+        if r.status_code != 200:
+            errors.append(f"удаление {len(chunk)} товаров: {r.status_code} — {r.text}")
+            continue
+        result = r.json().get("result", {})
+        removed.extend(result.get("product_ids", []))
+        rejected.extend(result.get("rejected", []))
+    return removed, rejected, errors
+
 
-    response = requests.get(URL_LIST_ACTIONS, headers=HEADERS)
+def _clean_action(action, limit_per_page):
+    """Скан и очистка одной акции (выполняется в пуле потоков)."""
+    action_id = action.get("id")
+    started = time.monotonic()
+    result = {"id": action_id, "title": action.get("title", "Без названия"),
+              "found": 0, "pages": 0, "removed": 0, "rejected": [], "errors": []}
+    try:
+        product_ids, result["pages"] = _fetch_action_product_ids(action_id, limit_per_page)
+        result["found"] = len(product_ids)
+        if product_ids:
+            removed, rejected, errors = _deactivate(action_id, product_ids)
+            result["removed"] = len(removed)
+            result["rejected"] = rejected
+            result["errors"].extend(errors)
+    except Exception as e:
+        result["errors"].append(str(e))
+    result["seconds"] = round(time.monotonic() - started, 2)
+    return result
+
+
+def _empty_cache_key(action):
+    # Пустая акция пересканируется, если в списке акций изменилось число товаров или участие
+    return action.get("id"), action.get("participating_products_count", 0), bool(action.get("is_participating"))
+
+
+def list_actions() -> list[dict]:
+    """Список акций — один лёгкий запрос без товаров."""
+    response = http_session.get(URL_LIST_ACTIONS, headers=HEADERS, timeout=REQUEST_TIMEOUT)
     if response.status_code != 200:
-        logger.error(f"❌ Ошибка при получении списка акций: {response.status_code} — {response.text}")
-        return
+        raise RuntimeError(f"{response.status_code} — {response.text}")
+    return response.json().get("result", [])
+
+
+def actions_snapshot(actions) -> frozenset:
+    """Что сравнивается между проверками: набор акций, число товаров в них и участие."""
+    return frozenset(
+        (a.get("id"), a.get("participating_products_count", 0), bool(a.get("is_participating")))
+        for a in actions
+    )
 
-    actions = response.json().get("result", [])
+
+def remove_all_products_from_all_actions(limit_per_page=100, actions=None) -> dict:
+    """
+    Снимает все товары со всех акций Ozon. Акции обрабатываются параллельно (до MAX_WORKERS),
+    пустые акции запоминаются на EMPTY_ACTION_TTL и не сканируются повторно.
+    actions — уже полученный список акций (list_actions), чтобы не запрашивать его второй раз.
+    Возвращает {"actions", "scanned", "skipped_empty", "removed", "rejected", "errors", "timings", "results"}.
+    """
+    logger.info("\n🚨 НАЧАЛО: отключение всех товаров из всех активных акций на Ozon\n")
+    started = time.monotonic()
+    summary = {"actions": 0, "scanned": 0, "skipped_empty": 0, "removed": 0, "rejected": 0,
+               "errors": [], "timings": {}, "results": []}
+
+    if actions is None:
+        try:
+            actions = list_actions()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при получении списка акций: {e}")
+            summary["errors"].append(f"список акций: {e}")
+            return summary
+
+    summary["actions"] = len(actions)
+    summary["timings"]["list"] = round(time.monotonic() - started, 2)
     logger.info(f"📋 Найдено акций: {len(actions)}\n")
 
+    now = time.monotonic()
+    with _empty_actions_lock:
+        for key in [k for k, expires in _empty_actions.items() if expires <= now]:
+            del _empty_actions[key]
+        known_empty = set(_empty_actions)
+
+    to_scan = []
+    for action in actions:
+        if action.get("participating_products_count", 0) == 0 and not action.get("is_participating", False):
+            continue
+        if _empty_cache_key(action) in known_empty:
+            summary["skipped_empty"] += 1
+            continue
+        to_scan.append(action)
+
+    scan_started = time.monotonic()
+    results = []
+    if to_scan:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(to_scan)), thread_name_prefix="ozon-actions") as pool:
+            results = list(pool.map(lambda a: _clean_action(a, limit_per_page), to_scan))
+    summary["timings"]["scan"] = round(time.monotonic() - scan_started, 2)
+    summary["scanned"] = len(to_scan)
+
     total_removed = 0
     telegram_report = [f"📋 Акций на Ozon: {len(actions)}\n"]
 
-    for action in actions:
-        action_id = action.get("id")
-        action_title = action.get("title", "Без названия")
+    for action, result in zip(to_scan, results):
+        action_id = result["id"]
+        action_title = result["title"]
         date_start = format_iso_date(action.get("date_start", "—"), hide_year=True)
         date_end = format_iso_date(action.get("date_end", "—"), hide_year=True)
         is_participating = action.get("is_participating", False)
         product_count = action.get("participating_products_count", 0)
 
-        if product_count == 0 and not is_participating:
-            continue
-
         logger.info("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
         logger.info(f"🔸 Акция: {action_title}")
         logger.info(f"🆔 ID акции: {action_id}")
         logger.info(f"📅 Период действия: с {date_start} до {date_end}")
         logger.info(f"📦 Товаров в акции: {product_count}")
         logger.info(f"📍 Участие продавца: {'ДА' if is_participating else 'НЕТ'}")
+        logger.info(f"⏱ Страниц: {result['pages']}, время: {result['seconds']:.2f} с")
 
         report_block = [
             f"✔️ {action_title}",
@@ -77,60 +210,33 @@ def remove_all_products_from_all_actions(limit_per_page=100):
             f"Товаров: {product_count} | Участие: {'ДА' if is_participating else 'НЕТ'}"
         ]
 
-        all_product_ids = []
-        last_id = ""
-
-        while True:
-            payload = {
-                "action_id": action_id,
-                "limit": limit_per_page,
-                "last_id": last_id
-            }
-            r = requests.post(URL_GET_PRODUCTS, json=payload, headers=HEADERS)
-            if r.status_code != 200:
-                logger.error(f"❌ Ошибка при получении товаров акции {action_id}: {r.status_code} — {r.text}")
-                break
-
-            result = r.json().get("result", {})
-            products = result.get("products", [])
-            all_product_ids.extend([p["id"] for p in products])
-            last_id = result.get("last_id", "")
-
-            if not products or not last_id:
-                break
-
-        if not all_product_ids:
-            logger.info("⏭ Комментарий: Нет товаров для удаления")
-            report_block.append("Комментарий: Нет товаров для удаления")
-            telegram_report.append("\n" + "\n".join(report_block))
-            continue
-
-        logger.info(f"🗑 Удаляем {len(all_product_ids)} товаров из акции: {action_title}")
+        for error in result["errors"]:
+            logger.error(f"❌ Ошибка в акции {action_id}: {error}")
+            summary["errors"].append(f"{action_id}: {error}")
+        summary["results"].append({**result, "rejected": len(result["rejected"])})
 
-        delete_payload = {
-            "action_id": action_id,
-            "product_ids": all_product_ids
-        }
-
-        del_response = requests.post(URL_REMOVE_PRODUCTS, json=delete_payload, headers=HEADERS)
-        if del_response.status_code != 200:
-            logger.error(f"❌ Ошибка при удалении товаров из акции {action_id}: {del_response.status_code} — {del_response.text}")
+        if not result["found"]:
+            if not result["errors"]:
+                with _empty_actions_lock:
+                    _empty_actions[_empty_cache_key(action)] = time.monotonic() + EMPTY_ACTION_TTL
+                logger.info("⏭ Комментарий: Нет товаров для удаления")
+                report_block.append("Комментарий: Нет товаров для удаления")
+                telegram_report.append("\n" + "\n".join(report_block))
             continue
 
-        del_result = del_response.json().get("result", {})
-        removed = del_result.get("product_ids", [])
-        rejected = del_result.get("rejected", [])
-
-        logger.success(f"✅ Удалено из акции: {len(removed)} товаров")
-        report_block.append(f"Удалено: {len(removed)} товаров")
-        if rejected:
-            logger.warning(f"⚠ Не удалось удалить: {len(rejected)} товаров — {rejected}")
-            report_block.append(f"Не удалено: {len(rejected)} товаров")
+        logger.success(f"✅ Удалено из акции: {result['removed']} товаров из {result['found']}")
+        report_block.append(f"Удалено: {result['removed']} товаров")
+        if result["rejected"]:
+            logger.warning(f"⚠ Не удалось удалить: {len(result['rejected'])} товаров — {result['rejected']}")
+            report_block.append(f"Не удалено: {len(result['rejected'])} товаров")
 
         telegram_report.append("\n" + "\n".join(report_block))
-        total_removed += len(removed)
+        total_removed += result["removed"]
+        summary["rejected"] += len(result["rejected"])
 
     logger.info("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+    summary["removed"] = total_removed
+    summary["timings"]["total"] = round(time.monotonic() - started, 2)
 
     if total_removed:
         logger.info(f"🏁 Завершено. Всего удалено товаров из акций: {total_removed}")
@@ -147,5 +253,95 @@ def remove_all_products_from_all_actions(limit_per_page=100):
     else:
         logger.info("🏁 Завершено. Товаров в акциях не было — удаление не потребовалось.")
 
+    logger.info(
+        f"⏱ Акции Ozon: список {summary['timings']['list']:.2f} с, скан {summary['scanned']} акций "
+        f"{summary['timings']['scan']:.2f} с (пустых из кэша: {summary['skipped_empty']}), "
+        f"всего {summary['timings']['total']:.2f} с"
+    )
+    return summary
+
+class ActionsWatcher:
+    """
+    Адаптивная проверка акций: tick() вызывается часто (раз в минуту), но список акций
+    запрашивается только когда подошёл срок. Полный скан товаров — только если список акций
+    (actions_snapshot) изменился с прошлой проверки или с последнего скана прошло FULL_SCAN_EVERY.
+    Без изменений интервал проверки удваивается (от MIN_INTERVAL до MAX_INTERVAL), при изменении — сбрасывается.
+    """
+
+    MIN_INTERVAL = 120
+    MAX_INTERVAL = 1800
+    FULL_SCAN_EVERY = 6 * 3600
+
+    def __init__(self, min_interval=None, max_interval=None, full_scan_every=None):
+        self.min_interval = min_interval or self.MIN_INTERVAL
+        self.max_interval = max_interval or self.MAX_INTERVAL
+        self.full_scan_every = full_scan_every or self.FULL_SCAN_EVERY
+        self.interval = self.min_interval
+        self._snapshot = None
+        self._next_probe = 0.0
+        self._last_scan = None
+        self._lock = threading.Lock()
+        self.probes = 0
+        self.scans = 0
+        self.last_result = None
+
+    def tick(self):
+        """Для планировщика: проверка, если подошёл срок; иначе ничего не делает."""
+        if time.monotonic() < self._next_probe:
+            return None
+        return self.probe()
+
+    def probe(self):
+        with self._lock:
+            self.probes += 1
+            try:
+                actions = list_actions()
+            except Exception as e:
+                logger.warning(f"⚠ Акции Ozon: не удалось получить список ({e}) → повтор через {self.min_interval} с")
+                self._next_probe = time.monotonic() + self.min_interval
+                return None
+
+            snapshot = actions_snapshot(actions)
+            now = time.monotonic()
+            stale = self._last_scan is None or now - self._last_scan >= self.full_scan_every
+            if snapshot == self._snapshot and not stale:
+                self.interval = min(self.interval * 2, self.max_interval)
+                self._next_probe = now + self.interval
+                logger.debug(f"💤 Акции Ozon без изменений → следующая проверка через {self.interval} с")
+                return None
+
+            reason = "первый запуск" if self._snapshot is None else ("изменился список акций" if snapshot != self._snapshot else "плановый полный скан")
+            logger.info(f"🔎 Акции Ozon: {reason} → сканируем товары")
+            result = remove_all_products_from_all_actions(actions=actions)
+            self.scans += 1
+            self.last_result = result
+            self._last_scan = time.monotonic()
+
+            if result["removed"]:
+                # После снятия товаров счётчики в списке изменятся — запоминаем уже новый список
+                try:
+                    snapshot = actions_snapshot(list_actions())
+                except Exception as e:
+                    logger.warning(f"⚠ Акции Ozon: не удалось обновить список после очистки: {e}")
+                    snapshot = None
+            # при ошибках скана список не запоминаем — на следующей проверке скан повторится
+            self._snapshot = None if result["errors"] else snapshot
+            self.interval = self.min_interval
+            self._next_probe = time.monotonic() + self.interval
+            return result
+
+    def status(self) -> dict:
+        return {
+            "interval": self.interval,
+            "next_probe_in": max(0, round(self._next_probe - time.monotonic())),
+            "probes": self.probes,
+            "scans": self.scans,
+            "last_result": self.last_result,
+        }
+
+
+actions_watcher = ActionsWatcher()
+
+
 if __name__ == "__main__":
     remove_all_products_from_all_actions()
@@ -25,18 +25,17 @@
 
 import os
 import sqlite3
-import math
 import json
-import requests
+from http_client import http_session
 from logger_config import logger
 from dotenv import load_dotenv
-from notifiers import get_notifier
+from notifier import telegram
+from services.pricing import WB_DISCOUNT, ozon_old_price, wb_price, ym_discount_base
 
 # Загрузка переменных окружения
 load_dotenv(dotenv_path=os.path.join("System", ".env"))
 
 # Telegram уведомления
-telegram = get_notifier('telegram')
 telegram_got_token_error = os.getenv('telegram_got_token_error')
 telegram_chat_id_error = os.getenv('telegram_chat_id_error')
 
@@ -61,7 +60,7 @@ def update_yandex():
         offers = []
         for offer_id, price in rows:
             price = int(price)
-            discount_base = int(math.ceil(price * 1.18 / 100.0)) * 100
+            discount_base = ym_discount_base(price)
             offers.append({
                 "offerId": str(offer_id).strip(),
                 "price": {
@@ -78,7 +77,7 @@ def update_yandex():
             "Content-Type": "application/json"
         }
         logger.info(f"⏳ Отправка {len(offers)} цен в Yandex Market...")
-        response = requests.post(url, headers=headers, json={"offers": offers}, timeout=10)
+        response = http_session.post(url, headers=headers, json={"offers": offers}, timeout=10)
         logger.info(f"📡 Yandex API: {response.status_code}")
         if response.status_code != 200:
             logger.warning(f"⚠ Ответ от Yandex API: {response.text}")
@@ -105,7 +104,7 @@ def update_ozon():
         prices = []
         for offer_id, price in rows:
             price = float(price)
-            old_price = int(round(price * 1.15))
+            old_price = ozon_old_price(price)
             prices.append({
                 "offer_id": str(offer_id).strip(),
                 "price": str(int(price)),
@@ -122,7 +121,7 @@ def update_ozon():
             'Content-Type': 'application/json'
         }
         logger.info(f"⏳ Отправка {len(prices)} цен в Ozon...")
-        response = requests.post(url, headers=headers, data=json.dumps({"prices": prices}), timeout=10)
+        response = http_session.post(url, headers=headers, data=json.dumps({"prices": prices}), timeout=10)
         logger.info(f"📡 Ozon API: {response.status_code}")
         if response.status_code != 200:
             logger.warning(f"⚠ Ответ от Ozon API: {response.text}")
@@ -158,11 +157,11 @@ def update_wildberries():
         data = []
         for wb_id, price in rows:
             base_price = int(price)
-            final_price = int(round((base_price * 1.20) / 100.0)) * 100  # +25%, округляем
+            final_price = wb_price(base_price)  # +20%, округляем к сотне
             data.append({
                 "nmID": int(wb_id),
                 "price": final_price,
-                "discount": 16
+                "discount": WB_DISCOUNT
             })
 
         wb_token = os.getenv('wb_token')
@@ -172,7 +171,7 @@ def update_wildberries():
             'Content-Type': 'application/json'
         }
 
-        response = requests.post(url, headers=headers, json={"data": data}, timeout=10)
+        response = http_session.post(url, headers=headers, json={"data": data}, timeout=10)
         logger.info(f"⏳ Отправка {len(data)} цен в Wildberries...")
         # if response.status_code != 200:
         #     logger.warning(f"⚠ Ответ от Wildberries API: {response.text}")
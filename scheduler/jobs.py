@@ -0,0 +1,221 @@
+"""
+Модуль `scheduler.jobs` — реестр периодических задач поверх APScheduler.
+
+Для каждой задачи задаются max_instances, coalesce и jitter; реестр ведёт историю длительностей
+и не даёт запускам накладываться друг на друга:
+
+- JobRegistry.add(job_id, func, trigger, ...):
+    Регистрирует задачу (trigger — "interval" или "cron", параметры триггера — как в APScheduler).
+    interval_seconds — ожидаемый период для cron-задач (для interval вычисляется сам).
+
+- JobRegistry.install(scheduler):
+    Добавляет все задачи в планировщик. Запуск оборачивается: если предыдущий ещё идёт —
+    новый пропускается; если выполнение дольше периода — предупреждение и alert (один раз за серию).
+
+- JobRegistry.stats():
+    Состояние задач: число запусков/пропусков/ошибок, последняя и средняя длительность,
+    история последних запусков, следующий запуск.
+
+APScheduler импортируется только в install(), модуль можно импортировать без него.
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from logger_config import job_context, logger
+
+
+# Сколько последних запусков хранить для каждой задачи
+HISTORY_SIZE = 50
+
+_INTERVAL_UNITS = {"weeks": 604800, "days": 86400, "hours": 3600, "minutes": 60, "seconds": 1}
+
+
+class _JobState:
+    def __init__(self, job_id: str, name: str, func, trigger: str, trigger_args: dict, options: dict,
+                 interval_seconds: float | None):
+        self.job_id = job_id
+        self.name = name
+        self.func = func
+        self.trigger = trigger
+        self.trigger_args = trigger_args
+        self.options = options
+        self.interval_seconds = interval_seconds
+
+        self.lock = threading.Lock()  # держится на время выполнения
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0
+        self.missed = 0
+        self.overruns = 0
+        self.overrunning = False  # alert уже отправлен в текущей серии
+        self.started_at = None
+        self.last_error = None
+        self.history = deque(maxlen=HISTORY_SIZE)  # {"start", "duration", "status"}
+        self.aps_job = None
+
+    def to_dict(self) -> dict:
+        durations = [h["duration"] for h in self.history]
+        next_run = getattr(self.aps_job, "next_run_time", None) if self.aps_job else None
+        started = self.started_at  # _run обнуляет started_at без _guard — читаем один раз
+        return {
+            "name": self.name,
+            "trigger": self.trigger,
+            "trigger_args": {k: str(v) for k, v in self.trigger_args.items()},
+            "interval_seconds": self.interval_seconds,
+            "max_instances": self.options["max_instances"],
+            "coalesce": self.options["coalesce"],
+            "running": self.lock.locked(),
+            "running_for": round(time.monotonic() - started, 1) if self.lock.locked() and started else None,
+            "runs": self.runs,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "missed": self.missed,
+            "overruns": self.overruns,
+            "last_error": self.last_error,
+            "last_duration": durations[-1] if durations else None,
+            "avg_duration": round(sum(durations) / len(durations), 2) if durations else None,
+            "max_duration": max(durations) if durations else None,
+            "next_run": next_run.strftime("%d.%m.%Y %H:%M:%S") if next_run else None,
+            "history": list(self.history),
+        }
+
+
+class JobRegistry:
+    def __init__(self, alert=None):
+        """alert(message) — куда сообщать о перерасходе времени (например, Telegram)."""
+        self._jobs = {}
+        self._alert = alert
+        self._guard = threading.Lock()
+
+    def add(self, job_id: str, func, trigger: str, *, name: str | None = None, args=(), kwargs=None,
+            max_instances: int = 1, coalesce: bool = True, jitter: int | None = None,
+            misfire_grace_time: int = 60, interval_seconds: float | None = None, **trigger_args):
+        if job_id in self._jobs:
+            raise ValueError(f"Задача {job_id} уже зарегистрирована")
+        if trigger == "interval" and interval_seconds is None:
+            interval_seconds = sum(_INTERVAL_UNITS[k] * v for k, v in trigger_args.items() if k in _INTERVAL_UNITS)
+
+        def call():
+            return func(*args, **(kwargs or {}))
+
+        options = {
+            "max_instances": max_instances,
+            "coalesce": coalesce,
+            "misfire_grace_time": misfire_grace_time,
+        }
+        if jitter:
+            trigger_args = {**trigger_args, "jitter": jitter}
+        self._jobs[job_id] = _JobState(job_id, name or job_id, call, trigger, trigger_args, options, interval_seconds)
+        return self
+
+    def install(self, scheduler):
+        from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+
+        for state in self._jobs.values():
+            state.aps_job = scheduler.add_job(
+                self._run, state.trigger,
+                args=[state.job_id],
+                id=state.job_id,
+                name=state.name,
+                replace_existing=True,
+                **state.options,
+                **state.trigger_args,
+            )
+        scheduler.add_listener(self._on_scheduler_event, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+        logger.info(f"📅 Зарегистрировано задач: {len(self._jobs)} ({', '.join(self._jobs)})")
+
+    def _on_scheduler_event(self, event):
+        from apscheduler.events import EVENT_JOB_MISSED
+
+        state = self._jobs.get(event.job_id)
+        if state is None:
+            return
+        with self._guard:
+            if event.code == EVENT_JOB_MISSED:
+                state.missed += 1
+            else:
+                state.skipped += 1
+        self._check_overrun(state)
+
+    def _run(self, job_id: str):
+        state = self._jobs[job_id]
+        if not state.lock.acquire(blocking=False):
+            # предыдущий запуск ещё идёт (например, задача вызвана вручную через run_now)
+            with self._guard:
+                state.skipped += 1
+            logger.warning(f"⏭ Задача {state.name}: предыдущий запуск ещё выполняется → пропуск")
+            self._check_overrun(state)
+            return
+
+        started = datetime.now()
+        state.started_at = time.monotonic()
+        status = "ok"
+        try:
+            with job_context(state.job_id):
+                state.func()
+        except Exception as e:
+            status = "error"
+            with self._guard:
+                state.errors += 1
+                state.last_error = f"{started:%d.%m.%Y %H:%M:%S}: {e}"
+            logger.exception(f"❌ Задача {state.name} завершилась с ошибкой")
+        finally:
+            duration = round(time.monotonic() - state.started_at, 2)
+            state.started_at = None
+            state.lock.release()
+
+        with self._guard:
+            state.runs += 1
+            state.history.append({
+                "start": started.strftime("%d.%m.%Y %H:%M:%S"),
+                "duration": duration,
+                "status": status,
+            })
+        logger.debug(f"⏱ Задача {state.name}: {duration:.2f} с ({status})")
+
+        if state.interval_seconds and duration > state.interval_seconds:
+            with self._guard:
+                state.overruns += 1
+            self._send_overrun_alert(
+                state, f"⏰ Задача {state.name} выполнялась {duration:.0f} с — дольше периода "
+                       f"{state.interval_seconds:.0f} с"
+            )
+        else:
+            state.overrunning = False
+
+    def _check_overrun(self, state: _JobState):
+        started = state.started_at  # может обнулиться в _run между проверкой и вычитанием
+        if started is None or not state.interval_seconds:
+            return
+        running_for = time.monotonic() - started
+        if running_for > state.interval_seconds:
+            self._send_overrun_alert(
+                state, f"⏰ Задача {state.name} выполняется уже {running_for:.0f} с (период "
+                       f"{state.interval_seconds:.0f} с) — следующий запуск пропущен"
+            )
+
+    def _send_overrun_alert(self, state: _JobState, message: str):
+        with self._guard:
+            if state.overrunning:
+                return
+            state.overrunning = True
+        logger.warning(message)
+        if self._alert:
+            try:
+                self._alert(message)
+            except Exception as e:
+                logger.warning(f"❌ Не удалось отправить предупреждение о задаче {state.name}: {e}")
+
+    def run_now(self, job_id: str):
+        """Запуск вне расписания (с теми же защитой от наложения и учётом времени)."""
+        self._run(job_id)
+
+    def stats(self) -> dict:
+        with self._guard:
+            return {job_id: state.to_dict() for job_id, state in self._jobs.items()}
+
+
+__all__ = ["JobRegistry"]
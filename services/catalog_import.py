@@ -0,0 +1,266 @@
+"""
+Модуль `services.catalog_import` — массовая загрузка товаров в marketplace из CSV/XLSX.
+
+Строка файла = товар маркетплейса, ключ — Sklad:
+    - Sklad ещё нет в маркетплейсе → новая строка;
+    - Sklad уже есть → обновляются переданные колонки;
+    - Модель / WB Barcode / WB Артикул совпадают с ДРУГИМ товаром (в базе или выше в файле) → дубликат, пропуск.
+
+Проверка — сразу для всего файла: обязательные поля, числа; новые Sklad — один anti-join,
+совпадения с другими товарами — join по индексу (Маркетплейс, колонка) вместо OR на каждую строку;
+запись — одна транзакция.
+
+- read_rows(stream, filename):
+    (columns, [dict]) из CSV (разделитель ; , или таб, UTF-8) или XLSX (первый лист).
+
+- prepare_rows(columns, rows, market, table_columns):
+    Проверка и нормализация: (готовые строки, ошибки [(номер строки, текст)]).
+
+- import_rows(conn, market, prepared, market_enabled, dry_run):
+    Запись в marketplace; возвращает сводку {"inserted", "updated", "unchanged", "duplicates"}.
+
+- ensure_indexes(conn):
+    Индексы (Маркетплейс, Sklad) и (Маркетплейс, уникальная колонка) — один раз при подготовке базы.
+"""
+
+import csv
+import io
+from datetime import datetime
+
+from services.pricing import calc_price, parse_number, register_sql_functions
+
+
+REQUIRED_COLUMNS = ("Sklad", "Модель", "Нал", "Опт", "%")
+WB_REQUIRED_COLUMNS = ("WB Barcode", "WB Артикул")
+# Колонки, которые проверяются на совпадение с другими товарами (кроме ключа Sklad)
+UNIQUE_COLUMNS = ("Модель", "WB Barcode", "WB Артикул")
+# Заполняются при загрузке, из файла не берутся
+COMPUTED_COLUMNS = ("Маркетплейс", "Цена", "Дата изменения")
+# Числа: в базе могут лежать и текстом ("12345", "12 345") — сравниваются по значению
+NUMERIC_COLUMNS = ("Нал", "Опт", "%", "Цена")
+
+
+def read_rows(stream, filename: str):
+    name = (filename or "").lower()
+    if name.endswith(".xlsx"):
+        return _read_xlsx(stream)
+    if name.endswith(".csv"):
+        return _read_csv(stream)
+    raise ValueError("Поддерживаются только файлы .csv и .xlsx")
+
+
+def _read_csv(stream):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    first = text.readline()
+    delimiter = max(";,\t", key=first.count)
+    reader = csv.reader([first], delimiter=delimiter)
+    columns = [c.strip() for c in next(reader)]
+    rows = [
+        dict(zip(columns, values))
+        for values in csv.reader(text, delimiter=delimiter)
+        if any(v.strip() for v in values)
+    ]
+    return columns, rows
+
+
+def _read_xlsx(stream):
+    from openpyxl import load_workbook  # нужен только для загрузки XLSX
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        values = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(values, None) or ()
+        columns = [str(c).strip() if c is not None else "" for c in header]
+        rows = [
+            dict(zip(columns, ("" if v is None else v for v in row)))
+            for row in values
+            if any(v not in (None, "") for v in row)
+        ]
+    finally:
+        workbook.close()
+    return columns, rows
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _differs_sql(column: str) -> str:
+    """Условие «значение колонки отличается от переданного»; числа — по значению, не по записи."""
+    if column in NUMERIC_COLUMNS:
+        return f"parse_number({_quote(column)}) IS NOT parse_number(?)"
+    return f"{_quote(column)} IS NOT ?"
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # XLSX отдаёт целые числа как float: 123.0 → "123"
+    return str(value).strip()
+
+
+def prepare_rows(columns, rows, market: str, table_columns) -> tuple[list[dict], list[tuple[int, str]]]:
+    """Номера строк — как в файле (заголовок — строка 1)."""
+    unknown = [c for c in columns if c and c not in table_columns]
+    if unknown:
+        raise ValueError(f"Неизвестные колонки: {', '.join(unknown)}")
+    required = REQUIRED_COLUMNS + (WB_REQUIRED_COLUMNS if market == "wildberries" else ())
+    missing = [c for c in required if c not in columns]
+    if missing:
+        raise ValueError(f"Нет обязательных колонок: {', '.join(missing)}")
+
+    prepared, errors = [], []
+    for line, raw in enumerate(rows, start=2):
+        data = {k: _text(v) for k, v in raw.items() if k and k not in COMPUTED_COLUMNS}
+
+        empty = [c for c in required if not data.get(c)]
+        if empty:
+            errors.append((line, f"не заполнены: {', '.join(empty)}"))
+            continue
+
+        opt = parse_number(data["Опт"])
+        markup = parse_number(data["%"])
+        stock = parse_number(data["Нал"])
+        if opt is None or markup is None or stock is None:
+            errors.append((line, "Опт, % и Нал должны быть числами"))
+            continue
+
+        data["Опт"] = int(opt) if opt.is_integer() else opt  # как при ручной правке: 12345, а не 12345.0
+        data["%"] = int(markup)
+        data["Нал"] = 0 if data.get("Статус", "").lower() == "выкл." else int(stock)
+        data["Цена"] = calc_price(opt, markup)
+        prepared.append({"line": line, "data": data})
+    return prepared, errors
+
+
+def ensure_indexes(conn):
+    """Индексы для проверок загрузки; создаются при подготовке базы (старт приложения), не на каждую загрузку."""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_marketplace_market_sklad ON marketplace ("Маркетплейс", "Sklad")')
+    for i, column in enumerate(UNIQUE_COLUMNS):
+        conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_marketplace_market_unique{i} ON marketplace ("Маркетплейс", {_quote(column)})'
+        )
+    conn.commit()
+
+
+def _file_duplicates(prepared):
+    """Повторы внутри файла: тот же Sklad или те же уникальные поля у другого Sklad — берём первую строку."""
+    seen_sklad = set()
+    seen = {column: {} for column in UNIQUE_COLUMNS}
+    kept, duplicates = [], []
+    for item in prepared:
+        data = item["data"]
+        if data["Sklad"] in seen_sklad:
+            duplicates.append((item["line"], f"Sklad {data['Sklad']} уже выше в файле"))
+            continue
+        clash = next(
+            (c for c in UNIQUE_COLUMNS
+             if data.get(c) and seen[c].get(data[c], data["Sklad"]) != data["Sklad"]),
+            None
+        )
+        if clash:
+            duplicates.append((item["line"], f"{clash} {data[clash]} уже выше в файле"))
+            continue
+        seen_sklad.add(data["Sklad"])
+        for c in UNIQUE_COLUMNS:
+            if data.get(c):
+                seen[c][data[c]] = data["Sklad"]
+        kept.append(item)
+    return kept, duplicates
+
+
+def import_rows(conn, market: str, prepared: list[dict], market_enabled: bool = True,
+                dry_run: bool = False) -> dict:
+    """
+    Транзакция — у этой функции: commit (или rollback при dry_run/ошибке).
+    market_enabled=False: новые товары — с Нал = 0, у существующих Нал не меняется.
+    """
+    register_sql_functions(conn)
+    prepared, duplicates = _file_duplicates(prepared)
+
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS import_batch (
+            line INTEGER PRIMARY KEY, sklad TEXT, model TEXT, wb_barcode TEXT, wb_art TEXT
+        )
+    """)
+    conn.execute("DELETE FROM temp.import_batch")
+    conn.executemany(
+        "INSERT INTO temp.import_batch VALUES (?, ?, NULLIF(?, ''), NULLIF(?, ''), NULLIF(?, ''))",
+        [(item["line"], item["data"]["Sklad"], *(item["data"].get(c, "") for c in UNIQUE_COLUMNS))
+         for item in prepared]
+    )
+
+    # Совпадения уникальных полей с другими товарами — по индексу на каждую колонку
+    clashes = {}
+    for column, alias in zip(UNIQUE_COLUMNS, ("model", "wb_barcode", "wb_art")):
+        for line, sklad, value in conn.execute(f"""
+            SELECT i.line, m.Sklad, i.{alias}
+              FROM temp.import_batch AS i
+              JOIN marketplace AS m
+                ON m.Маркетплейс = ? AND m.{_quote(column)} = i.{alias} AND m.Sklad IS NOT i.sklad
+        """, (market,)):
+            clashes.setdefault(line, f"{column} {value} уже у товара {sklad}")
+
+    # Новые Sklad — anti-join по индексу (Маркетплейс, Sklad)
+    new_lines = {line for (line,) in conn.execute("""
+        SELECT i.line FROM temp.import_batch AS i
+         WHERE NOT EXISTS (SELECT 1 FROM marketplace AS m WHERE m.Маркетплейс = ? AND m.Sklad = i.sklad)
+    """, (market,))}
+
+    now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
+    inserted = updated = unchanged = 0
+    try:
+        for item in prepared:
+            line, data = item["line"], dict(item["data"])
+            if line in clashes:
+                duplicates.append((line, clashes[line]))
+                continue
+
+            if line in new_lines:
+                if not market_enabled:
+                    data["Нал"] = 0
+                data["Маркетплейс"] = market
+                data["Дата изменения"] = now_str
+                columns = list(data)
+                conn.execute(
+                    f"INSERT INTO marketplace ({', '.join(map(_quote, columns))}) "
+                    f"VALUES ({', '.join('?' * len(columns))})",
+                    [data[c] for c in columns]
+                )
+                inserted += 1
+                continue
+
+            sklad = data.pop("Sklad")
+            if not market_enabled:
+                data.pop("Нал", None)
+            columns = list(data)
+            cur = conn.execute(
+                f"UPDATE marketplace SET {', '.join(f'{_quote(c)} = ?' for c in columns)}, "
+                f'"Дата изменения" = ? '
+                f"WHERE Маркетплейс = ? AND Sklad = ? "
+                f"AND ({' OR '.join(_differs_sql(c) for c in columns)})",
+                [*(data[c] for c in columns), now_str, market, sklad, *(data[c] for c in columns)]
+            )
+            if cur.rowcount:
+                updated += 1
+            else:
+                unchanged += 1
+
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": unchanged,
+        "duplicates": sorted(duplicates),
+    }
+
+
+__all__ = ["read_rows", "prepare_rows", "import_rows", "ensure_indexes"]
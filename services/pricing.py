@@ -0,0 +1,126 @@
+"""
+Модуль `services.pricing` — единый расчёт цен.
+
+Формула: Цена = round((ОПТ + ОПТ * % / 100) / 100) * 100 — наценка и округление к сотне.
+round() в Python и numpy.round округляют половину к чётному, SQL ROUND — от нуля,
+поэтому в SQL используется не ROUND, а функция calc_price из этого модуля.
+numpy/pandas импортируются только векторным API (calc_prices / to_numbers).
+
+- parse_number(value):
+    Число из значения базы/формы: 12345, "12 345", "12345 р.", "15%". None — не число.
+
+- calc_price(opt, markup):
+    Цена одной строки (результаты кэшируются по аргументам). None — если не посчитать.
+
+- calc_prices(opt, markup):
+    То же для Series/массивов целиком (NaN там, где не посчитать).
+
+- register_sql_functions(conn):
+    SQL-функции calc_price(opt, markup) и parse_number(value) на соединении SQLite.
+
+- ym_discount_base(price), ozon_old_price(price), wb_price(price), WB_DISCOUNT:
+    Преобразования цены для API маркетплейсов.
+"""
+
+import math
+import numbers
+from functools import lru_cache
+
+
+# Yandex Market: «зачёркнутая» цена discountBase = +18%, вверх к сотне
+YM_DISCOUNT_BASE_RATE = 1.18
+# Ozon: old_price = +15%, до рубля
+OZON_OLD_PRICE_RATE = 1.15
+# Wildberries: цена до скидки = +20%, к сотне; скидка на карточке — 16%
+WB_PRICE_RATE = 1.20
+WB_DISCOUNT = 16
+
+
+def _clean(text: str) -> str:
+    return text.replace(' ', '').replace('р.', '').replace('%', '')
+
+
+@lru_cache(maxsize=65536)
+def _parse_text(text: str) -> float | None:
+    try:
+        return float(_clean(text))
+    except ValueError:
+        return None
+
+
+def parse_number(value) -> float | None:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, numbers.Real):  # в т.ч. числа numpy
+        return None if math.isnan(value) else float(value)
+    return _parse_text(str(value))
+
+
+def _price_base(opt, markup):
+    # одно выражение для скалярного и векторного расчёта
+    return (opt + opt * markup / 100.0) / 100.0
+
+
+@lru_cache(maxsize=65536)
+def _calc_price_cached(opt: float, markup: float) -> int:
+    # round() — половина к чётному, как numpy.round в calc_prices
+    return int(round(_price_base(opt, markup)) * 100)
+
+
+def calc_price(opt, markup) -> int | None:
+    opt = parse_number(opt)
+    markup = parse_number(markup)
+    if opt is None or markup is None:
+        return None
+    return _calc_price_cached(opt, markup)
+
+
+def to_numbers(values):
+    """Series/массив → float Series (NaN — не число)."""
+    import pandas as pd  # numpy/pandas — только для векторного API, скалярному не нужны
+
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if series.dtype == object:
+        series = series.map(parse_number)
+    return pd.to_numeric(series, errors="coerce").astype(float)
+
+
+def calc_prices(opt, markup):
+    """
+    Векторный расчёт: opt и markup — Series/массивы одной длины (или число для markup).
+    Возвращает float Series, индекс opt сохраняется.
+    """
+    import numpy as np
+    import pandas as pd
+
+    opt = to_numbers(opt)
+    if not np.isscalar(markup):
+        markup = to_numbers(markup).set_axis(opt.index)
+    elif parse_number(markup) is None:
+        return pd.Series(np.nan, index=opt.index)
+    else:
+        markup = parse_number(markup)
+    return np.round(_price_base(opt, markup)) * 100
+
+
+def register_sql_functions(conn):
+    conn.create_function("calc_price", 2, calc_price, deterministic=True)
+    conn.create_function("parse_number", 1, parse_number, deterministic=True)
+
+
+def ym_discount_base(price) -> int:
+    return int(math.ceil(float(price) * YM_DISCOUNT_BASE_RATE / 100.0)) * 100
+
+
+def ozon_old_price(price) -> int:
+    return int(round(float(price) * OZON_OLD_PRICE_RATE))
+
+
+def wb_price(price) -> int:
+    return int(round(float(price) * WB_PRICE_RATE / 100.0)) * 100
+
+
+__all__ = [
+    "parse_number", "calc_price", "calc_prices", "to_numbers", "register_sql_functions",
+    "ym_discount_base", "ozon_old_price", "wb_price", "WB_DISCOUNT",
+]
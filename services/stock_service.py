@@ -0,0 +1,168 @@
+"""
+Модуль `services.stock_service` — флаги доступности и пересчёт остатков/цен маркетплейса.
+Без Flask: используется веб-приложением, main.py, order_notifications и update_sklad.
+
+- load_stock_flags(path):
+    Флаги из System/stock_flags.json. Файл перечитывается только при изменении (mtime/размер),
+    вызывающий код получает свою копию — её можно менять и сохранять.
+
+- save_stock_flags(flags, path):
+    Атомарная запись флагов (временный файл + replace) и обновление кэша.
+
+- recompute_market(market, flags, db_path):
+    Пересчёт Нал/Опт/Цена всех строк маркетплейса по выбранному поставщику (db.suppliers).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from copy import deepcopy
+from datetime import datetime
+
+from logger_config import logger
+from db.suppliers import fetch_best_suppliers
+from services.pricing import calc_price, parse_number
+
+
+DB_PATH = "System/marketplace_base.db"
+FLAGS_PATH = "System/stock_flags.json"
+
+DEFAULT_FLAGS = {
+    "yandex": True,
+    "ozon": True,
+    "wildberries": True,
+    "suppliers": {},
+}
+
+_flags_cache = {}  # path -> ((mtime_ns, size), flags)
+_flags_lock = threading.Lock()
+
+
+def load_stock_flags(path: str = FLAGS_PATH) -> dict:
+    try:
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with _flags_lock:
+            cached = _flags_cache.get(path)
+            if cached is not None and cached[0] == stamp:
+                return deepcopy(cached[1])
+
+        with open(path, "r", encoding="utf-8") as f:
+            flags = json.load(f)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать {path}: {e}. Используем все маркетплейсы ON.")
+        return deepcopy(DEFAULT_FLAGS)
+
+    for key, value in DEFAULT_FLAGS.items():
+        flags.setdefault(key, deepcopy(value))
+    with _flags_lock:
+        _flags_cache[path] = (stamp, flags)
+    return deepcopy(flags)
+
+
+def save_stock_flags(flags: dict, path: str = FLAGS_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(flags, f)
+    os.replace(tmp_path, path)
+
+    st = os.stat(path)
+    with _flags_lock:
+        _flags_cache[path] = ((st.st_mtime_ns, st.st_size), deepcopy(flags))
+
+
+def is_market_enabled(flags: dict, market: str) -> bool:
+    return bool(flags.get(market, True))
+
+
+def is_supplier_enabled(flags: dict, supplier: str) -> bool:
+    return bool((flags.get("suppliers") or {}).get(supplier, True))
+
+
+def recompute_market(market: str, flags: dict, db_path: str = DB_PATH) -> int | None:
+    """Пересчёт без Flask-контекста. Возвращает кол-во обновлённых строк (None — маркетплейс выключен)."""
+    # если маркетплейс выключен - не трогаем остатки
+    if not is_market_enabled(flags, market):
+        logger.info(f"⏭ {market.upper()} выключен → пересчёт пропущен, нули сохраняем")
+        return None
+
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    rows = cur.execute("""
+        SELECT rowid, "%", Цена, Опт, Нал, Статус
+          FROM marketplace
+         WHERE Маркетплейс = ?
+    """, (market,)).fetchall()
+
+    # Выбор поставщика для всех строк маркетплейса — один запрос
+    best = fetch_best_suppliers(conn, flags, market)
+    now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
+
+    updated = 0
+    for row in rows:
+        chosen_sup, nal, opt = best.get(row['rowid'], ('', 0, None))
+
+        if chosen_sup == '':
+            new_nal = 0
+            new_opt = row['Опт']
+        else:
+            new_nal = int(nal or 0)
+            new_opt = opt if opt is not None else row['Опт']
+
+        markup = parse_number(row['%'] if row['%'] is not None else '0')
+        if markup is None:
+            markup = 0.0
+
+        # Выключенный товар всегда с Нал = 0
+        if str(row['Статус'] or '').strip().lower() == 'выкл.':
+            new_nal = 0
+
+        # 🚫 Заморозка: при Нал=0 НЕ трогаем Опт/Цена
+        freeze_price = int(new_nal or 0) == 0
+
+        new_price = None
+        if not freeze_price and (new_opt is not None):
+            new_price = calc_price(new_opt, markup)
+
+        sets, vals = [], []
+
+        if int(row['Нал'] or 0) != int(new_nal):
+            sets.append('Нал = ?')
+            vals.append(int(new_nal))
+
+        cur_opt = parse_number(row['Опт'] or '0')
+        if (not freeze_price) and (new_opt is not None):
+            new_opt_f = parse_number(new_opt)
+            if new_opt_f is None:
+                new_opt_f = cur_opt
+            if cur_opt is None or (new_opt_f is not None and new_opt_f != cur_opt):
+                sets.append('Опт = ?')
+                vals.append(new_opt_f)
+
+        cur_price = parse_number(row['Цена'] or '0')
+        cur_price = int(cur_price) if cur_price is not None else 0
+        if new_price is not None and new_price != cur_price:
+            sets.append('Цена = ?')
+            vals.append(int(new_price))
+
+        if sets:
+            sets.append('"Дата изменения" = ?')
+            vals.extend((now_str, row['rowid']))
+            cur.execute(f"UPDATE marketplace SET {', '.join(sets)} WHERE rowid = ?", vals)
+            updated += 1
+
+    conn.commit()
+    conn.close()
+
+    logger.info(f"📊 {market.upper()}: обработано {len(rows)} строк, изменено {updated}")
+    logger.success(f"✅ Пересчёт завершён для {market.upper()}")
+    return updated
+
+
+__all__ = [
+    "DB_PATH", "FLAGS_PATH", "load_stock_flags", "save_stock_flags", "is_market_enabled",
+    "is_supplier_enabled", "recompute_market",
+]
@@ -0,0 +1,60 @@
+"""
+Модуль `services.supplier_selector` — выбор поставщика для строки marketplace без Flask.
+
+Правило одно для всех путей — представление temp.best_supplier (db/suppliers.py):
+    - свой склад (Sklad) с остатком — без сравнений;
+    - иначе минимальный ОПТ среди поставщиков с остатком, при равенстве — приоритет из реестра.
+
+- supplier_registry(enabled_only, db_path):
+    Поставщики из реестра (таблица suppliers) в порядке приоритета.
+
+- choose_best_supplier_for_row(row, conn, flags):
+    (supplier, nal, opt) для одной строки; ('', 0, None) — кандидатов нет.
+"""
+
+import sqlite3
+
+from db.suppliers import best_supplier_for_codes, list_suppliers, prepare_best_supplier_view
+from services.stock_service import DB_PATH, load_stock_flags
+
+
+def supplier_registry(enabled_only: bool = True, db_path: str = DB_PATH) -> list[dict]:
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        return list_suppliers(conn, enabled_only=enabled_only)
+    finally:
+        conn.close()
+
+
+def choose_best_supplier_for_row(row: dict, conn=None, flags: dict | None = None,
+                                 db_path: str = DB_PATH) -> tuple[str, int, float]:
+    """
+    Вход: row — dict одной строки marketplace; flags — stock_flags (по умолчанию — из файла).
+    Строка с rowid берётся из представления, строка без rowid (ещё не в базе) — по своим кодам.
+    """
+    if flags is None:
+        flags = load_stock_flags()
+
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        rowid = row.get('rowid')
+        if rowid is not None:
+            prepare_best_supplier_view(conn, flags)
+            found = conn.execute(
+                "SELECT supplier, nal, opt FROM temp.best_supplier WHERE mp_rowid = ?", (int(rowid),)
+            ).fetchone()
+            return (found[0], int(found[1]), found[2]) if found else ('', 0, None)
+
+        codes = {
+            s['name']: row.get(s['code_column'])
+            for s in list_suppliers(conn, enabled_only=True) if s['code_column']
+        }
+        return best_supplier_for_codes(conn, codes, flags)
+    finally:
+        if own_conn:
+            conn.close()
+
+
+__all__ = ["supplier_registry", "choose_best_supplier_for_row"]
@@ -27,14 +27,14 @@
 
 
 import sqlite3
-import pandas as pd
-import requests
+from http_client import http_session
 import os
 import json
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from notifiers import get_notifier
+from notifier import telegram
 from logger_config import logger
+from metrics import metrics
 
 
 # Загрузка токенов и переменных окружения
@@ -42,10 +42,12 @@ load_dotenv(dotenv_path=os.path.join("System", ".env"))
 
 telegram_got_token_error = os.getenv('telegram_got_token_error')
 telegram_chat_id_error = os.getenv('telegram_chat_id_error')
-telegram = get_notifier('telegram')
 
 # 🔄 Получение остатков из базы
+@metrics.timer("ymwb_gen_sklad_seconds", source="db")
 def gen_sklad():
+    import pandas as pd  # тяжёлый импорт — только когда реально строим остатки
+
     logger.info("🚀 Генерация остатков из базы данных")
     DB_PATH = "System/marketplace_base.db"
     conn = sqlite3.connect(DB_PATH, timeout=10)
@@ -111,7 +113,7 @@ def wb_update(wb_data):
         url = f'https://marketplace-api.wildberries.ru/api/v3/stocks/{warehouse_id}'
         headers = {'Authorization': token, 'stocks': 'application/json'}
         payload = {'warehouseId': warehouse_id, 'stocks': wb_data}
-        response = requests.put(url, headers=headers, json=payload, timeout=10)
+        response = http_session.put(url, headers=headers, json=payload, timeout=10)
         if response.status_code != 204:
             raise Exception(f"Статус-код: {response.status_code}, ответ: {response.text}")
     except Exception as e:
@@ -127,7 +129,7 @@ def ym_update(ym_data):
         campaign_id = os.getenv('campaign_id')
         url = f'https://api.partner.market.yandex.ru/campaigns/{campaign_id}/offers/stocks'
         headers = {"Authorization": f"Bearer {token}"}
-        response = requests.put(url, headers=headers, json={"skus": ym_data}, timeout=10)
+        response = http_session.put(url, headers=headers, json={"skus": ym_data}, timeout=10)
         if response.status_code != 200:
             raise Exception(f"Статус-код: {response.status_code}, ответ: {response.text}")
     except Exception as e:
@@ -154,7 +156,7 @@ def oz_update(oz_data):
 
         for chunk in chunk_list(oz_data, 100):
             payload = {"stocks": chunk}
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
+            response = http_session.post(url, headers=headers, json=payload, timeout=10)
             if response.status_code != 200:
                 raise Exception(f"Статус-код: {response.status_code}, ответ: {response.text}")
             logger.success(f"✅ Отправлено {len(chunk)} товаров в OZON")
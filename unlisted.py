@@ -1,44 +1,225 @@
+"""
+Модуль `unlisted` — товары поставщиков (prices), которых ещё нет на маркетплейсах.
+
+Товар «не выставлен», если его нормализованный артикул (db.suppliers.code_key) не встречается
+среди кодов поставщиков в marketplace (таблица supplier_codes) и поставщик — не Sklad.
+
+Множество строк хранится в памяти процесса (UnlistedIndex) и привязано к версиям данных
+marketplace, supplier_codes и prices (db.changes): при изменениях перечитываются только
+изменённые строки (changes_since), полная пересборка — при первом запросе или если журнал уже обрезан.
+
+- unlisted_rows(chunk_size):
+    (columns, rows) — колонки prices и генератор строк; для потоковой выгрузки (exporter).
+
+- generate_unlisted():
+    То же одним DataFrame.
+"""
+
 import sqlite3
-import pandas as pd
+import threading
+from collections import Counter, defaultdict
+
 from logger_config import logger
+from db.changes import changes_since, get_data_version
+from db.suppliers import SUP_DB_PATH, code_key, ensure_supplier_registry
+from services.stock_service import DB_PATH
 
 
-def generate_unlisted():
-    """Формирует DataFrame с товарами, которых нет на маркетплейсах и не от 'Sklad'."""
-    try:
-        # Подключение к базе marketplace
-        with sqlite3.connect('System/marketplace_base.db') as mp_conn:
-            mp_df = pd.read_sql_query("SELECT Sklad, Invask, Okno, United FROM marketplace", mp_conn)
+# Сколько rowid подставлять в один запрос `IN (...)`
+_IN_CHUNK = 500
+
+
+def _chunks(items, size=_IN_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _price_key(supplier, article):
+    """Ключ строки prices; None — строка своего склада (в выгрузку не попадает никогда)."""
+    if str(supplier or "").strip().lower() == "sklad":
+        return None
+    return code_key(article)
+
+
+class UnlistedIndex:
+    def __init__(self, mp_path: str = DB_PATH, prices_path: str = SUP_DB_PATH):
+        self.mp_path = mp_path
+        self.prices_path = prices_path
+        self._lock = threading.Lock()
+        self._versions = None         # (версия marketplace, версия supplier_codes, версия prices)
+        self._mp_keys = {}            # rowid marketplace → коды строки
+        self._listed = Counter()      # код → сколько раз встречается в marketplace
+        self._price_keys = {}         # rowid prices → код (None — Sklad)
+        self._by_key = defaultdict(set)  # код → rowid prices
+        self._unlisted = set()
+
+    def rowids(self) -> list[int]:
+        with self._lock:
+            mp_conn = sqlite3.connect(self.mp_path, timeout=10)
+            pr_conn = sqlite3.connect(self.prices_path, timeout=10)
+            try:
+                ensure_supplier_registry(mp_conn)
+                # версии — до чтения данных: запись между ними подхватится следующим запросом
+                # supplier_codes — отдельно: коды поставщиков без колонки меняются, не трогая marketplace
+                versions = (
+                    get_data_version(mp_conn, "marketplace"),
+                    get_data_version(mp_conn, "supplier_codes"),
+                    get_data_version(pr_conn, "prices"),
+                )
+                if versions != self._versions:
+                    if self._versions is None or not self._apply_changes(mp_conn, pr_conn):
+                        self._rebuild(mp_conn, pr_conn)
+                    self._versions = versions
+            finally:
+                mp_conn.close()
+                pr_conn.close()
+            return sorted(self._unlisted)
 
-        # Объединяем и нормализуем артикулы
-        listed_articles = pd.concat([
-            mp_df['Sklad'],
-            mp_df['Invask'],
-            mp_df['Okno'],
-            mp_df['United']
-        ], ignore_index=True).fillna('').astype(str)
+    def _rebuild(self, mp_conn, pr_conn):
+        self._mp_keys, self._listed = {}, Counter()
+        self._price_keys, self._by_key, self._unlisted = {}, defaultdict(set), set()
 
-        # Очистка от пробелов, табов и ведущих нулей
-        listed_articles = listed_articles.str.replace(r'\s+', '', regex=True).str.lstrip('0')
-        listed_articles = listed_articles[listed_articles != ''].unique()
+        mp_keys = defaultdict(set)
+        for rowid, key in mp_conn.execute("SELECT mp_rowid, code_key FROM supplier_codes WHERE code_key <> ''"):
+            mp_keys[rowid].add(key)
+        for rowid, keys in mp_keys.items():
+            self._mp_keys[rowid] = frozenset(keys)
+            self._listed.update(keys)
 
-        # Подключение к базе всех товаров
-        with sqlite3.connect('System/!YMWB.db') as all_conn:
-            all_df = pd.read_sql_query("SELECT * FROM prices", all_conn)
+        for rowid, supplier, article in pr_conn.execute('SELECT rowid, "Поставщик", "Артикул" FROM prices'):
+            self._add_price(rowid, _price_key(supplier, article))
+        logger.debug(f"📋 Невыставленные товары: полная пересборка, {len(self._unlisted)} строк")
 
-        # Нормализуем артикулы в базе всех товаров
-        all_df['Артикул'] = all_df['Артикул'].astype(str).fillna('').str.replace(r'\s+', '', regex=True).str.lstrip('0')
+    def _apply_changes(self, mp_conn, pr_conn) -> bool:
+        mp_version, codes_version, pr_version = self._versions
+        mp_changes = changes_since(mp_conn, "marketplace", mp_version)
+        codes_changes = changes_since(mp_conn, "supplier_codes", codes_version)
+        pr_changes = changes_since(pr_conn, "prices", pr_version)
+        if not (mp_changes.complete and codes_changes.complete and pr_changes.complete):
+            return False
+        # row_id в журнале supplier_codes — rowid строки marketplace (mp_rowid)
+        mp_rowids = {row_id for row_id, _, _ in (*mp_changes.changes, *codes_changes.changes)}
+        # Перезапись большей части таблицы дешевле перечитать целиком
+        if len(pr_changes.changes) > len(self._price_keys) // 2 or len(mp_rowids) > len(self._mp_keys) // 2:
+            return False
 
-        # Фильтрация: исключаем уже имеющиеся и склад
-        not_listed_df = all_df[
-            (~all_df['Артикул'].isin(listed_articles)) &
-            (all_df['Поставщик'].str.lower() != 'sklad')
-        ]
+        affected = set()
+        for chunk in _chunks(mp_rowids):
+            new_keys = defaultdict(set)
+            rows = mp_conn.execute(
+                f"SELECT mp_rowid, code_key FROM supplier_codes WHERE code_key <> '' "
+                f"AND mp_rowid IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            for rowid, key in rows:
+                new_keys[rowid].add(key)
+            for rowid in chunk:
+                for key in self._mp_keys.pop(rowid, ()):
+                    self._listed[key] -= 1
+                    if not self._listed[key]:
+                        del self._listed[key]
+                        affected.add(key)
+                keys = new_keys.get(rowid)
+                if keys:
+                    self._mp_keys[rowid] = frozenset(keys)
+                    for key in keys:
+                        if not self._listed[key]:
+                            affected.add(key)
+                        self._listed[key] += 1
 
-        return not_listed_df.reset_index(drop=True)
+        for key in affected:
+            listed = key in self._listed
+            for rowid in self._by_key.get(key, ()):
+                if listed:
+                    self._unlisted.discard(rowid)
+                else:
+                    self._unlisted.add(rowid)
 
+        for chunk in _chunks(row_id for row_id, _, _ in pr_changes.changes):
+            for rowid in chunk:
+                self._remove_price(rowid)
+            rows = pr_conn.execute(
+                f'SELECT rowid, "Поставщик", "Артикул" FROM prices WHERE rowid IN ({", ".join("?" * len(chunk))})',
+                chunk
+            )
+            for rowid, supplier, article in rows:
+                self._add_price(rowid, _price_key(supplier, article))
+
+        logger.debug(
+            f"📋 Невыставленные товары: изменённых строк marketplace {len(mp_rowids)}, "
+            f"prices {len(pr_changes.changes)} → {len(self._unlisted)} строк"
+        )
+        return True
+
+    def _add_price(self, rowid, key):
+        self._price_keys[rowid] = key
+        if key is None:
+            return
+        self._by_key[key].add(rowid)
+        if key not in self._listed:
+            self._unlisted.add(rowid)
+
+    def _remove_price(self, rowid):
+        if rowid not in self._price_keys:
+            return
+        key = self._price_keys.pop(rowid)
+        self._unlisted.discard(rowid)
+        if key is not None:
+            rowids = self._by_key.get(key)
+            if rowids is not None:
+                rowids.discard(rowid)
+                if not rowids:
+                    del self._by_key[key]
+
+
+_index = UnlistedIndex()
+
+
+def unlisted_rows(chunk_size: int = 1000):
+    """
+    (columns, rows): колонки prices и генератор строк по возрастанию rowid.
+    Артикул в строках — нормализованный (без пробелов и ведущих нулей).
+    Соединение закрывается, когда генератор дочитан или закрыт.
+    """
+    rowids = _index.rowids()
+
+    conn = sqlite3.connect(_index.prices_path, timeout=10, check_same_thread=False)
+    conn.execute("CREATE TEMP TABLE unlisted_ids (id INTEGER PRIMARY KEY)")
+    conn.executemany("INSERT INTO temp.unlisted_ids (id) VALUES (?)", ((r,) for r in rowids))
+    cur = conn.execute("""
+        SELECT p.* FROM prices AS p
+          JOIN temp.unlisted_ids AS u ON u.id = p.rowid
+         ORDER BY p.rowid
+    """)
+    columns = [d[0] for d in cur.description]
+    article_idx = columns.index("Артикул") if "Артикул" in columns else None
+
+    def rows():
+        try:
+            while True:
+                batch = cur.fetchmany(chunk_size)
+                if not batch:
+                    break
+                for row in batch:
+                    if article_idx is not None:
+                        row = (*row[:article_idx], code_key(row[article_idx]), *row[article_idx + 1:])
+                    yield row
+        finally:
+            conn.close()
+
+    return columns, rows()
+
+
+def generate_unlisted():
+    """Формирует DataFrame с товарами, которых нет на маркетплейсах и не от 'Sklad'."""
+    import pandas as pd
+
+    try:
+        columns, rows = unlisted_rows()
+        return pd.DataFrame.from_records(list(rows), columns=columns)
     except Exception as e:
         logger.error(f"Ошибка в generate_unlisted(): {e}", exc_info=True)
         return pd.DataFrame()
 
 
+__all__ = ["UnlistedIndex", "unlisted_rows", "generate_unlisted"]
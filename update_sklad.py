@@ -26,22 +26,28 @@
 
 
 from logger_config import logger
+from metrics import metrics
 from datetime import datetime
 import pandas as pd
 import gspread
 import sqlite3
-import json
+from db.changes import ensure_version_tracking
+from db.suppliers import ensure_supplier_registry, supplier_rows_clause
+from services.pricing import calc_prices, to_numbers
+from services.stock_service import load_stock_flags
 
 
 
+@metrics.timer("ymwb_gen_sklad_seconds", source="sheets")
 def gen_sklad():
     logger.info("🚀 Генерация данных со склада (Google Sheets)")
     pd.set_option('display.max_columns', None)
     pd.set_option('display.expand_frame_repr', False)
-    gc = gspread.service_account(filename='System/my-python-397519-3688db4697d6.json')
-    sh = gc.open("КАЗНА")
-    worksheet = sh.worksheet("СКЛАД")
-    data = worksheet.get('A:W')
+    with metrics.timer("ymwb_sheets_seconds", call="read_sklad"):
+        gc = gspread.service_account(filename='System/my-python-397519-3688db4697d6.json')
+        sh = gc.open("КАЗНА")
+        worksheet = sh.worksheet("СКЛАД")
+        data = worksheet.get('A:W')
     logger.debug(f"📥 Получено {len(data) - 1} строк (без заголовка)")
 
     # Удаляем пустые строки и пробелы
@@ -112,10 +118,20 @@ def gen_sklad():
     return sklad
 
 
+# Ключ строки Sklad в prices. Те же выражения, что в индексе idx_prices_supplier_art,
+# чтобы SQLite мог искать по индексу.
+_PRICES_SUPPLIER_KEY = 'UPPER(TRIM("Поставщик"))'
+_PRICES_ART_KEY = 'TRIM(CAST("Артикул" AS TEXT))'
+
+
 def upsert_ymwb_prices_from_sklad(sklad_df):
     """
-    Синхронизирует таблицу 'prices' в !YMWB.db с данными склада.
-    Логика полностью сохранена, оптимизирована скорость работы.
+    Синхронизирует таблицу 'prices' в !YMWB.db с данными склада (строки поставщика Sklad).
+
+    Снимок склада загружается во временную таблицу sklad_stage одним executemany,
+    затем в одной транзакции: UPDATE ... FROM (только изменившиеся строки),
+    INSERT отсутствующих и DELETE (anti-join) пропавших со склада.
+    Возвращает счётчики: inserted, updated, deleted, unchanged.
     """
     db_path = "System/!YMWB.db"
     conn = sqlite3.connect(db_path, timeout=10)
@@ -138,186 +154,178 @@ def upsert_ymwb_prices_from_sklad(sklad_df):
         cur.execute('ALTER TABLE "prices" ADD COLUMN "Наименование" TEXT')
     if "РРЦ" not in cols:
         cur.execute('ALTER TABLE "prices" ADD COLUMN "РРЦ" INTEGER')
+    cur.execute(f'CREATE INDEX IF NOT EXISTS idx_prices_supplier_art ON "prices" ({_PRICES_SUPPLIER_KEY}, {_PRICES_ART_KEY})')
+    ensure_version_tracking(conn, "prices")
+
+    # --- 2. Снимок склада (при повторах артикула берём последнюю строку) ---
+    stage = pd.DataFrame({
+        "art": sklad_df["Арт мой"].astype(str).str.strip(),
+        "name": sklad_df["Модель"].astype(str).str.strip(),
+        "nal": pd.to_numeric(sklad_df["Наличие"], errors="coerce").fillna(0).astype(int),
+        "opt": pd.to_numeric(sklad_df["ОПТ"], errors="coerce").fillna(0).astype(int),
+        "rrc": pd.to_numeric(sklad_df.get("РРЦ", 0), errors="coerce").fillna(0).astype(int),
+    })
+    stage = stage[stage["art"] != ""].drop_duplicates("art", keep="last")
+    stage_rows = [
+        (art, name or None, int(nal), int(opt), int(rrc))
+        for art, name, nal, opt, rrc in stage.itertuples(index=False, name=None)
+    ]
 
-    # --- 2. Подготовка данных из склада ---
-    data_to_upsert = []
-    all_current_arts = set()
-
-    for _, r in sklad_df.iterrows():
-        art = str(r.get("Арт мой", "")).strip()
-        if not art:
-            continue
-        model = str(r.get("Модель", "")).strip()
-        nal   = int(r.get("Наличие", 0) or 0)
-        opt   = int(r.get("ОПТ", 0) or 0)
-        rrc   = int(r.get("РРЦ", 0) or 0)
-        all_current_arts.add(art)
-        data_to_upsert.append((nal, opt, rrc, model if model else None, art, art, model, nal, opt, rrc))
-
-    # --- 3. Пакетное обновление (UPSERT) ---
-    # Сначала пытаемся обновить существующие записи
-    cur.executemany("""
-        UPDATE "prices"
-           SET "Наличие" = ?, "ОПТ" = ?, "РРЦ" = ?,
-               "Наименование" = COALESCE(?, "Наименование")
-         WHERE UPPER(TRIM("Поставщик")) = UPPER('Sklad')
-           AND TRIM(CAST("Артикул" AS TEXT)) = TRIM(?)
-    """, [(nal, opt, rrc, model, art) for nal, opt, rrc, model, art, *_ in data_to_upsert])
-
-    # Теперь вставляем те, которых не было
-    cur.executemany("""
-        INSERT INTO "prices" ("Поставщик","Артикул","Наименование","Наличие","ОПТ","РРЦ")
-        SELECT 'Sklad', ?, ?, ?, ?, ?
-        WHERE NOT EXISTS (
-            SELECT 1 FROM "prices"
-             WHERE UPPER(TRIM("Поставщик")) = UPPER('Sklad')
-               AND TRIM(CAST("Артикул" AS TEXT)) = TRIM(?)
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS sklad_stage (
+            art  TEXT PRIMARY KEY,
+            name TEXT,
+            nal  INTEGER,
+            opt  INTEGER,
+            rrc  INTEGER
         )
-    """, [(art, model, nal, opt, rrc, art) for nal, opt, rrc, model, art, *_ in data_to_upsert])
-
-    rows = len(data_to_upsert)
-
-    # --- 4. Удаление отсутствующих артикулов пакетами (чтобы не упереться в 999 параметров SQLite) ---
-    deleted = 0
-    if all_current_arts:
-        all_current_arts = list(all_current_arts)
-        batch_size = 500
-        for i in range(0, len(all_current_arts), batch_size):
-            batch = all_current_arts[i:i + batch_size]
-            cur.execute(f"""
-                DELETE FROM "prices"
-                 WHERE UPPER(TRIM("Поставщик")) = UPPER('Sklad')
-                   AND TRIM(CAST("Артикул" AS TEXT)) NOT IN ({",".join("?" * len(batch))})
-            """, batch)
-            deleted += cur.rowcount
-    else:
-        cur.execute("""
+    """)
+
+    sklad_match = f"""
+        {_PRICES_SUPPLIER_KEY} = 'SKLAD'
+        AND {_PRICES_ART_KEY} = s.art
+    """
+
+    # --- 3. Всё применение — одна транзакция ---
+    with conn:
+        cur.execute("DELETE FROM sklad_stage")
+        cur.executemany("INSERT INTO sklad_stage (art, name, nal, opt, rrc) VALUES (?, ?, ?, ?, ?)", stage_rows)
+
+        matched = cur.execute(f"""
+            SELECT COUNT(*) FROM "prices" JOIN sklad_stage s ON {sklad_match}
+        """).fetchone()[0]
+
+        cur.execute(f"""
+            UPDATE "prices"
+               SET "Наличие" = s.nal, "ОПТ" = s.opt, "РРЦ" = s.rrc,
+                   "Наименование" = COALESCE(s.name, "prices"."Наименование")
+              FROM sklad_stage s
+             WHERE {sklad_match}
+               AND ("prices"."Наличие" IS NOT s.nal
+                    OR "prices"."ОПТ" IS NOT s.opt
+                    OR "prices"."РРЦ" IS NOT s.rrc
+                    OR (s.name IS NOT NULL AND "prices"."Наименование" IS NOT s.name))
+        """)
+        updated = cur.rowcount
+
+        cur.execute(f"""
+            INSERT INTO "prices" ("Поставщик","Артикул","Наименование","Наличие","ОПТ","РРЦ")
+            SELECT 'Sklad', s.art, s.name, s.nal, s.opt, s.rrc
+              FROM sklad_stage s
+             WHERE NOT EXISTS (SELECT 1 FROM "prices" WHERE {sklad_match})
+        """)
+        inserted = cur.rowcount
+
+        cur.execute(f"""
             DELETE FROM "prices"
-             WHERE UPPER(TRIM("Поставщик")) = UPPER('Sklad')
+             WHERE {_PRICES_SUPPLIER_KEY} = 'SKLAD'
+               AND NOT EXISTS (SELECT 1 FROM sklad_stage s WHERE s.art = {_PRICES_ART_KEY})
         """)
         deleted = cur.rowcount
 
-    # --- 5. Финал ---
-    conn.commit()
-    conn.close()
-    logger.success(f"🧾 !YMWB.db → prices синхронизированы со складом, обновлено/добавлено: {rows}, удалено: {deleted}")
+        cur.execute("DELETE FROM sklad_stage")
 
+    conn.close()
 
+    result = {"inserted": inserted, "updated": updated, "deleted": deleted, "unchanged": matched - updated}
+    logger.success(
+        f"🧾 !YMWB.db → prices синхронизированы со складом: добавлено {inserted}, обновлено {updated}, "
+        f"удалено {deleted}, без изменений {result['unchanged']}"
+    )
+    return result
 
 
 def update_sklad_db(sklad_df):
     logger.info("🚀 Начато обновление остатков из склада в базу данных")
 
-    try:
-        with open("System/stock_flags.json", "r", encoding="utf-8") as f:
-            flags = json.load(f)
-            logger.info(f"⚙️ Загружены флаги обновления: {flags}")
-    except:
-        flags = {"yandex": True, "ozon": True, "wildberries": True}
+    flags = load_stock_flags()
+    logger.info(f"⚙️ Загружены флаги обновления: {flags}")
 
-    conn = sqlite3.connect("System/marketplace_base.db", timeout=10)
-    cursor = conn.cursor()
     # Проверка флага доступности поставщика Sklad
     if not flags.get("suppliers", {}).get("Sklad", True):
         logger.info("⛔ Поставщик 'Sklad' отключён флагом — обновление пропущено")
-        conn.close()
         return
 
-    # Подготовка словаря из Excel-файла склада
-    sklad_dict = {
-        str(row["Арт мой"]): (int(row["Наличие"]), int(row["ОПТ"]))
-        for _, row in sklad_df.iterrows()
-    }
-    logger.info(f"📦 Подготовлено {len(sklad_dict)} записей для обновления склада")
+    conn = sqlite3.connect("System/marketplace_base.db", timeout=10)
 
-    # Выгружаем товары Sklad из общей таблицы
-    cursor.execute("""
-        SELECT rowid, Маркетплейс, Sklad, Статус, Модель, Нал, Опт, "%", Цена
+    # Склад: артикул → (Наличие, ОПТ); при повторах берём последнюю строку
+    sklad = pd.DataFrame({
+        "art": sklad_df["Арт мой"].astype(str),
+        "sklad_nal": pd.to_numeric(sklad_df["Наличие"]).astype(int),
+        "sklad_opt": pd.to_numeric(sklad_df["ОПТ"]).astype(int),
+    }).drop_duplicates("art", keep="last")
+    logger.info(f"📦 Подготовлено {len(sklad)} записей для обновления склада")
+
+    # Товары Sklad из общей таблицы (только строки без других поставщиков) — один SELECT
+    ensure_supplier_registry(conn)
+    sklad_clause, sklad_params = supplier_rows_clause("Sklad", preferred=True)
+    rows = pd.read_sql_query(f"""
+        SELECT rowid, Маркетплейс, Sklad, Статус, Нал, Опт, "%", Цена
         FROM marketplace
-        WHERE COALESCE(Invask,'')='' 
-          AND COALESCE(Okno,'')='' 
-          AND COALESCE(United,'')='' 
-          AND TRIM(COALESCE(Sklad,''))<>''
-    """)
-    rows = cursor.fetchall()
-
-    for row in rows:
-        rowid, marketplace, art_mc, status, model, current_nal, current_opt, markup_raw, current_price = row
-
-        try:
-            current_nal = int(current_nal or 0)
-        except Exception:
-            current_nal = 0
-
-        table_flag = flags.get(marketplace.lower(), True)
-        if not table_flag:
-            if current_nal != 0:
-                cursor.execute("""
-                    UPDATE marketplace
-                       SET Нал = 0,
-                           "Дата изменения" = ?
-                     WHERE rowid = ?
-                """, (datetime.now().strftime("%d.%m.%Y %H:%M"), rowid))
-                logger.info(f"⛔ {marketplace} отключён флагом → остаток принудительно обнулён")
-            else:
-                logger.info(f"⛔ {marketplace} отключён флагом → остаток уже 0")
-            continue
-
-        art_mc_str = str(art_mc).strip()
-        status = (status or "").strip().lower()
-        model = model.strip() if model else "—"
-        current_opt = int(current_opt) if current_opt is not None else 0
-        current_price = int(current_price) if current_price is not None else 0
-        markup_raw = str(markup_raw).replace('%', '').replace(' ', '') if markup_raw else '0'
-
-        try:
-            markup = float(markup_raw)
-        except:
-            markup = 0.0
-
-        if art_mc_str in sklad_dict:
-            nal, opt = sklad_dict[art_mc_str]
-
-            try:
-                new_price = round((opt + opt * markup / 100) / 100.0) * 100
-            except:
-                new_price = opt
-
-            if status == "выкл." and current_nal == 0 and nal >= 0:
-                if (current_opt == opt) and (current_price == new_price):
-                    logger.debug(
-                        f"⏩ {marketplace} | {art_mc_str} ({model}) — выключен, Нал=0, данные не изменились → пропуск"
-                    )
-                    continue
-
-            if (current_nal != nal) or (current_opt != opt) or (current_price != new_price):
-                logger.debug(
-                    f"✅ {marketplace} | {art_mc_str} ({model}) → "
-                    f"stock: {current_nal} → {nal}, "
-                    f"opt: {current_opt} → {opt}, "
-                    f"price: {current_price} → {new_price}"
-                )
-                cursor.execute("""
-                    UPDATE marketplace
-                    SET Нал = ?, Опт = ?, Цена = ?, "Дата изменения" = ?
-                    WHERE rowid = ?
-                """, (nal, opt, new_price, datetime.now().strftime("%d.%m.%Y %H:%M"), rowid))
-
-        else:
-            # Нет на складе — обнуляем наличие, если нужно
-            if current_nal != 0:
-                if status == "выкл." and current_nal == 0:
-                    logger.debug(f"⏩ {marketplace} | {art_mc_str} ({model}) — выключен и уже обнулён → пропуск")
-                    continue
-                logger.debug(f"❌ {marketplace} | {art_mc_str} ({model}) отсутствует на складе → stock: {current_nal} → 0")
-                cursor.execute("""
-                    UPDATE marketplace
-                    SET Нал = ?, "Дата изменения" = ?
-                    WHERE rowid = ?
-                """, (0, datetime.now().strftime("%d.%m.%Y %H:%M"), rowid))
+        WHERE {sklad_clause}
+    """, conn, params=sklad_params)
+
+    if rows.empty:
+        conn.close()
+        logger.success("✅ Обновление остатков со склада завершено (товаров Sklad нет)")
+        return
 
+    # Текущие значения (как раньше: пустое/нечисловое → 0)
+    def _num(series):
+        return pd.to_numeric(series, errors="coerce").fillna(0)
+
+    rows["art"] = rows["Sklad"].astype(str).str.strip()
+    rows["cur_nal"] = _num(rows["Нал"]).astype(int)
+    rows["cur_opt"] = _num(rows["Опт"]).astype(int)
+    rows["cur_price"] = _num(rows["Цена"]).astype(int)
+    rows["markup"] = to_numbers(rows["%"]).fillna(0)
+    rows["off"] = rows["Статус"].fillna("").str.strip().str.lower() == "выкл."
+    rows["market_on"] = rows["Маркетплейс"].fillna("").str.lower().map(lambda mp: bool(flags.get(mp, True)))
+
+    # Сопоставление со складом одним join'ом
+    rows = rows.merge(sklad, on="art", how="left")
+    in_sklad = rows["sklad_nal"].notna()
+    sklad_nal = rows["sklad_nal"].fillna(0).astype(int)
+    sklad_opt = rows["sklad_opt"].fillna(0).astype(int)
+    # Цена = ОПТ + наценка, округление к сотне
+    new_price = calc_prices(sklad_opt, rows["markup"]).astype(int)
+
+    # 1) Маркетплейс выключен флагом → только обнуляем остаток
+    zero_off_market = ~rows["market_on"] & (rows["cur_nal"] != 0)
+
+    # 2) Есть на складе → Нал/Опт/Цена, если что-то изменилось
+    #    (выключенный товар с Нал=0 при неизменных Опт/Цена пропускаем)
+    price_changed = (rows["cur_opt"] != sklad_opt) | (rows["cur_price"] != new_price)
+    changed = (rows["cur_nal"] != sklad_nal) | price_changed
+    skip_disabled = rows["off"] & (rows["cur_nal"] == 0) & ~price_changed
+    update_full = rows["market_on"] & in_sklad & changed & ~skip_disabled
+
+    # 3) Нет на складе → обнуляем остаток
+    zero_missing = rows["market_on"] & ~in_sklad & (rows["cur_nal"] != 0)
+
+    now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
+    diff = [
+        (int(nal), int(opt), int(price), now_str, int(rowid))
+        for rowid, nal, opt, price in zip(
+            rows.loc[update_full, "rowid"], sklad_nal[update_full], sklad_opt[update_full], new_price[update_full]
+        )
+    ]
+    diff += [
+        (0, None, None, now_str, int(rowid))
+        for rowid in rows.loc[zero_off_market | zero_missing, "rowid"]
+    ]
+
+    if diff:
+        conn.executemany("""
+            UPDATE marketplace
+               SET Нал = ?, Опт = COALESCE(?, Опт), Цена = COALESCE(?, Цена), "Дата изменения" = ?
+             WHERE rowid = ?
+        """, diff)
     conn.commit()
     conn.close()
-    logger.success("✅ Обновление остатков со склада завершено")
-
 
+    logger.info(
+        f"📊 Sklad: строк {len(rows)} | обновлено {int(update_full.sum())} | "
+        f"нет на складе → 0: {int(zero_missing.sum())} | МП выключен → 0: {int(zero_off_market.sum())}"
+    )
+    logger.success("✅ Обновление остатков со склада завершено")
@@ -4,25 +4,38 @@ from update_sklad import gen_sklad, update_sklad_db, upsert_ymwb_prices_from_skl
 from auto_stock_updater import update
 from datetime import datetime
 import pandas as pd
-from flask import session, Response
+from flask import session, Response, stream_with_context, g
 from functools import wraps
 from dotenv import load_dotenv
 import os
-import requests
-from logger_config import logger, LOG_DIR
+from logger_config import logger, LOG_DIR, is_enabled
 from pathlib import Path
 from datetime import timedelta
 import stock
+import hmac
 import json
+import time
 import sqlite3
 import shutil
 import glob
-from threading import Lock
 from flask import send_file
 from copy import deepcopy
-from io import BytesIO
-from unlisted import generate_unlisted
-from ozon_actions import remove_all_products_from_all_actions
+from itertools import chain
+from unlisted import unlisted_rows
+from exporter import CSV_MIMETYPE, XLSX_MIMETYPE, iter_csv, table_rows, write_xlsx
+from ozon_actions import actions_watcher
+from job_runner import JobRunner
+from scheduler.jobs import JobRegistry
+from services.pricing import calc_price, calc_prices, parse_number, register_sql_functions
+from locks import LockManager, market_key, supplier_key
+from metrics import PROMETHEUS_MIMETYPE, metrics
+from db.changes import VersionedCache, changes_since, ensure_version_tracking, prune_change_log
+from db.suppliers import (
+    SUP_DB_PATH, ensure_supplier_registry, fetch_best_suppliers, supplier_conditions, supplier_rows_clause,
+)
+from services import catalog_import, stock_service
+from services.stock_service import load_stock_flags, recompute_market
+from services.supplier_selector import supplier_registry
 
 
 last_download_time = None
@@ -35,7 +48,11 @@ global_stock_flags = {
     "ozon": True,
     "wildberries": True
 }
-toggle_lock = Lock()
+MARKETS = ("yandex", "ozon", "wildberries")
+
+# Блокировки по маркетплейсам / поставщикам вместо одного общего toggle_lock
+locks = LockManager()
+ALL_MARKET_KEYS = tuple(market_key(m) for m in MARKETS)
 
 def send_telegram_message(message: str):
     stock.telegram.notify(
@@ -45,26 +62,15 @@ def send_telegram_message(message: str):
     )
 
 
-CRON_SUPPLIERS = ("Invask", "Okno", "United", "Sklad")
-
-
-def set_supplier_state_if_needed(supplier: str, enabled: bool):
+def set_suppliers_state_if_needed(enabled: bool):
+    """CRON: все поставщики реестра → enabled, одним пакетом (без HTTP к самому себе)."""
+    action = "включении" if enabled else "отключении"
     try:
-        current = global_stock_flags.get("suppliers", {}).get(supplier, True)
-
-        if current == enabled:
-            state = "ON" if enabled else "OFF"
-            logger.info(f"⏱️ CRON: {supplier} уже {state} → ничего не делаем")
-            return
-
-        action = "включаем" if enabled else "выключаем"
-        logger.info(f"⏱️ CRON: {supplier} сейчас {'ON' if current else 'OFF'} → {action} (toggle)")
-
-        requests.post(f"http://127.0.0.1:5050/toggle_supplier/{supplier}")
-
+        changed = set_suppliers_state({s["name"]: enabled for s in supplier_registry()})
+        if not changed:
+            logger.info(f"⏱️ CRON: все поставщики уже {'ON' if enabled else 'OFF'} → ничего не делаем")
     except Exception as e:
-        action = "включении" if enabled else "отключении"
-        logger.warning(f"❌ CRON: Ошибка при {action} {supplier}: {e}")
+        logger.warning(f"❌ CRON: Ошибка при {action} поставщиков: {e}")
 
 def backup_database():
     os.makedirs("System/backups", exist_ok=True)
@@ -82,6 +88,15 @@ def backup_database():
         reverse=True
     )
 
+    # Заодно обрезаем журналы изменений (см. db/changes.py)
+    for path, table in ((DB_PATH, "marketplace"), (SUP_DB_PATH, "prices")):
+        try:
+            conn = sqlite3.connect(path, timeout=10)
+            prune_change_log(conn, table)
+            conn.close()
+        except Exception as e:
+            logger.warning(f"❌ Не удалось обрезать журнал изменений {table}: {e}")
+
     # Удаляем старые бэкапы, оставляя только последние 14
     for old_file in backup_files[14:]:
         try:
@@ -97,190 +112,90 @@ def get_last_download_time():
     return None
 
 
-def update_sklad_task():
+def update_sklad_task(progress=None):
+    """
+    Полное обновление склада по этапам.
+    progress(stage, message) — необязательный колбэк для отчёта о ходе выполнения (см. job_runner).
+    """
+    report = progress or (lambda stage, message="": None)
     try:
-        with toggle_lock:
-            logger.success("🔁 Обновление склада через update_sklad.py...")
+        logger.success("🔁 Обновление склада через update_sklad.py...")
 
-            # 1) Тянем свежие данные склада
-            df = gen_sklad()
+        # 1) Тянем свежие данные склада (без блокировок — это самый долгий этап)
+        report("gen_sklad", "Загрузка склада из Google Sheets")
+        df = gen_sklad()
 
+        # Дальше пишем в обе базы по всем маркетплейсам
+        with locks.hold("prices", *ALL_MARKET_KEYS):
             # 2) Синхронизируем !YMWB.db/prices (Sklad): UPDATE/INSERT + DELETE отсутствующих
+            report("prices", f"Синхронизация !YMWB.db ({len(df)} строк)")
             upsert_ymwb_prices_from_sklad(df)
 
             # 3) Обновляем marketplace_base.db из склада (Нал/ОПТ/Цена)
+            report("sklad_db", "Обновление остатков Sklad")
             update_sklad_db(df)
 
             # 4) Полный пересчёт выбора поставщика по всей базе (уже по обновлённому !YMWB.db)
+            report("suppliers", "Выбор поставщиков")
             update(global_stock_flags)
 
             # 5) Точечный пересчёт для каждой таблицы МП (оставляем, как у тебя)
-            for _mp in ('yandex', 'ozon', 'wildberries'):
+            for _mp in MARKETS:
+                report("recompute", f"Пересчёт {_mp}")
                 try:
                     recompute_marketplace_core(_mp)
                 except Exception as e:
                     logger.warning(f"❌ Ошибка пересчёта для {_mp}: {e}")
 
-            # сохраняем дату ...
-
-            # сохраняем дату
-            with open(LAST_UPDATE_FILE, "w") as f:
-                f.write(datetime.now().strftime("%d.%m.%Y - %H:%M"))
-            logger.success("✅ Склад успешно обновлён.")
-            global last_download_time
-            last_download_time = datetime.now().strftime("%d.%m.%Y - %H:%M")
-    except Exception as e:
-        logger.exception("❌ Ошибка при обновлении склада")
-
-
-def load_stock_flags():
-    try:
-        with open(FLAGS_PATH, 'r') as f:
-            flags = json.load(f)
-            if "suppliers" not in flags:
-                flags["suppliers"] = {}
-            return flags
+        # сохраняем дату
+        with open(LAST_UPDATE_FILE, "w") as f:
+            f.write(datetime.now().strftime("%d.%m.%Y - %H:%M"))
+        logger.success("✅ Склад успешно обновлён.")
+        global last_download_time
+        last_download_time = datetime.now().strftime("%d.%m.%Y - %H:%M")
     except Exception:
-        return {
-            "yandex": True,
-            "ozon": True,
-            "wildberries": True,
-            "suppliers": {}
-        }
-
-
-SUPPLIERS = ['Invask', 'Okno', 'United']  # приоритет на равных ценах: Invask > Okno > United (можно поменять)
-
-# Кэшируем авто-обнаруженную таблицу с колонками Поставщик/Артикул/Наличие/ОПТ
-_SUP_TBL_CACHE = None
-_SUP_DB_PATH = "System/!YMWB.db"
-
-def _detect_suppliers_table(conn) -> str | None:
-    global _SUP_TBL_CACHE
-    if _SUP_TBL_CACHE:
-        return _SUP_TBL_CACHE
-    try:
-        cur = conn.cursor()
-        # 1) Пробуем стандартные имена
-        for name in ("prices", "stocks"):
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (name,))
-            if cur.fetchone():
-                # Проверим, что есть нужные колонки
-                cur.execute(f'PRAGMA table_info("{name}")')
-                cols = {r[1] for r in cur.fetchall()}
-                need = {"Поставщик", "Артикул", "Наличие", "ОПТ"}
-                if need.issubset(cols):
-                    _SUP_TBL_CACHE = name
-                    logger.info(f"📦 Используем таблицу остатков: {name}")
-                    return name
-        # 2) Ищем любую подходящую
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        for (tname,) in cur.fetchall():
-            cur.execute(f'PRAGMA table_info("{tname}")')
-            cols = {r[1] for r in cur.fetchall()}
-            if {"Поставщик", "Артикул", "Наличие", "ОПТ"}.issubset(cols):
-                _SUP_TBL_CACHE = tname
-                logger.info(f"📦 Используем таблицу остатков: {tname}")
-                return tname
-    except Exception as e:
-        logger.warning(f"❌ Не удалось определить таблицу остатков в !YMWB.db: {e}")
-    return None
+        logger.exception("❌ Ошибка при обновлении склада")
+        raise
 
-def _fetch_stock_for(conn_unused, supplier: str, code: str):
-    if not code or not str(code).strip():
-        return 0, None
-    try:
-        sup_conn = sqlite3.connect("System/!YMWB.db", timeout=5)
-        cur = sup_conn.cursor()
-        # Без учета регистра по Поставщику + убираем пробелы и ведущие нули в Артикуле
-        cur.execute("""
-            SELECT COALESCE("Наличие",0), "ОПТ"
-              FROM prices
-             WHERE UPPER(TRIM("Поставщик")) = UPPER(?)
-               AND (
-                    REPLACE(REPLACE(REPLACE(CAST("Артикул" AS TEXT), ' ', ''), ' ', ''), CHAR(9), '') 
-                        = REPLACE(REPLACE(REPLACE(?, ' ', ''), ' ', ''), CHAR(9), '')
-                 OR REPLACE(REPLACE(REPLACE(LTRIM(CAST("Артикул" AS TEXT), '0'), ' ', ''), ' ', ''), CHAR(9), '')
-                        = REPLACE(REPLACE(REPLACE(LTRIM(?, '0'), ' ', ''), ' ', ''), CHAR(9), '')
-               )
-             LIMIT 1
-        """, (supplier, str(code).strip(), str(code).strip()))
-        row = cur.fetchone()
-    except Exception as e:
-        logger.warning(f"❌ SUPPLIERS_DB read failed: {e}")
-        row = None
-    finally:
-        try: sup_conn.close()
-        except: pass
 
-    if not row:
-        return 0, None
+# Фоновый запуск обновления склада: кнопка и планировщик не блокируют друг друга,
+# повторные запросы склеиваются с уже идущим обновлением.
+update_jobs = JobRunner(max_workers=1)
+UPDATE_JOB_NAME = "update_sklad"
 
-    nal, opt = row
-    try: nal = int(str(nal).strip() or 0)
-    except: nal = 0
-    try: opt = float(str(opt).replace(' ', '').replace('р.', '')) if opt is not None else None
-    except: opt = None
-    return nal, opt
 
-def choose_best_supplier_for_row(row: dict, conn, use_row_sklad: bool = True) -> tuple[str, int, float]:
-    """
-    Вход: row — dict одной строки marketplace (с полями Sklad, Invask, Okno, United, ...).
-    Выход: (chosen_supplier, nal, opt)
-      - Если у Sklad nal >= 1 — возвращаем Sklad без сравнений.
-      - Иначе ищем среди Invask/Okno/United варианты с nal > 0 и берём минимальный opt.
-      - При равных opt — приоритет по порядку SUPPLIERS.
-      - Если кандидатов нет — возвращаем ('', 0, None).
-    """
+def submit_update_sklad():
+    return update_jobs.submit(UPDATE_JOB_NAME, update_sklad_task)
 
-    sklad_code = str(row.get('Sklad') or '').strip()
-    sklad_enabled = global_stock_flags.get("suppliers", {}).get("Sklad", True)
 
-    if sklad_code and sklad_enabled:
-        # Остаток склада берём только из !YMWB.db — чтобы не путать с агрегатным "Нал" строки
-        nal_ext, opt_ext = _fetch_stock_for(conn, 'Sklad', sklad_code)
-        if nal_ext >= 1:
-            return 'Sklad', nal_ext, opt_ext
+def update_sklad_job():
+    """Запуск из планировщика: ставим в очередь (или присоединяемся к идущему) и ждём завершения."""
+    job, _ = submit_update_sklad()
+    job.wait()
 
-    # 2) Кандидаты из остальных
-    best = ('', 0, None)  # (supplier, nal, opt)
-    for sup in SUPPLIERS:
-        sup_code = str(row.get(sup) or '').strip()
-        if not sup_code:
-            continue
-        # пропускаем отключённых поставщиков
-        if not global_stock_flags.get("suppliers", {}).get(sup, True):
-            continue
-        nal, opt = _fetch_stock_for(conn, sup, sup_code)
-        if nal and nal > 0 and opt is not None:
-            if best[0] == '':
-                best = (sup, nal, opt)
-            else:
-                # сравнение по opt; при равенстве — по приоритету SUPPLIERS
-                if opt < best[2]:
-                    best = (sup, nal, opt)
-                elif opt == best[2]:
-                    if SUPPLIERS.index(sup) < SUPPLIERS.index(best[0]):
-                        best = (sup, nal, opt)
 
-    return best
+def save_stock_flags():
+    with locks.hold("flags"):
+        stock_service.save_stock_flags(global_stock_flags, FLAGS_PATH)
 
-def _calc_price(opt_value, markup_raw):
-    try:
-        opt = float(str(opt_value).replace(' ', '').replace('р.', ''))
-        markup = float(str(markup_raw).replace('%', '').replace(' ', ''))
-        return int(round((opt + opt * markup / 100.0) / 100.0) * 100)
-    except:
-        return None
 
 global_stock_flags = load_stock_flags()
 
 app = Flask(__name__)
 DB_PATH = "System/marketplace_base.db"
+STOCK_BACKUP_PATH = "System/temp_stock_backup.db"  # копии остатков выключенных маркетплейсов/поставщиков
+# Результаты, зависящие только от содержимого marketplace (статистика, ошибки) — до изменения данных
+marketplace_cache = VersionedCache(DB_PATH, "marketplace")
+# Статистика по поставщикам зависит ещё и от реестра (suppliers) и связи строк с кодами (supplier_codes)
+statistic_cache = VersionedCache(
+    DB_PATH, ("marketplace", "suppliers", "supplier_codes"), setup=ensure_supplier_registry
+)
 load_dotenv(dotenv_path=os.path.join("System", ".env"))
 app.secret_key = os.getenv('SECRET_KEY')
 USERNAME = "admin"
 PASSWORD = os.getenv('PASSWORD')
+# Токен для сборщика метрик (Prometheus): Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
 app.permanent_session_lifetime = timedelta(days=30)
 
 @app.after_request
@@ -288,6 +203,19 @@ def no_index_headers(response):
     response.headers["X-Robots-Tag"] = "noindex, nofollow"
     return response
 
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.teardown_request
+def observe_request_time(exc=None):
+    started = g.pop("request_started", None)
+    if started is not None and request.endpoint != "static":
+        metrics.observe("ymwb_http_server_seconds", time.perf_counter() - started,
+                        endpoint=request.endpoint or "not_found", method=request.method)
+
 @app.route('/favicon.ico')
 def favicon():
     from flask import send_from_directory
@@ -301,21 +229,20 @@ def favicon():
 @app.route('/toggle_stock/<market>', methods=['POST', 'GET'])
 def toggle_stock(market):
     try:
-        with toggle_lock:
-            if market not in global_stock_flags:
-                return jsonify({"status": "error", "message": "unknown market"}), 400
+        if market not in MARKETS:
+            return jsonify({"status": "error", "message": "unknown market"}), 400
 
+        with locks.hold(market_key(market)):
             # Переключаем состояние (ON/OFF)
             global_stock_flags[market] = not global_stock_flags[market]
-            with open(FLAGS_PATH, 'w') as f:
-                json.dump(global_stock_flags, f)
+            save_stock_flags()
 
             state = "ON" if global_stock_flags[market] else "OFF"
             logger.info(f"🟡 Переключение {market}: {state}")
 
             conn_main = sqlite3.connect(DB_PATH, timeout=10)
             cur = conn_main.cursor()
-            conn_backup = sqlite3.connect("System/temp_stock_backup.db", timeout=10)
+            conn_backup = sqlite3.connect(STOCK_BACKUP_PATH, timeout=10)
             bcur = conn_backup.cursor()
 
             if not global_stock_flags[market]:
@@ -392,16 +319,46 @@ def toggle_stock(market):
 @app.route('/run_update')
 def run_manual_update():
     try:
-        update_sklad_task()
-        logger.success("✅ Обновление по кнопке завершено.")
+        job, created = submit_update_sklad()
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return '', 204
+            return jsonify({"job_id": job.id, "status": job.status, "merged": not created}), 202
         return redirect(request.referrer or url_for('index'))
     except Exception as e:
         logger.exception("❌ Ошибка при обновлении через кнопку")
         return Response("Ошибка", status=500)
 
 
+@app.route('/run_update/<job_id>')
+def run_update_status(job_id):
+    job = update_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "unknown job"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/run_update/<job_id>/events')
+def run_update_events(job_id):
+    """Поток событий задачи (Server-Sent Events): этап за этапом, до завершения."""
+    job = update_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "unknown job"}), 404
+
+    def stream():
+        sent = 0
+        while True:
+            events, finished = job.wait_events(sent)
+            for event in events:
+                yield f"event: progress\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            sent += len(events)
+            if finished and not events:
+                yield f"event: end\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 def requires_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -490,106 +447,151 @@ def login():
         </html>
         '''
 
-@app.route('/toggle_supplier/<supplier>', methods=['POST', 'GET'])
-def toggle_supplier(supplier):
-    try:
-        with toggle_lock:  # последовательное выполнение
-            # Переключаем флаг в JSON
-            global_stock_flags["suppliers"][supplier] = not global_stock_flags["suppliers"].get(supplier, True)
-            with open(FLAGS_PATH, 'w') as f:
-                json.dump(global_stock_flags, f)
-            logger.info(f"🔁 Поставщик {supplier} переключён: {'ON' if global_stock_flags['suppliers'][supplier] else 'OFF'}")
-
-            # Маппим имя поставщика -> имя колонки с его кодом
-            col_by_supplier = {"Invask": "Invask", "Okno": "Okno", "United": "United", "Sklad": None}
-            col = col_by_supplier.get(supplier)
-            if supplier not in col_by_supplier:
-                return jsonify({"status": "error", "message": "unknown supplier"}), 400
-
-            # Условие отбора строк
-            if supplier == "Sklad":
-                where_clause = """
-                    COALESCE(Invask,'')='' AND COALESCE(Okno,'')='' AND COALESCE(United,'')='' 
-                    AND TRIM(COALESCE(Sklad,''))<>'' AND Маркетплейс = ?
-                """
-            else:
-                where_clause = f"{col} IS NOT NULL AND TRIM({col}) <> '' AND Маркетплейс = ?"
+def _apply_supplier_state(cur, supplier: str, market: str, where_clause: str, where_params: tuple, enabled: bool):
+    """
+    Обнуляет (с резервной копией) или восстанавливает остатки поставщика в одном маркетплейсе.
+    cur — курсор основной базы с подключённой (ATTACH) базой резервных копий `bk`; commit — у вызывающего.
+    """
+    table_backup = f"bk.backup_supplier_{supplier}_{market}"
+    params = (*where_params, market)
+
+    if not enabled:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table_backup} (
+                Sklad TEXT PRIMARY KEY,
+                Нал INTEGER
+            )
+        """)
+        cur.execute(f"DELETE FROM {table_backup}")
+        cur.execute(f"""
+            INSERT OR REPLACE INTO {table_backup} (Sklad, Нал)
+            SELECT Sklad, Нал FROM marketplace WHERE {where_clause}
+        """, params)
+        cur.execute(f"UPDATE marketplace SET Нал = 0 WHERE {where_clause}", params)
+        return
 
-            conn_main = sqlite3.connect(DB_PATH, timeout=10)
-            conn_temp = sqlite3.connect("System/temp_stock_backup.db", timeout=10)
-            cursor_main = conn_main.cursor()
-            cursor_temp = conn_temp.cursor()
-
-            for market in ['yandex', 'ozon', 'wildberries']:
-                if not global_stock_flags.get(market, True):
-                    logger.info(
-                        f"⏭ {market.upper()} выключен → поставщика {supplier} не трогаем"
+    backup_name = table_backup.split(".", 1)[1]
+    if not cur.execute(
+        "SELECT 1 FROM bk.sqlite_master WHERE type = 'table' AND name = ?", (backup_name,)
+    ).fetchone():
+        return
+
+    # Остатки из копии — для артикулов, попадающих под условие поставщика
+    cur.execute(f"""
+        UPDATE marketplace
+           SET Нал = b.Нал
+          FROM {table_backup} AS b
+         WHERE marketplace.Sklad = b.Sklad
+           AND marketplace.Маркетплейс = ?
+           AND marketplace.Sklad IN (SELECT Sklad FROM marketplace WHERE {where_clause})
+    """, (market, *params))
+    cur.execute(f"""
+        DELETE FROM {table_backup}
+         WHERE Sklad IN (SELECT Sklad FROM marketplace WHERE {where_clause})
+    """, params)
+
+
+def set_suppliers_state(states: dict[str, bool], toggle: bool = False) -> dict[str, bool]:
+    """
+    Пакетное переключение поставщиков: {поставщик: True/False}.
+    toggle=True — значения не важны, каждый поставщик из states переключается в противоположное
+    состояние (текущий флаг читается под той же блокировкой, что и запись).
+    Остатки всех маркетплейсов обнуляются/восстанавливаются в одной транзакции, флаги сохраняются
+    один раз, затем — один пересчёт на маркетплейс. Возвращает поставщиков, чьё состояние изменилось.
+    """
+    registry = {s["name"]: s for s in supplier_registry(enabled_only=False)}
+    unknown = [name for name in states if name not in registry]
+    if unknown:
+        raise ValueError(f"Неизвестные поставщики: {', '.join(unknown)}")
+
+    # Все ключи — одним hold() в отсортированном порядке: взятие частями даёт взаимную блокировку с CRON
+    with locks.hold(*(supplier_key(s) for s in states), *ALL_MARKET_KEYS):
+        if toggle:
+            states = {supplier: not global_stock_flags["suppliers"].get(supplier, True) for supplier in states}
+        changed = {
+            supplier: bool(enabled) for supplier, enabled in states.items()
+            if global_stock_flags["suppliers"].get(supplier, True) != bool(enabled)
+        }
+        if not changed:
+            return {}
+
+        markets = [m for m in MARKETS if global_stock_flags.get(m, True)]
+        for market in MARKETS:
+            if market not in markets:
+                logger.info(f"⏭ {market.upper()} выключен → поставщиков {', '.join(changed)} не трогаем")
+
+        conn = sqlite3.connect(DB_PATH, timeout=10)
+        try:
+            conn.execute("ATTACH DATABASE ? AS bk", (STOCK_BACKUP_PATH,))
+            cur = conn.cursor()
+            cur.execute("BEGIN")
+            for supplier, enabled in changed.items():
+                # Условие отбора строк: строки со связью в supplier_codes (для «своего склада» — только без других)
+                rows_clause, rows_params = supplier_rows_clause(supplier, bool(registry[supplier]["preferred"]))
+                for market in markets:
+                    _apply_supplier_state(
+                        cur, supplier, market, f"{rows_clause} AND Маркетплейс = ?", rows_params, enabled
                     )
-                    continue
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        global_stock_flags["suppliers"].update(changed)
+        save_stock_flags()
+        logger.info(
+            "🔁 Поставщики переключены: "
+            + ", ".join(f"{s} {'ON' if e else 'OFF'}" for s, e in changed.items())
+        )
 
-                table_backup = f"backup_supplier_{supplier}_{market}"
-                try:
-                    cursor_main.execute(f"SELECT Sklad, Нал FROM marketplace WHERE {where_clause}", (market,))
-                    rows = cursor_main.fetchall()
-
-                    if not global_stock_flags["suppliers"][supplier]:
-                        cursor_temp.execute(f"""
-                            CREATE TABLE IF NOT EXISTS {table_backup} (
-                                Sklad TEXT PRIMARY KEY,
-                                Нал INTEGER
-                            )
-                        """)
-                        cursor_temp.execute(f"DELETE FROM {table_backup}")
-                        for art, nal in rows:
-                            cursor_temp.execute(
-                                f"INSERT INTO {table_backup} (Sklad, Нал) VALUES (?, ?)",
-                                (art, nal)
-                            )
-                        cursor_main.execute(f"UPDATE marketplace SET Нал = 0 WHERE {where_clause}", (market,))
-                    else:
-                        for art, _ in rows:
-                            cursor_temp.execute(
-                                f"SELECT Нал FROM {table_backup} WHERE Sklad = ?",
-                                (art,)
-                            )
-                            res = cursor_temp.fetchone()
-                            if res:
-                                nal = res[0]
-                                cursor_main.execute("""
-                                    UPDATE marketplace
-                                       SET Нал = ?
-                                     WHERE Sklad = ? AND Маркетплейс = ?
-                                """, (nal, art, market))
-                                cursor_temp.execute(
-                                    f"DELETE FROM {table_backup} WHERE Sklad = ?",
-                                    (art,)
-                                )
-                except Exception as e:
-                    logger.warning(f"❌ Ошибка обработки {supplier} в {market}: {e}")
+        for market in markets:
+            try:
+                recompute_marketplace_core(market)
+            except Exception as e:
+                logger.error(f"❌ Ошибка пересчёта для {market}: {e}")
 
-            conn_main.commit()
-            conn_temp.commit()
-            conn_main.close()
-            conn_temp.close()
+    return changed
 
-            # Пересчёт по всем МП
-            for market in ['yandex', 'ozon', 'wildberries']:
-                try:
-                    recompute_marketplace_core(market)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка пересчёта для {market}: {e}")
 
-            # ✅ ВСЕГДА JSON
-            return jsonify({
-                "status": "ok",
-                "supplier": supplier,
-                "enabled": global_stock_flags["suppliers"][supplier]
-            }), 200
+@app.route('/toggle_supplier/<supplier>', methods=['POST', 'GET'])
+@requires_auth
+def toggle_supplier(supplier):
+    try:
+        if supplier not in {s["name"] for s in supplier_registry()}:
+            return jsonify({"status": "error", "message": "unknown supplier"}), 400
+
+        changed = set_suppliers_state({supplier: True}, toggle=True)
+        enabled = changed[supplier]
+
+        # ✅ ВСЕГДА JSON
+        return jsonify({
+            "status": "ok",
+            "supplier": supplier,
+            "enabled": enabled
+        }), 200
     except Exception as e:
         logger.exception("❌ toggle_supplier failed")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/toggle_suppliers', methods=['POST'])
+@requires_auth
+def toggle_suppliers():
+    """Пакетное переключение: JSON {поставщик: true/false} → {"changed": {...}}."""
+    states = request.get_json(silent=True)
+    if not isinstance(states, dict) or not all(isinstance(v, bool) for v in states.values()):
+        return jsonify({"status": "error", "message": "expected {supplier: bool}"}), 400
+    try:
+        changed = set_suppliers_state(states)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.exception("❌ toggle_suppliers failed")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "ok", "changed": changed}), 200
+
 
 @app.route('/')
 @requires_auth
@@ -621,8 +623,11 @@ def show_table(table_name):
     tables = [row[0] for row in cursor.fetchall()]
 
 
-    query = "SELECT * FROM marketplace WHERE Маркетплейс = ?"
+    query = "SELECT rowid AS _rowid, * FROM marketplace WHERE Маркетплейс = ?"
     df = pd.read_sql_query(query, conn, params=(table_name,))
+    # Выбранный поставщик для всех строк — один запрос (подсветка и сортировка по колонкам поставщиков)
+    best = fetch_best_suppliers(conn, global_stock_flags, table_name)
+    df['_supplier'] = df.pop('_rowid').map(lambda rowid: best.get(rowid, ('',))[0])
     if "Маркетплейс" in df.columns:
         df.drop(columns=["Маркетплейс"], inplace=True)
     # Желаемый порядок колонок (WB — отдельный порядок)
@@ -668,18 +673,10 @@ def show_table(table_name):
         except Exception as e:
             logger.warning(f"❌ Ошибка преобразования дат: {e}")
     if all(col in df.columns for col in ['Опт', '%', 'Цена', 'Нал']):
-        def recalc_price(opt, markup):
-            try:
-                opt = float(str(opt).replace(' ', '').replace('р.', ''))
-                markup = float(str(markup).replace('%', '').replace(' ', ''))
-                return int(round((opt + (opt * markup / 100)) / 100.0) * 100)
-            except:
-                return None  # не трогаем, если не смогли посчитать
-
-        mask = pd.to_numeric(df['Нал'], errors='coerce').fillna(0) > 0
-        df.loc[mask, 'Цена'] = df.loc[mask].apply(
-            lambda row: recalc_price(row['Опт'], row['%']), axis=1
-        ).fillna(df.loc[mask, 'Цена'])
+        prices = calc_prices(df['Опт'], df['%'])
+        # не трогаем, если не смогли посчитать
+        mask = (pd.to_numeric(df['Нал'], errors='coerce').fillna(0) > 0) & prices.notna()
+        df.loc[mask, 'Цена'] = prices[mask].astype(int)
     conn.close()
 
     if sort_column and sort_column in df.columns:
@@ -688,11 +685,7 @@ def show_table(table_name):
 
         # 👇 Особая логика для колонок поставщиков
         if sort_column in ["Sklad", "Invask", "Okno", "United"]:
-            def highlight_sort(row):
-                active_supplier = choose_best_supplier_for_row(row.to_dict(), None, use_row_sklad=True)[0]
-                return 1 if active_supplier == sort_column else 0
-
-            df['_highlight_sort'] = df.apply(highlight_sort, axis=1)
+            df['_highlight_sort'] = df['_supplier'].eq(sort_column).astype(int)
             # 🔑 по умолчанию (asc) цветные сверху
             df = df.sort_values(
                 by=['_disabled_flag', '_highlight_sort'],
@@ -755,43 +748,32 @@ def show_table(table_name):
     # 📌 Получаем список всех уникальных поставщиков из общей таблицы
     conn_sup = sqlite3.connect(DB_PATH)
     try:
-        # Фиксированный список поставщиков
-        suppliers_list = ["Invask", "Okno", "United", "Sklad"]
+        # Поставщики из реестра
+        conditions = supplier_conditions(conn_sup)
+        suppliers_list = list(conditions)
 
-        # Подсчёты: "total" — строк с непустым кодом этого поставщика;
+        # Подсчёты: "total" — строк с кодом этого поставщика;
         # "active" — такие строки, у которых Нал > 0.
-        conn_cnt = sqlite3.connect(DB_PATH)
-        cnt_df = pd.read_sql_query("""
-            SELECT LOWER(Маркетплейс) AS mp,
-                   SUM(CASE WHEN TRIM(COALESCE(Invask,''))<>'' THEN 1 ELSE 0 END) AS invask_total,
-                   SUM(CASE WHEN TRIM(COALESCE(Invask,''))<>'' AND Нал>0 THEN 1 ELSE 0 END) AS invask_active,
-
-                   SUM(CASE WHEN TRIM(COALESCE(Okno,''))<>'' THEN 1 ELSE 0 END) AS okno_total,
-                   SUM(CASE WHEN TRIM(COALESCE(Okno,''))<>'' AND Нал>0 THEN 1 ELSE 0 END) AS okno_active,
-
-                   SUM(CASE WHEN TRIM(COALESCE(United,''))<>'' THEN 1 ELSE 0 END) AS united_total,
-                   SUM(CASE WHEN TRIM(COALESCE(United,''))<>'' AND Нал>0 THEN 1 ELSE 0 END) AS united_active,
-
-                   SUM(CASE WHEN TRIM(COALESCE(Sklad,''))<>'' THEN 1 ELSE 0 END) AS sklad_total,
-                   SUM(CASE WHEN TRIM(COALESCE(Sklad,''))<>'' AND Нал>0 THEN 1 ELSE 0 END) AS sklad_active
+        sums, params = [], []
+        for i, (sup, (cond, cond_params)) in enumerate(conditions.items()):
+            sums.append(
+                f"SUM(CASE WHEN {cond} THEN 1 ELSE 0 END) AS total_{i}, "
+                f"SUM(CASE WHEN {cond} AND Нал>0 THEN 1 ELSE 0 END) AS active_{i}"
+            )
+            params.extend(cond_params * 2)
+        cnt_rows = conn_sup.execute(f"""
+            SELECT LOWER(Маркетплейс) AS mp, {", ".join(sums)}
               FROM marketplace
              GROUP BY LOWER(Маркетплейс)
-        """, conn_cnt)
-        conn_cnt.close()
+        """, params).fetchall() if sums else []
 
         supplier_counts = {}
-        for _, r in cnt_df.iterrows():
-            mp = r['mp']
-            supplier_counts.setdefault('Invask', {})[mp] = {'total': int(r['invask_total'] or 0),
-                                                            'active': int(r['invask_active'] or 0)}
-            supplier_counts.setdefault('Okno', {})[mp] = {'total': int(r['okno_total'] or 0),
-                                                          'active': int(r['okno_active'] or 0)}
-            supplier_counts.setdefault('United', {})[mp] = {'total': int(r['united_total'] or 0),
-                                                            'active': int(r['united_active'] or 0)}
-            supplier_counts.setdefault('Sklad', {})[mp] = {
-                'total': int(r['sklad_total'] or 0),
-                'active': int(r['sklad_active'] or 0)
-            }
+        for mp, *counts in cnt_rows:
+            for i, sup in enumerate(suppliers_list):
+                supplier_counts.setdefault(sup, {})[mp] = {
+                    'total': int(counts[2 * i] or 0),
+                    'active': int(counts[2 * i + 1] or 0)
+                }
 
     except Exception:
         suppliers_list = []
@@ -803,48 +785,30 @@ def show_table(table_name):
         df["Дата изменения"] = df["Дата изменения"].dt.strftime("%d.%m.%Y %H:%M")
     has_errors = has_error_products()
 
-    print("🔥 has_errors =", has_errors)
-    logger.debug(f"🔥 has_errors = {has_errors}")
-    # === ВСТАВИТЬ ПЕРЕД return render_template(...) ===
-    # ВСТАВИТЬ ПЕРЕД return render_template(...)
-    active_suppliers = []
-
-    # Берём только нужные поля; отсутствующие — заполняем пустыми
-    need_cols = ['Sklad', 'Invask', 'Okno', 'United', '%', 'Цена', 'Опт', 'Нал', 'Статус', 'Модель']
-    df_for_pick = df.copy()
-    for c in need_cols:
-        if c not in df_for_pick.columns:
-            df_for_pick[c] = ''
-
-    for _, r in df_for_pick[need_cols].fillna('').iterrows():
-        row_dict = dict(r)
-
-        # выключенные товары не подсвечиваем
-        if str(row_dict.get('Статус', '')).strip().lower() == 'выкл.':
-            active_suppliers.append('')
-            continue
-
-        chosen_sup, _, _ = choose_best_supplier_for_row(row_dict, None, use_row_sklad=True)
-
-        active_suppliers.append(chosen_sup or '')
-    return render_template(
-        "index.html",
-        tables=tables,
-        table_data=df,
-        selected_table=table_name,
-        sort_column=sort_column,
-        sort_order=sort_order,
-        zip=zip,
-        stats=stats,
-        last_download_time=last_download_time,
-        global_stock_flags=global_stock_flags,
-        saved_form_data=saved_form_data,
-        suppliers_list=suppliers_list,
-        supplier_counts=supplier_counts,
-        active_suppliers=active_suppliers,
-        has_errors=has_errors
-
-    )
+    logger.debug("🔥 has_errors = {}", has_errors)
+    # Подсветка выбранного поставщика; выключенные товары не подсвечиваем
+    disabled_mask = df['Статус'].astype(str).str.strip().str.lower().eq('выкл.')
+    active_suppliers = df['_supplier'].where(~disabled_mask, '').tolist()
+    df.drop(columns=['_supplier'], inplace=True)
+    with metrics.timer("ymwb_render_seconds", template="index.html"):
+        html = render_template(
+            "index.html",
+            tables=tables,
+            table_data=df,
+            selected_table=table_name,
+            sort_column=sort_column,
+            sort_order=sort_order,
+            zip=zip,
+            stats=stats,
+            last_download_time=last_download_time,
+            global_stock_flags=global_stock_flags,
+            saved_form_data=saved_form_data,
+            suppliers_list=suppliers_list,
+            supplier_counts=supplier_counts,
+            active_suppliers=active_suppliers,
+            has_errors=has_errors
+        )
+    return html
 
 
 @app.route('/delete/<table>/<item_id>', methods=['POST'])
@@ -868,143 +832,251 @@ def delete_row(table, item_id):
     return redirect(url_for('show_table', table_name=table, search=''))
 
 
-@app.route('/update/<table>/<item_id>', methods=['POST'])
-def update_row(table, item_id):
-    data = request.form.to_dict()
-    if "Sklad" in data:
-        del data["Sklad"]
+# Поля, изменение которых обновляет "Дата изменения"
+EDIT_IMPORTANT_FIELDS = (
+    "Invask", "Okno", "United", "Модель", "Статус", "Нал", "Опт", "%", "Комментарий",
+    "Цена", "WB Артикул", "WB Barcode"
+)
+# Колонки, которые правкой не меняются
+EDIT_READONLY_FIELDS = ("Маркетплейс", "Sklad", "Дата изменения")
 
-    # Получаем старые данные для сравнения
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM marketplace WHERE Sklad = ? AND Маркетплейс = ?", (item_id, table))
-    row = cursor.fetchone()
-    column_names = [description[0] for description in cursor.description]
-    old_data = dict(zip(column_names, row)) if row else {}
+_schema_cache = {}  # db_path → (schema_version, колонки marketplace)
 
-    if not old_data:
-        conn.close()
-        logger.warning(f"⚠️ Товар с Sklad = {item_id} не найден.")
-        return '', 400
 
-    if not global_stock_flags.get(table, True):
-        logger.info(f"⚙️ Редактирование товара в выключенном маркетплейсе: {table}")
-        if 'Нал' in data:
-            del data['Нал']
+def marketplace_columns(conn) -> list[str]:
+    """Колонки marketplace; PRAGMA table_info перечитывается только при изменении схемы базы."""
+    version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    cached = _schema_cache.get(DB_PATH)
+    if cached is None or cached[0] != version:
+        cached = (version, [row[1] for row in conn.execute("PRAGMA table_info(marketplace)")])
+        _schema_cache[DB_PATH] = cached
+    return cached[1]
 
-    model = old_data.get("Модель", "—")
-    opt_old = int(old_data.get("Опт", 0))
-    stock_old = int(old_data.get("Нал", 0))
-    price_old = 0
 
-    price_old = int(old_data.get("Цена", 0) or 0)
+def _number_text(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _number_value(value):
+    number = parse_number(value)
+    if number is None:
+        return value
+    return int(number) if number.is_integer() else number
 
-    try:
-        stock_new = int(data.get("Нал", 0))
-        opt_new = int(data.get("Опт", 0))
-        markup = float(data.get("%", "0").replace('%', '').replace(' ', ''))
-        price_new = round((opt_new + opt_new * markup / 100) / 100.0) * 100
-    except Exception as e:
-        logger.warning(f"❌ Ошибка при парсинге чисел: {e}")
-        stock_new, opt_new, price_new = stock_old, opt_old, price_old
-
-    if (stock_old != stock_new) or (opt_old != opt_new) or (price_old != price_new):
-        logger.debug(
-            f"✅ {table} | {item_id} ({model}) → "
-            f"stock: {stock_old} → {stock_new}, "
-            f"opt: {opt_old} → {opt_new}, "
-            f"price: {price_old} → {price_new}"
-        )
-    # Принудительное обнуление "Нал", если статус "выкл."
-    if data.get('Статус', '').strip() == 'выкл.':
-        data['Нал'] = '0'
-    elif not global_stock_flags.get(table, True):
-        if 'Нал' in data:
-            del data['Нал']
 
-    # Удалить Sklad из обновляемых данных
+def apply_row_edits(market: str, edits: list[dict]) -> tuple[list[dict], list[dict]]:
+    """
+    Правки строк маркетплейса одной транзакцией: edits — [{"Sklad": ..., колонка: значение, ...}].
+    Цена пересчитывается из Опт/% (непереданные берутся из базы; нечисловые — цена не меняется, остальные
+    поля сохраняются); "Дата изменения" — только при изменениях.
+    Возвращает (результаты {"Sklad", "Нал", "Опт", "%", "Цена", "Статус", "Дата изменения", "changed"},
+    ошибки {"Sklad", "message"}).
+    """
+    market_enabled = global_stock_flags.get(market, True)
+    now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
+    results, errors = [], []
 
+    conn = sqlite3.connect(DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
     try:
-        opt = float(data.get('Опт', '0').replace(' ', '').replace('р.', ''))
-        markup = float(data.get('%', '0').replace(' ', '').replace('%', ''))
-        raw_price = opt + (opt * markup / 100)
-        price = int(round(raw_price / 100.0) * 100)
-        formatted_price = str(price)
+        columns = marketplace_columns(conn)
+        sklads = list(dict.fromkeys(str(e.get("Sklad", "")).strip() for e in edits))
+
+        # Чтение — под той же блокировкой, что и запись: пересчёт/импорт между ними сделал бы old_rows устаревшими
+        with locks.hold(market_key(market)):
+            old_rows = {}
+            for start in range(0, len(sklads), 500):
+                chunk = sklads[start:start + 500]
+                for row in conn.execute(
+                    f"SELECT * FROM marketplace WHERE Маркетплейс = ? AND Sklad IN ({', '.join('?' * len(chunk))})",
+                    (market, *chunk)
+                ):
+                    old_rows[row["Sklad"]] = dict(row)
+
+            for edit in edits:
+                sklad = str(edit.get("Sklad", "")).strip()
+                data = {
+                    k: (v.strip() if isinstance(v, str) else v)
+                    for k, v in edit.items() if k not in EDIT_READONLY_FIELDS
+                }
+                old_data = old_rows.get(sklad)
+                if old_data is None:
+                    logger.warning(f"⚠️ Товар с Sklad = {sklad} не найден.")
+                    errors.append({"Sklad": sklad, "message": "not found"})
+                    continue
+                unknown = [k for k in data if k not in columns]
+                if unknown:
+                    errors.append({"Sklad": sklad, "message": f"unknown columns: {', '.join(unknown)}"})
+                    continue
 
-        # Получаем список колонок таблицы
-        conn_check = sqlite3.connect(DB_PATH)
-        cur_check = conn_check.cursor()
-        cur_check.execute("PRAGMA table_info(marketplace)")
-        table_columns = [col[1] for col in cur_check.fetchall()]
-        conn_check.close()
+                if not market_enabled:
+                    logger.info(f"⚙️ Редактирование товара в выключенном маркетплейсе: {market}")
+                    data.pop('Нал', None)
+                # Принудительное обнуление "Нал", если статус "выкл."
+                if str(data.get('Статус', '')).strip() == 'выкл.':
+                    data['Нал'] = '0'
+
+                opt = parse_number(data.get('Опт', old_data.get('Опт')))
+                markup = parse_number(data.get('%', old_data.get('%')))
+                if opt is None or markup is None:
+                    # Как и раньше: цена не пересчитывается, остальные поля строки сохраняются
+                    logger.warning("❌ Невалидные данные в Опт/Наценка для пересчёта цены.")
+                else:
+                    data['Цена'] = str(calc_price(opt, markup))
+                    if '%' in data:
+                        data['%'] = str(int(markup))
+                    if 'Опт' in data:
+                        data['Опт'] = _number_text(opt)
+                if 'Нал' in data:
+                    stock = parse_number(data['Нал'])
+                    if stock is None:
+                        errors.append({"Sklad": sklad, "message": "Нал должен быть числом"})
+                        continue
+                    data['Нал'] = _number_text(stock)
+
+                changed = False
+                for field in EDIT_IMPORTANT_FIELDS:
+                    if field not in data:
+                        continue
+                    old_val = str(old_data.get(field) if old_data.get(field) is not None else "").strip()
+                    new_val = str(data[field]).strip()
+                    if field == "Нал" and str(old_data.get("Статус") or "").strip() == "выкл." and old_val == "0":
+                        # Разрешаем отличия в Нал, если товар выключен и Нал=0 — не считаем изменением
+                        new_val = "0"
+                    if old_val != new_val:
+                        changed = True
+                        break
+                if changed:
+                    data["Дата изменения"] = now_str
+
+                update_clause = ", ".join(f'"{col}" = ?' for col in data)
+                conn.execute(
+                    f"UPDATE marketplace SET {update_clause} WHERE Sklad = ? AND Маркетплейс = ?",
+                    [*data.values(), sklad, market]
+                )
 
-        data['Цена'] = formatted_price  # В новой структуре колонка 'Цена' всегда есть
+                new_data = {**old_data, **data}
+                old_rows[sklad] = new_data
+                if is_enabled("DEBUG"):  # строка на каждую правку — форматируем, только если DEBUG включён
+                    logger.debug(
+                        f"✅ {market} | {sklad} ({old_data.get('Модель', '—')}) → "
+                        f"stock: {old_data.get('Нал')} → {new_data.get('Нал')}, "
+                        f"opt: {old_data.get('Опт')} → {new_data.get('Опт')}, "
+                        f"price: {old_data.get('Цена')} → {new_data.get('Цена')}"
+                    )
+                old_status = str(old_data.get("Статус") or "").strip().lower()
+                new_status = str(new_data.get("Статус") or "").strip().lower()
+                if old_status != new_status:
+                    action = "🔴 ОТКЛЮЧЕН" if new_status == "выкл." else "🟢 ВКЛЮЧЕН"
+                    logger.info(f"{action}: {new_data.get('Модель')} ({sklad}) в таблице {market.upper()}")
+
+                results.append({
+                    "Sklad": sklad,
+                    **{k: _number_value(new_data.get(k)) for k in ("Нал", "Опт", "%", "Цена")},
+                    "Статус": new_data.get("Статус"),
+                    "Дата изменения": new_data.get("Дата изменения"),
+                    "changed": changed,
+                })
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
-        if '%' in data:
-            data['%'] = str(int(markup))
+    logger.success(f"✅ Успешно обновлено: {len(results)} строк в {market.upper()}, ошибок: {len(errors)}")
+    return results, errors
 
-    except ValueError:
-        logger.warning("❌ Невалидные данные в Опт/Наценка для пересчёта цены.")
-
-    # Ключевые поля, которые влияют на "Дата изменения"
-    important_fields = [
-        "Invask", "Okno", "United", "Модель", "Статус", "Нал", "Опт", "%", "Комментарий",
-        "Цена", "WB Артикул", "WB Barcode"
-    ]
-
-    # Подготовка к сравнению
-    changed = False
-    for field in important_fields:
-        old_val = str(old_data.get(field, "")).strip()
-        new_val = str(data.get(field, "")).strip()
-        if field == "Нал" and old_data.get("Статус", "").strip() == "выкл." and old_val == "0" and new_val != old_val:
-            # Разрешаем отличия в Нал, если товар выключен и Нал=0 — не считаем изменением
-            new_val = "0"
-        if old_val != new_val:
-            changed = True
-            break
-
-    if changed:
-        data["Дата изменения"] = datetime.now().strftime("%d.%m.%Y %H:%M")
 
-    columns = list(data.keys())
-    values = list(data.values())
-    update_clause = ", ".join([f'"{col}" = ?' for col in columns])
+@app.route('/update/<table>/<item_id>', methods=['POST'])
+def update_row(table, item_id):
+    data = request.form.to_dict()
+    data["Sklad"] = item_id
+    try:
+        results, errors = apply_row_edits(table, [data])
+    except Exception:
+        logger.exception("❌ Ошибка при обновлении:")
+        return '', 204
+    # Коды ответа — как раньше: 400 только для ненайденного товара, остальные ошибки строки — в лог
+    if any(e["message"] == "not found" for e in errors):
+        return '', 400
+    for e in errors:
+        logger.warning(f"⚠️ {table} | {e['Sklad']}: {e['message']}")
+    return '', 204
 
-    logger.debug(f"🧩 SQL запрос: UPDATE '{table}' SET {update_clause} WHERE \"Sklad\" = ?")
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+@app.route('/update_batch/<table>', methods=['POST'])
+@requires_auth
+def update_batch(table):
+    """
+    Несколько правок одним запросом: JSON [{"Sklad": ..., колонка: значение}, ...] (или {"rows": [...]}).
+    Ответ — пересчитанные Нал/Опт/%/Цена/Статус по каждой строке и ошибки по строкам.
+    """
+    if table not in MARKETS:
+        return jsonify({"status": "error", "message": "unknown market"}), 400
+    payload = request.get_json(silent=True)
+    edits = payload.get("rows") if isinstance(payload, dict) else payload
+    if not isinstance(edits, list) or not all(isinstance(e, dict) and e.get("Sklad") for e in edits):
+        return jsonify({"status": "error", "message": "expected [{Sklad: ..., column: value}]"}), 400
     try:
-        cursor.execute(
-            f"UPDATE marketplace SET {update_clause} WHERE Sklad = ? AND Маркетплейс = ?",
-            values + [item_id, table]
-        )
-        conn.commit()
-        logger.debug(f"🧾 Кол-во обновлённых строк: {cursor.rowcount}")
-        logger.success("✅ Успешно обновлено!")
+        results, errors = apply_row_edits(table, edits)
+    except Exception as e:
+        logger.exception("❌ Ошибка пакетного обновления")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "ok", "rows": results, "errors": errors}), 200
 
-        # 🔍 Проверяем смену статуса
-        cursor.execute("""
-            SELECT Статус, Модель
-              FROM marketplace
-             WHERE Sklad = ? AND LOWER(Маркетплейс) = LOWER(?)
-        """, (item_id, table))
-        row = cursor.fetchone()
-        if row:
-            new_status, model = row
-            old_status = old_data.get("Статус", "").strip().lower()
-            new_status = (new_status or "").strip().lower()
-            if old_status != new_status:
-                action = "🔴 ОТКЛЮЧЕН" if new_status == "выкл." else "🟢 ВКЛЮЧЕН"
-                logger.info(f"{action}: {model} ({item_id}) в таблице {table.upper()}")
 
+@app.route('/import/<table_name>', methods=['POST'])
+@requires_auth
+def import_items(table_name):
+    """
+    Массовая загрузка товаров: файл .csv/.xlsx в поле file, ?dry_run=1 — только проверка.
+    Новые Sklad добавляются, существующие обновляются; ответ — сводка с номерами строк ошибок/дубликатов.
+    """
+    if table_name not in MARKETS:
+        return jsonify({"status": "error", "message": "unknown market"}), 400
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        return jsonify({"status": "error", "message": "no file"}), 400
+    dry_run = request.args.get("dry_run") == "1"
+
+    conn = sqlite3.connect(DB_PATH, timeout=10)
+    try:
+        table_columns = [row[1] for row in conn.execute("PRAGMA table_info(marketplace)")]
+        columns, rows = catalog_import.read_rows(upload.stream, upload.filename)
+        prepared, errors = catalog_import.prepare_rows(columns, rows, table_name, table_columns)
+        with locks.hold(market_key(table_name)):
+            result = catalog_import.import_rows(
+                conn, table_name, prepared,
+                market_enabled=global_stock_flags.get(table_name, True),
+                dry_run=dry_run,
+            )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
-        logger.exception("❌ Ошибка при обновлении:")
+        logger.exception("❌ Ошибка массовой загрузки")
+        return jsonify({"status": "error", "message": str(e)}), 500
     finally:
         conn.close()
 
-    return '', 204
+    summary = (
+        f"добавлено {result['inserted']}, обновлено {result['updated']}, без изменений {result['unchanged']}, "
+        f"дубликатов {len(result['duplicates'])}, ошибок {len(errors)}"
+    )
+    if dry_run:
+        logger.info(f"🔍 Проверка загрузки в {table_name.upper()} ({upload.filename}): {summary}")
+    else:
+        logger.success(f"📥 Загрузка в {table_name.upper()} ({upload.filename}): {summary}")
+        if result["inserted"] or result["updated"]:
+            send_telegram_message(f"📥 {table_name.upper()}: загружен {upload.filename}\n{summary}")
+
+    return jsonify({
+        "status": "ok",
+        "dry_run": dry_run,
+        **{k: result[k] for k in ("inserted", "updated", "unchanged")},
+        "duplicates": [{"line": line, "reason": reason} for line, reason in result["duplicates"]],
+        "errors": [{"line": line, "reason": reason} for line, reason in errors],
+    }), 200
 
 
 @app.route('/bulk_markup/<market>', methods=['POST'])
@@ -1019,7 +1091,7 @@ def bulk_markup(market):
     except Exception:
         return Response("Bad delta", status=400)
 
-    if market not in ('yandex', 'ozon', 'wildberries'):
+    if market not in MARKETS:
         return Response("Bad market", status=400)
 
     # Если маркетплейс глобально выключен — меняем только наценку и цену, остатки не трогаем
@@ -1027,25 +1099,22 @@ def bulk_markup(market):
     now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
 
     conn = sqlite3.connect(DB_PATH)
+    register_sql_functions(conn)
     cur = conn.cursor()
 
     # Наценка хранится без знака %, Опт и Цена — числа/строки-числа.
-    # Обновляем наценку и сразу цену с округлением к сотне.
+    # Обновляем наценку и сразу цену функцией calc_price (то же округление, что в Python).
     try:
-        cur.execute("""
-            UPDATE marketplace
-               SET "%" = COALESCE(CAST("%" AS INTEGER), 0) + ?,
-                   Цена = CAST(
-                              ROUND(
-                                  (CAST(Опт AS FLOAT) + CAST(Опт AS FLOAT) * (COALESCE(CAST("%" AS INTEGER),0) + ?)/100.0)
-                                  / 100.0, 0
-                              ) * 100 AS INTEGER
-                          ),
-                   "Дата изменения" = ?
-             WHERE Маркетплейс = ?
-        """, (delta, delta, now_str, market))
-        conn.commit()
-        updated = cur.rowcount
+        with locks.hold(market_key(market)):
+            cur.execute("""
+                UPDATE marketplace
+                   SET "%" = COALESCE(CAST("%" AS INTEGER), 0) + ?,
+                       Цена = calc_price(Опт, COALESCE(CAST("%" AS INTEGER), 0) + ?),
+                       "Дата изменения" = ?
+                 WHERE Маркетплейс = ?
+            """, (delta, delta, now_str, market))
+            conn.commit()
+            updated = cur.rowcount
     except Exception as e:
         conn.rollback()
         logger.exception("❌ Ошибка массового изменения наценки")
@@ -1148,7 +1217,7 @@ def add_item(table_name):
             stock = 0
 
         data['Нал'] = str(stock)
-        price_ym = int(round((opt + (opt * markup / 100)) / 100.0) * 100)
+        price_ym = calc_price(opt, markup)
 
         data['Опт'] = str(opt)
         data['%'] = str(int(markup))
@@ -1186,114 +1255,262 @@ def add_item(table_name):
 @requires_auth
 def show_statistic():
     logger.info("📈 Открыта страница статистики")
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query(
-        "SELECT Sklad, Invask, Okno, United, Модель, Статус, Маркетплейс, Опт, Нал FROM marketplace",
-        conn
-    )
-    conn.close()
-
-    data = {}
-    supplier_stats = {
-        "Sklad": {"Yandex": 0, "Ozon": 0, "Wildberries": 0, "Всего": 0, "Активно": 0, "Неактивно": 0},
-        "Invask": {"Yandex": 0, "Ozon": 0, "Wildberries": 0, "Всего": 0, "Активно": 0, "Неактивно": 0},
-        "Okno": {"Yandex": 0, "Ozon": 0, "Wildberries": 0, "Всего": 0, "Активно": 0, "Неактивно": 0},
-        "United": {"Yandex": 0, "Ozon": 0, "Wildberries": 0, "Всего": 0, "Активно": 0, "Неактивно": 0},
-    }
-
-    for _, row in df.iterrows():
-        art_mc = row['Sklad']
-        status = (row.get('Статус') or '').strip().lower()
-        mp = row.get('Маркетплейс', '').capitalize()
-
-        if art_mc not in data:
-            data[art_mc] = {
-                'Sklad': art_mc,
-                'Модель': row.get('Модель', '')
-            }
-
-        # отмечаем наличие товара на маркетплейсе
-        data[art_mc][mp] = True
-        if status == 'выкл.':
-            data[art_mc][f'Статус_{mp}'] = 'выкл.'
-
-        # обновляем статистику по каждому поставщику
-        for sup in ["Sklad", "Invask", "Okno", "United"]:
-            if sup == "Sklad":
-                cond = (not row['Invask'] and not row['Okno'] and not row['United'] and row['Sklad'])
-            else:
-                cond = bool(row[sup])
-
-            if cond:
-                supplier_stats[sup][mp] += 1
-                supplier_stats[sup]['Всего'] += 1
-                if status == 'выкл.':
-                    supplier_stats[sup]['Неактивно'] += 1
-                else:
-                    supplier_stats[sup]['Активно'] += 1
-
+    stats_data, supplier_stats = statistic_cache.get("statistic", _compute_statistic)
     errors = detect_errors_across_marketplaces()
 
     return render_template(
         "statistic.html",
-        stats_data=list(data.values()),
+        stats_data=stats_data,
         supplier_stats=supplier_stats,
         errors=errors
     )
 
 
+STAT_MARKETS = {"yandex": "Yandex", "ozon": "Ozon", "wildberries": "Wildberries"}
+
 
+def _status_off(value) -> int:
+    return int(str(value or '').strip().lower() == 'выкл.')
+
+
+def _compute_statistic():
+    """Статистика по поставщикам и матрица размещения SKU — агрегатами SQL за два прохода по таблице."""
+    conn = sqlite3.connect(DB_PATH, timeout=10)
+    conn.create_function("status_off", 1, _status_off, deterministic=True)
+    try:
+        # Условия «товар относится к поставщику» — из реестра (как в интерфейсе)
+        conditions = supplier_conditions(conn)
+        sums = ",\n".join(
+            f"SUM(CASE WHEN {cond} THEN 1 ELSE 0 END) AS \"{sup}_total\", "
+            f"SUM(CASE WHEN {cond} THEN status_off(Статус) ELSE 0 END) AS \"{sup}_off\""
+            for sup, (cond, _) in conditions.items()
+        )
+        params = [p for cond, cond_params in conditions.values() for p in cond_params * 2]
+        cur = conn.execute(f"""
+            SELECT LOWER(Маркетплейс) AS mp, {sums}
+              FROM marketplace
+             GROUP BY LOWER(Маркетплейс)
+        """, params)
+        columns = [d[0] for d in cur.description]
+        per_market = cur.fetchall()
+
+        presence = ",\n".join(
+            f"MAX(LOWER(Маркетплейс) = '{mp}') AS \"{label}\", "
+            f"MAX(LOWER(Маркетплейс) = '{mp}' AND status_off(Статус)) AS \"off_{label}\""
+            for mp, label in STAT_MARKETS.items()
+        )
+        # Модель берётся из первой строки SKU
+        matrix = conn.execute(f"""
+            SELECT g.art, m.Модель, g.*
+              FROM (
+                    SELECT MIN(rowid) AS first_id, Sklad AS art, {presence}
+                      FROM marketplace
+                     GROUP BY Sklad
+                   ) g
+              JOIN marketplace m ON m.rowid = g.first_id
+             ORDER BY g.first_id
+        """).fetchall()
+    finally:
+        conn.close()
+
+    supplier_stats = {
+        sup: {"Yandex": 0, "Ozon": 0, "Wildberries": 0, "Всего": 0, "Активно": 0, "Неактивно": 0}
+        for sup in conditions
+    }
+    for row in per_market:
+        r = dict(zip(columns, row))
+        label = STAT_MARKETS.get(r["mp"])
+        if label is None:
+            continue
+        for sup, stats in supplier_stats.items():
+            total, off = int(r[f"{sup}_total"] or 0), int(r[f"{sup}_off"] or 0)
+            stats[label] += total
+            stats["Всего"] += total
+            stats["Неактивно"] += off
+            stats["Активно"] += total - off
+
+    stats_data = []
+    for art_mc, model, _first_id, _art, *flags in matrix:
+        item = {'Sklad': art_mc, 'Модель': model}
+        for i, label in enumerate(STAT_MARKETS.values()):
+            present, off = flags[2 * i], flags[2 * i + 1]
+            if present:
+                item[label] = True
+            if off:
+                item[f'Статус_{label}'] = 'выкл.'
+        stats_data.append(item)
+
+    return stats_data, supplier_stats
 
 
 def has_error_products():
     errors = detect_errors_across_marketplaces()
     return len(errors) > 0
 
+
+# Поля, расхождение которых между маркетплейсами считаем ошибкой
+ERROR_FIELDS = ["Sklad", "Invask", "Okno", "United", "Модель"]
+
+
 def detect_errors_across_marketplaces():
-    import sqlite3
-    import pandas as pd
+    """Расхождения между маркетплейсами; пересчитываются только при изменении данных marketplace."""
+    return marketplace_cache.get("errors", _detect_errors_uncached)
 
-    db_path = "System/marketplace_base.db"
-    conn = sqlite3.connect(db_path, timeout=10)
-    df = pd.read_sql_query("SELECT * FROM marketplace", conn)
-    conn.close()
 
-    df["Маркетплейс"] = df["Маркетплейс"].str.capitalize()
+def _detect_errors_uncached():
+    # Сравнение как str(value): NULL и пустая строка — разные значения
+    distinct = ",\n".join(
+        'COUNT(DISTINCT IFNULL(CAST("{0}" AS TEXT), \'None\')) > 1 AS "d_{0}"'.format(f) for f in ERROR_FIELDS
+    )
+    any_diff = " OR ".join(f'"d_{f}"' for f in ERROR_FIELDS)
+
+    conn = sqlite3.connect(DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(f"""
+            WITH groups AS (
+                SELECT Sklad, COUNT(*) AS cnt,
+                       {distinct}
+                  FROM marketplace
+                 WHERE Sklad IS NOT NULL
+                 GROUP BY Sklad
+            )
+            SELECT m.Маркетплейс, m.Sklad, m.Invask, m.Okno, m.United, m.Модель, m.Статус, m.Нал, m.Опт,
+                   {", ".join(f'g."d_{f}"' for f in ERROR_FIELDS)}
+              FROM groups g
+              JOIN marketplace m ON m.Sklad = g.Sklad
+             WHERE g.cnt > 1 AND ({any_diff})
+             ORDER BY m.Sklad, m.rowid
+        """).fetchall()
+    finally:
+        conn.close()
 
     errors = []
-    # 👇 теперь проверяем и Sklad как поле
-    fields_to_check = ["Sklad", "Invask", "Okno", "United", "Модель"]
+    for r in rows:
+        diff = {f: bool(r[f"d_{f}"]) for f in ERROR_FIELDS}
+        diff["Нал"] = False
+        diff["Опт"] = False
+        errors.append({
+            "Маркетплейс": (r["Маркетплейс"] or "").capitalize(),
+            "Sklad": r["Sklad"],
+            "Invask": r["Invask"],
+            "Okno": r["Okno"],
+            "United": r["United"],
+            "Модель": r["Модель"],
+            "Статус": r["Статус"],
+            "Нал": r["Нал"],
+            "Опт": r["Опт"],
+            "diff": diff
+        })
+    return errors
 
-    for art_mc, group in df.groupby("Sklad"):
-        if len(group) <= 1:
-            continue
 
-        values_by_field = {field: set(group[field].astype(str).fillna("")) for field in fields_to_check}
+# Таблицы, по которым доступен журнал изменений: имя → (база, таблица)
+CHANGE_FEEDS = {
+    "marketplace": (DB_PATH, "marketplace"),
+    "prices": (SUP_DB_PATH, "prices"),
+}
 
-        has_diff = any(len(values) > 1 for values in values_by_field.values())
-        if not has_diff:
-            continue
 
-        for _, row in group.iterrows():
-            row_dict = row.to_dict()
-            diff = {field: len(values_by_field[field]) > 1 for field in fields_to_check}
-            diff["Нал"] = False
-            diff["Опт"] = False
-
-            errors.append({
-                "Маркетплейс": row_dict.get("Маркетплейс", ""),
-                "Sklad": row_dict.get("Sklad", ""),
-                "Invask": row_dict.get("Invask", ""),
-                "Okno": row_dict.get("Okno", ""),
-                "United": row_dict.get("United", ""),
-                "Модель": row_dict.get("Модель", ""),
-                "Статус": row_dict.get("Статус", ""),
-                "Нал": row_dict.get("Нал", ""),
-                "Опт": row_dict.get("Опт", ""),
-                "diff": diff
-            })
+def install_change_tracking():
+    for path, table in CHANGE_FEEDS.values():
+        try:
+            conn = sqlite3.connect(path, timeout=10)
+            ensure_version_tracking(conn, table)
+            conn.close()
+        except Exception as e:
+            logger.warning(f"❌ Журнал изменений для {table} не включён: {e}")
 
-    return errors
+
+def install_marketplace_indexes():
+    """Индексы marketplace для массовой загрузки (services.catalog_import) — при старте, вне транзакций загрузки."""
+    try:
+        conn = sqlite3.connect(DB_PATH, timeout=10)
+        catalog_import.ensure_indexes(conn)
+        conn.close()
+    except Exception as e:
+        logger.warning(f"❌ Индексы marketplace не созданы: {e}")
+
+
+@app.route('/changes/<feed>')
+@requires_auth
+def show_changes(feed):
+    """Изменения таблицы после версии ?since=N: [{row_id, op, version}], либо complete=false (журнал обрезан)."""
+    if feed not in CHANGE_FEEDS:
+        return jsonify({"status": "error", "message": "unknown table"}), 400
+    try:
+        since = int(request.args.get("since", "0"))
+    except ValueError:
+        return jsonify({"status": "error", "message": "bad since"}), 400
+
+    path, table = CHANGE_FEEDS[feed]
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        result = changes_since(conn, table, since)
+    finally:
+        conn.close()
+
+    return jsonify({
+        "version": result.version,
+        "complete": result.complete,
+        "changes": [{"row_id": r, "op": op, "version": v} for r, op, v in result.changes],
+    }), 200
+
+
+@app.route('/lock_metrics')
+@requires_auth
+def lock_metrics():
+    """Статистика блокировок: сколько ждали захвата и сколько держали (секунды)."""
+    return jsonify(locks.metrics()), 200
+
+
+@app.route('/metrics')
+def metrics_text():
+    """Метрики процесса в текстовом формате Prometheus: после входа или с токеном METRICS_TOKEN."""
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    )
+    if not (token_ok or session.get('logged_in')):
+        return "Unauthorized", 401
+    return Response(metrics.render(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+@app.route('/metrics/dashboard')
+@requires_auth
+def metrics_dashboard():
+    """Длительности по последним замерам: p50 / p90 / p99, среднее и максимум."""
+    return render_template("metrics.html", rows=metrics.summary())
+
+
+# Периодические задачи: без наложения запусков, с историей длительностей (scheduler/jobs.py)
+job_registry = JobRegistry(alert=send_telegram_message)
+
+
+def register_jobs(registry: JobRegistry):
+    registry.add("update_sklad", update_sklad_job, "interval", minutes=5, jitter=15,
+                 name="Обновление склада")
+    # Тик раз в минуту; сам список акций запрашивается адаптивно (ozon_actions.ActionsWatcher),
+    # период для контроля перерасхода — максимальный интервал проверки
+    registry.add("ozon_actions", actions_watcher.tick, "interval", minutes=1,
+                 interval_seconds=actions_watcher.max_interval, name="Проверка акций Ozon")
+    registry.add("backup", backup_database, "cron", hour=2, interval_seconds=24 * 3600,
+                 name="Бэкап базы")  # каждый день в 2 ночи
+    registry.add("suppliers_off", set_suppliers_state_if_needed, "cron",
+                 day_of_week='fri', hour=1, minute=0, args=[False],
+                 name="CRON: выключение поставщиков")
+    registry.add("suppliers_on", set_suppliers_state_if_needed, "cron",
+                 day_of_week='sun', hour=15, minute=0, args=[True],
+                 name="CRON: включение поставщиков")
+
+
+@app.route('/scheduler/jobs')
+@requires_auth
+def scheduler_jobs():
+    """Задачи планировщика: запуски, пропуски, ошибки и история длительностей (секунды)."""
+    jobs = job_registry.stats()
+    if "ozon_actions" in jobs:
+        jobs["ozon_actions"]["watcher"] = actions_watcher.status()
+    return jsonify(jobs), 200
 
 
 @app.errorhandler(Exception)
@@ -1301,161 +1518,91 @@ def handle_error(e):
     logger.exception(f"💥 Ошибка: {str(e)}")
     return "Произошла ошибка на сервере", 500
 
+@app.route('/export/<table_name>')
+@requires_auth
+def export_table(table_name):
+    """
+    Выгрузка yandex / ozon / wildberries / prices: ?format=csv (по умолчанию, потоком) или xlsx,
+    ?columns=Sklad,Нал — выбор колонок, остальные параметры — фильтры ?Статус=Вкл. (можно повторять).
+    """
+    fmt = request.args.get("format", "csv").lower()
+    if fmt not in ("xlsx", "csv"):
+        return jsonify({"status": "error", "message": "unknown format"}), 400
+    columns = [c.strip() for c in request.args.get("columns", "").split(",") if c.strip()] or None
+    filters = {k: request.args.getlist(k) for k in request.args if k not in ("format", "columns")}
+    try:
+        columns, rows = table_rows(table_name, columns, filters)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    filename = f"{table_name}_{datetime.now():%Y-%m-%d_%H-%M}.{fmt}"
+    logger.info(f"📤 Выгрузка {table_name} ({fmt}), колонок: {len(columns)}, фильтры: {filters or '—'}")
+    if fmt == "csv":
+        return Response(
+            stream_with_context(iter_csv(columns, rows)),
+            mimetype=CSV_MIMETYPE,
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+    return send_file(write_xlsx(columns, rows, sheet_name=table_name), as_attachment=True,
+                     download_name=filename, mimetype=XLSX_MIMETYPE)
+
+
 @app.route('/download_unlisted')
 @requires_auth
 def download_unlisted():
+    """Новые товары поставщиков: ?format=xlsx (по умолчанию) или csv (отдаётся потоком)."""
+    fmt = request.args.get("format", "xlsx").lower()
+    if fmt not in ("xlsx", "csv"):
+        return Response("Неизвестный формат", status=400)
     try:
-        df = generate_unlisted()
-        if df.empty:
+        columns, rows = unlisted_rows()
+        first = next(rows, None)
+        if first is None:
             return Response("Нет новых товаров", status=404)
+        rows = chain([first], rows)
 
-        # Сохраняем в Excel в памяти
-        output = BytesIO()
-        df.to_excel(output, index=False)
-        output.seek(0)
+        if fmt == "csv":
+            return Response(
+                stream_with_context(iter_csv(columns, rows)),
+                mimetype=CSV_MIMETYPE,
+                headers={"Content-Disposition": "attachment; filename=new_products.csv"},
+            )
 
         return send_file(
-            output,
+            write_xlsx(columns, rows),
             as_attachment=True,
             download_name="new_products.xlsx",
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mimetype=XLSX_MIMETYPE
         )
     except Exception as e:
         logger.exception("❌ Ошибка при формировании списка новых товаров")
         return Response("Ошибка при формировании файла", status=500)
 
 def recompute_marketplace_core(market: str) -> int:
-    # если маркетплейс выключен - не трогаем остатки
-    if not global_stock_flags.get(market, True):
-        logger.info(f"⏭ {market.upper()} выключен → пересчёт пропущен, нули сохраняем")
-        return
-    """Чистый пересчёт без Flask-контекста. Возвращает кол-во обновлённых строк."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-
-    rows = cur.execute("""
-        SELECT rowid, Sklad, Invask, Okno, United,
-               "%", Цена, Опт, Нал, Статус, Модель
-          FROM marketplace
-         WHERE Маркетплейс = ?
-    """, (market,)).fetchall()
-
-    updated = 0
-    for r in rows:
-        row = dict(r)
-        chosen_sup, nal, opt = choose_best_supplier_for_row(row, conn, use_row_sklad=True)
-        # logger.debug(
-        #     f"🔎 {market.upper()} | {row.get('Модель', '—')} | Sklad={row.get('Sklad', '')}, "
-        #     f"Invask={row.get('Invask', '')}, Okno={row.get('Okno', '')}, United={row.get('United', '')} "
-        #     f"→ chosen={chosen_sup} nal={nal} opt={opt}"
-        # )
-
-        if chosen_sup == '':
-            new_nal = 0
-            new_opt = row.get('Опт')
-        else:
-            new_nal = int(nal or 0)
-            new_opt = opt if opt is not None else row.get('Опт')
-
-        try:
-            markup = float(str(row.get('%', '0')).replace('%', '').replace(' ', ''))
-        except:
-            markup = 0.0
-
-            # Выключенный товар всегда с Нал = 0
-        if str(row.get('Статус', '')).strip().lower() == 'выкл.':
-            new_nal = 0
-
-            # 🚫 Заморозка: при Нал=0 НЕ трогаем Опт/Цена
-        freeze_price = int(new_nal or 0) == 0
-
-        new_price = None
-        if not freeze_price and (new_opt is not None):
-            try:
-                base_opt = float(str(new_opt).replace(' ', '').replace('р.', ''))
-                new_price = int(round((base_opt + (base_opt * markup / 100.0)) / 100.0) * 100)
-            except Exception:
-                new_price = None
-
-        changed = False
-        sets, vals = [], []
-
-        if int(row.get('Нал') or 0) != int(new_nal):
-            sets.append('Нал = ?'); vals.append(int(new_nal)); changed = True
-
-        try:
-            cur_opt = float(str(row.get('Опт') or '0').replace(' ', '').replace('р.', ''))
-        except:
-            cur_opt = None
-        if (not freeze_price) and (new_opt is not None):
-            try:
-                new_opt_f = float(new_opt)
-            except:
-                new_opt_f = cur_opt
-            if cur_opt is None or (new_opt_f is not None and new_opt_f != cur_opt):
-                sets.append('Опт = ?');
-                vals.append(new_opt_f);
-                changed = True
-
-        try:
-            cur_price = int(str(row.get('Цена') or '0').replace(' ', '').replace('р.', ''))
-        except:
-            cur_price = 0
-        if new_price is not None and new_price != cur_price:
-            sets.append('Цена = ?')
-            vals.append(int(new_price))
-            changed = True
-
-        if changed:
-            sets.append('"Дата изменения" = ?'); vals.append(datetime.now().strftime("%d.%m.%Y %H:%M"))
-            vals.append(r['rowid'])
-            cur.execute(f"UPDATE marketplace SET {', '.join(sets)} WHERE rowid = ?", vals)
-            updated += 1
-
-    conn.commit()
-    conn.close()
-
-    total_rows = len(rows)
-    logger.info(f"📊 {market.upper()}: обработано {total_rows} строк, изменено {updated}")
-    logger.success(f"✅ Пересчёт завершён для {market.upper()}")
-    return updated
+    """Чистый пересчёт без Flask-контекста (services.stock_service). Возвращает кол-во обновлённых строк."""
+    return recompute_market(market, global_stock_flags, DB_PATH)
 
 @app.route('/recompute/<market>', methods=['POST', 'GET'])
 @requires_auth
 def recompute_marketplace(market):
-    updated = recompute_marketplace_core(market)
+    # Неизвестный маркетплейс — не пересчёт впустую и не новый ключ блокировки
+    if market_key(market) not in ALL_MARKET_KEYS:
+        return Response("Unknown market", status=404)
+    with locks.hold(market_key(market)):
+        updated = recompute_marketplace_core(market)
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return '', 204
     return redirect(url_for('show_table', table_name=market))
 
 
 if __name__ == '__main__':
+    install_change_tracking()
+    install_marketplace_indexes()
     if not os.environ.get("WERKZEUG_RUN_MAIN"):  # предотвращает двойной запуск задач
         scheduler = BackgroundScheduler()
-        scheduler.add_job(update_sklad_task, 'interval', minutes=5)
-        scheduler.add_job(remove_all_products_from_all_actions, 'interval', minutes=10)  # Проверка Акций Озон
-        scheduler.add_job(backup_database, 'cron', hour=2)  # каждый день в 2 ночи
-        for supplier in CRON_SUPPLIERS:
-            scheduler.add_job(
-                set_supplier_state_if_needed,
-                'cron',
-                day_of_week='fri',
-                hour=1,
-                minute=0,
-                args=[supplier, False]
-            )
-
-            scheduler.add_job(
-                set_supplier_state_if_needed,
-                'cron',
-                day_of_week='sun',
-                hour=15,
-                minute=0,
-                args=[supplier, True]
-            )
+        register_jobs(job_registry)
+        job_registry.install(scheduler)
         scheduler.start()
         logger.info("📅 Планировщик запущен (обновление склада каждые 5 минут)")
     logger.info("🚀 Приложение запущено")
     app.run(host="127.0.0.1", port=5050, debug=False, use_reloader=False)
-